@@ -0,0 +1,1011 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Native encoder and decoder for GeneralPlus A1800 (.a18) audio.
+
+A1800 is the codec used for the tracks in a DLC's AMF section. It is a
+member of the G.722.1 / Siren family: 16 kHz mono audio is cut into 20 ms
+frames of 320 samples, each frame is transformed with a modulated lapped
+transform (MLT), and the lower 14 regions of 20 coefficients are coded as
+a region power envelope followed by Huffman-coded, vector-quantized
+coefficients. Every frame takes exactly bitrate / 50 bits.
+
+An a18 file (or AMF track) looks like this:
+
+    [optional 0x30-byte "GENERALPLUS SP" file header]
+    uint32  number of bytes that follow (including the next word)
+    uint16  bitrate in bits per second (0x3e80 = 16000)
+    frames  each bitrate / 400 bytes, read as little-endian 16-bit
+            words with the most significant bit first
+
+The decoder needs the codec's Huffman code tables and quantizer
+centroids. These are the G.722.1 reference tables. They aren't in this
+repository; generate them from the ITU-T G.722.1 reference source code
+(which is freely available from the ITU) with
+
+    python a1800.py --make-tables path/to/g7221/source -t a1800_tables.json
+
+which reads the arrays out of its .c files (see
+tables_from_reference()). The file is looked up at the path given, then
+$A1800_TABLES, then ./a1800_tables.json, and holds these keys, named
+after the arrays in the reference code:
+
+    differential_region_power_bits   13 lists of 24 code lengths
+    differential_region_power_codes  13 lists of 24 codes
+    mlt_sqvh_bitcount                7 lists (one per category) of code lengths
+    mlt_sqvh_code                    7 lists of codes, indexed by vector index
+    mlt_quant_centroid               7 lists of centroids, indexed by bin
+
+Everything else (framing, envelope and categorization, vector
+quantization, noise fill and the MLT) is implemented here. The MLT, the
+envelope and the quantization of every region at every category run over
+all the frames of a track at once; only choosing each frame's
+categorization and packing its bits is done frame by frame.
+
+It is checked against a1800.dll by the codec-reference CI workflow,
+which generates the tables, decodes the .a18 files in audio/new_audio
+with the DLL (audioutils/make_a1800_reference.py writes each one next to
+its .a18 as <name>.dll.wav) and runs test_furby.TestA1800Reference. The
+DLL and tables can't be committed, so the workflow needs them configured
+(see .github/workflows/codec-reference.yml); the same test runs locally
+wherever both are present. Until that check passes, use the DLL for
+anything that goes onto a real Furby.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import struct
+import subprocess
+import sys
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = 320
+DEFAULT_BITRATE = 16000
+
+A18_HEADER = b"\x00\xff\x00\xffGENERALPLUS SP\x00\x00"
+A18_HEADER_LENGTH = 0x30
+
+DEFAULT_TABLES_PATH = "a1800_tables.json"
+
+# Bump whenever a change to the encoder changes its output.
+ENCODER_VERSION = 1
+
+NUMBER_OF_REGIONS = 14
+REGION_SIZE = 20
+NUM_CATEGORIES = 8
+NUM_CATEGORIZATION_CONTROL_BITS = 4
+NUM_CATEGORIZATION_CONTROL_POSSIBILITIES = 16
+REGION_POWER_BITS = 5
+ESF_ADJUSTMENT_TO_RMS_INDEX = 7
+DRP_DIFF_MIN = -12
+DRP_DIFF_MAX = 11
+MIN_RMS_INDEX = -8
+MAX_RMS_INDEX = 31
+
+# Per category (0-6; category 7 carries no bits and is filled with noise.)
+VECTOR_DIMENSION = (2, 2, 2, 4, 4, 5, 5)
+NUMBER_OF_VECTORS = (10, 10, 10, 5, 5, 4, 4)
+MAX_BIN = (13, 9, 6, 4, 3, 2, 1)
+EXPECTED_BITS_TABLE = (52, 47, 43, 37, 29, 22, 16, 0)
+
+# Encoder quantizer step sizes and dead zones, per category.
+STEP_SIZE = (0.3536, 0.5, 0.7071, 1.0, 1.4142, 2.0, 2.8284)
+DEAD_ZONE = (0.3, 0.33, 0.36, 0.39, 0.42, 0.45, 0.5)
+
+# Relative level of the noise used for coefficients quantized to zero.
+NOISE_FILL_FACTOR = {5: 0.17678, 6: 0.25, 7: 0.70711}
+
+# The fixed-point reference code stores centroids in Q12.
+CENTROID_Q = 12
+
+
+class OutOfBits(Exception):
+    """
+    Raised internally when a frame's bits run out mid-vector, or hold a
+    code that isn't in the tables. Either way the rest of the frame is
+    filled with noise.
+    """
+
+
+class A1800Tables(object):
+    """
+    Huffman code tables and centroids for the A1800 codec.
+
+    Codes are given as (code, length) pairs, as in the G.722.1 reference
+    code; they're turned into lookup dictionaries keyed by (length, code).
+    """
+
+    def __init__(self, region_power_bits, region_power_codes, vector_bits, vector_codes, centroids):
+
+        # Some transcriptions carry an unused row for region 0.
+        if len(region_power_bits) == NUMBER_OF_REGIONS:
+            region_power_bits = region_power_bits[1:]
+            region_power_codes = region_power_codes[1:]
+
+        if (len(region_power_bits) != NUMBER_OF_REGIONS - 1) or (len(region_power_codes) != NUMBER_OF_REGIONS - 1):
+            raise ValueError("Expected %d region power tables." % (NUMBER_OF_REGIONS - 1))
+
+        num_diffs = DRP_DIFF_MAX - DRP_DIFF_MIN + 1
+        self.region_power_codes = []
+        self.region_power_lengths = []
+        self.region_power_decoders = []
+        for bits, codes in zip(region_power_bits, region_power_codes):
+            if (len(bits) != num_diffs) or (len(codes) != num_diffs):
+                raise ValueError("Region power tables need %d entries each." % num_diffs)
+            self.region_power_codes.append(list(zip(codes, bits)))
+            self.region_power_lengths.append(bits)
+            self.region_power_decoders.append(self._decoder(codes, bits))
+
+        if (len(vector_bits) < len(MAX_BIN)) or (len(vector_codes) < len(MAX_BIN)) or (len(centroids) < len(MAX_BIN)):
+            raise ValueError("Expected vector tables and centroids for %d categories." % len(MAX_BIN))
+
+        self.vector_codes = []
+        self.vector_lengths = []
+        self.vector_decoders = []
+        self.centroids = []
+        for category in range(len(MAX_BIN)):
+            num_indices = (MAX_BIN[category] + 1) ** VECTOR_DIMENSION[category]
+            bits = vector_bits[category]
+            codes = vector_codes[category]
+            if (len(bits) < num_indices) or (len(codes) < num_indices):
+                raise ValueError("Category %d needs %d vector codes." % (category, num_indices))
+            if len(centroids[category]) < MAX_BIN[category] + 1:
+                raise ValueError("Category %d needs %d centroids." % (category, MAX_BIN[category] + 1))
+            self.vector_codes.append(list(zip(codes[:num_indices], bits[:num_indices])))
+            self.vector_lengths.append(np.asarray(bits[:num_indices], dtype=np.int64))
+            self.vector_decoders.append(self._decoder(codes[:num_indices], bits[:num_indices]))
+            self.centroids.append(np.asarray(centroids[category][:MAX_BIN[category] + 1], dtype=np.float64))
+
+        # Identifies these tables in cache keys.
+        contents = [self.region_power_codes, self.vector_codes, [c.tolist() for c in self.centroids]]
+        self.fingerprint = hashlib.sha256(json.dumps(contents).encode("ascii")).hexdigest()
+
+    @staticmethod
+    def _decoder(codes, bits):
+
+        decoder = {}
+        for value, (code, length) in enumerate(zip(codes, bits)):
+            if (length <= 0) or (code >> length):
+                raise ValueError("Code %d does not fit in %d bits." % (code, length))
+            if (length, code) in decoder:
+                raise ValueError("Duplicate code %d (%d bits)." % (code, length))
+            decoder[(length, code)] = value
+
+        # A prefix code is needed for the bit-by-bit lookup to be unambiguous.
+        for (length, code) in decoder:
+            for shorter in range(1, length):
+                if (shorter, code >> (length - shorter)) in decoder:
+                    raise ValueError("Code %d (%d bits) is not prefix-free." % (code, length))
+
+        decoder["max_length"] = max(bits)
+        return decoder
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["differential_region_power_bits"],
+            data["differential_region_power_codes"],
+            data["mlt_sqvh_bitcount"],
+            data["mlt_sqvh_code"],
+            data["mlt_quant_centroid"],
+        )
+
+
+_tables_cache = {}
+
+
+def load_tables(path=None):
+    """
+    Load (and cache) the codec tables.
+
+    Args:
+        path: Path to the JSON table file (default: $A1800_TABLES, then
+              ./a1800_tables.json)
+
+    Returns:
+        A1800Tables
+    """
+    if path is None:
+        path = os.environ.get("A1800_TABLES", DEFAULT_TABLES_PATH)
+
+    path = os.path.abspath(path)
+    if path not in _tables_cache:
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                "A1800 codec tables not found at %s. Generate them from the "
+                "G.722.1 reference code with 'python a1800.py --make-tables SOURCE_DIR' "
+                "and pass their path or set $A1800_TABLES." % path
+            )
+        with open(path, "r") as f:
+            _tables_cache[path] = A1800Tables.from_dict(json.load(f))
+
+    return _tables_cache[path]
+
+
+def _c_arrays(source):
+    """Every initialized array in C source, by name, as nested lists of numbers."""
+    source = re.sub(r"/\*.*?\*/|//[^\n]*", "", source, flags=re.S)
+    number = re.compile(r"0[xX][0-9a-fA-F]+|[-+]?\d+\.?\d*(?:[eE][-+]?\d+)?")
+
+    def value(text):
+        if text.lower().startswith("0x"):
+            return int(text, 16)
+        return float(text) if any(c in text for c in ".eE") else int(text)
+
+    arrays = {}
+    for match in re.finditer(r"(\w+)\s*(?:\[[^\]]*\]\s*)+=\s*\{(.*?)\}\s*;", source, flags=re.S):
+        body = match.group(2)
+        rows = re.findall(r"\{([^{}]*)\}", body)
+        if rows:
+            arrays[match.group(1)] = [[value(n) for n in number.findall(row)] for row in rows]
+        else:
+            arrays[match.group(1)] = [value(n) for n in number.findall(body)]
+    return arrays
+
+
+def tables_from_reference(source_dir):
+    """
+    Generate the codec tables from the G.722.1 reference source code.
+
+    Args:
+        source_dir: Directory holding the reference code's .c files
+                    (searched recursively)
+
+    Returns:
+        dict in the table file's format (see A1800Tables.from_dict())
+    """
+    arrays = {}
+    for path in sorted(glob.glob(os.path.join(source_dir, "**", "*.c"), recursive=True)):
+        with open(path, "r", errors="replace") as f:
+            arrays.update(_c_arrays(f.read()))
+
+    def array(name):
+        if name not in arrays:
+            raise ValueError("No %s array in the reference code under %s." % (name, source_dir))
+        return arrays[name]
+
+    categories = range(len(MAX_BIN))
+    centroids = array("mlt_quant_centroid")
+    if all(isinstance(c, int) for row in centroids for c in row):
+        centroids = [[c / float(1 << CENTROID_Q) for c in row] for row in centroids]
+
+    # The reference code has rows for up to 28 regions (for G.722.1 Annex C);
+    # only the first NUMBER_OF_REGIONS are used here.
+    return {
+        "differential_region_power_bits": array("differential_region_power_bits")[:NUMBER_OF_REGIONS],
+        "differential_region_power_codes": array("differential_region_power_codes")[:NUMBER_OF_REGIONS],
+        "mlt_sqvh_bitcount": [array("mlt_sqvh_bitcount_category_%d" % c) for c in categories],
+        "mlt_sqvh_code": [array("mlt_sqvh_code_category_%d" % c) for c in categories],
+        "mlt_quant_centroid": centroids[:len(MAX_BIN)],
+    }
+
+
+def _resolve_tables(tables):
+    if isinstance(tables, A1800Tables):
+        return tables
+    return load_tables(tables)
+
+
+def parse_track(data):
+    """
+    Split an a18 file or AMF track into its bitrate and frames.
+
+    Args:
+        data: bytes-like contents of an .a18 file (with or without the
+              GeneralPlus header) or an AMF track
+
+    Returns:
+        (bitrate, frames) where frames is a (num_frames, words_per_frame)
+        uint16 array. A partial frame at the end is ignored.
+    """
+    data = memoryview(data)
+    if bytes(data[:len(A18_HEADER)]) == A18_HEADER:
+        data = data[A18_HEADER_LENGTH:]
+
+    if len(data) < 6:
+        raise ValueError("Track is too short to hold an a18 header.")
+
+    length, bitrate = struct.unpack_from("<IH", data)
+    frame_bytes = frame_size(bitrate)
+
+    payload = data[6:4 + length]
+    usable = (len(payload) // frame_bytes) * frame_bytes
+    frames = np.frombuffer(payload[:usable], dtype="<u2").reshape(-1, frame_bytes // 2)
+
+    return bitrate, frames
+
+
+def frame_size(bitrate):
+    """Bytes per 20 ms frame at the given bitrate."""
+    frame_bytes, leftover = divmod(bitrate, 400)
+    if (frame_bytes == 0) or leftover or (frame_bytes % 2):
+        raise ValueError("Unsupported a18 bitrate %d." % bitrate)
+    return frame_bytes
+
+
+def _frame_bits(frames):
+    """Unpack frames of 16-bit words into rows of bits, MSB first."""
+    shifts = np.arange(15, -1, -1, dtype=np.uint16)
+    return ((frames[:, :, None] >> shifts) & 1).reshape(frames.shape[0], -1).astype(np.uint8)
+
+
+class _BitReader(object):
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.pos = 0
+
+    def remaining(self):
+        return len(self.bits) - self.pos
+
+    def read(self, count):
+        if count > self.remaining():
+            raise OutOfBits()
+        value = 0
+        for bit in self.bits[self.pos:self.pos + count]:
+            value = (value << 1) | bit
+        self.pos += count
+        return value
+
+    def read_code(self, decoder):
+        code = 0
+        for length in range(1, decoder["max_length"] + 1):
+            if self.pos >= len(self.bits):
+                raise OutOfBits()
+            code = (code << 1) | self.bits[self.pos]
+            self.pos += 1
+            if (length, code) in decoder:
+                return decoder[(length, code)]
+        raise OutOfBits()
+
+
+def categorize(available_bits, rms_index):
+    """
+    Work out each region's quantizer category from the power envelope.
+
+    Returns the highest-rate categorization and the order in which
+    regions are stepped down (coarser) by the categorization control.
+    Encoder and decoder must agree on this exactly.
+
+    Args:
+        available_bits: Bits left for the coefficients in this frame
+        rms_index: Region power indices
+
+    Returns:
+        (power_categories, category_balances)
+    """
+    num_regions = len(rms_index)
+
+    # Pretend we have fewer bits at higher rates, as categories cost more there.
+    if available_bits > FRAME_SAMPLES:
+        available_bits = FRAME_SAMPLES + (((available_bits - FRAME_SAMPLES) * 5) >> 3)
+
+    def raw_categories(offset):
+        return [min(max((offset - rms_index[r]) >> 1, 0), NUM_CATEGORIES - 1) for r in range(num_regions)]
+
+    # Binary search for the offset that makes the expected bit count fit.
+    offset = -32
+    delta = 32
+    while delta > 0:
+        test_offset = offset + delta
+        expected = sum(EXPECTED_BITS_TABLE[c] for c in raw_categories(test_offset))
+        if expected >= available_bits - 32:
+            offset = test_offset
+        delta >>= 1
+
+    categories = raw_categories(offset)
+    max_rate_categories = list(categories)
+    min_rate_categories = list(categories)
+    max_bits = min_bits = sum(EXPECTED_BITS_TABLE[c] for c in categories)
+
+    temp_balances = [0] * (2 * NUM_CATEGORIZATION_CONTROL_POSSIBILITIES)
+    max_ptr = min_ptr = NUM_CATEGORIZATION_CONTROL_POSSIBILITIES
+
+    for _ in range(NUM_CATEGORIZATION_CONTROL_POSSIBILITIES - 1):
+
+        if max_bits + min_bits <= 2 * available_bits:
+            # Bits to spare: make one region of the high-rate side finer.
+            raw_value = 100
+            region_index = 0
+            for region in range(num_regions):
+                if max_rate_categories[region] > 0:
+                    value = offset - rms_index[region] - 2 * max_rate_categories[region]
+                    if value < raw_value:
+                        raw_value = value
+                        region_index = region
+            max_ptr -= 1
+            temp_balances[max_ptr] = region_index
+            max_bits -= EXPECTED_BITS_TABLE[max_rate_categories[region_index]]
+            max_rate_categories[region_index] -= 1
+            max_bits += EXPECTED_BITS_TABLE[max_rate_categories[region_index]]
+
+        else:
+            # Over budget: make one region of the low-rate side coarser.
+            raw_value = -100
+            region_index = 0
+            for region in range(num_regions - 1, -1, -1):
+                if min_rate_categories[region] < NUM_CATEGORIES - 1:
+                    value = offset - rms_index[region] - 2 * min_rate_categories[region]
+                    if value > raw_value:
+                        raw_value = value
+                        region_index = region
+            temp_balances[min_ptr] = region_index
+            min_ptr += 1
+            min_bits -= EXPECTED_BITS_TABLE[min_rate_categories[region_index]]
+            min_rate_categories[region_index] += 1
+            min_bits += EXPECTED_BITS_TABLE[min_rate_categories[region_index]]
+
+    category_balances = temp_balances[max_ptr:max_ptr + NUM_CATEGORIZATION_CONTROL_POSSIBILITIES - 1]
+    return max_rate_categories, category_balances
+
+
+def _noise(rng, count, level):
+    return level * (rng.integers(0, 2, size=count) * 2 - 1)
+
+
+def _decode_frame(bits, tables, rng):
+    """Decode one frame's bits into FRAME_SAMPLES MLT coefficients."""
+
+    reader = _BitReader(bits)
+    coefs = np.zeros(FRAME_SAMPLES)
+
+    try:
+        # Power envelope: absolute first region, Huffman-coded differences after.
+        rms_index = [reader.read(REGION_POWER_BITS) - ESF_ADJUSTMENT_TO_RMS_INDEX]
+        for region in range(1, NUMBER_OF_REGIONS):
+            diff = reader.read_code(tables.region_power_decoders[region - 1]) + DRP_DIFF_MIN
+            rms_index.append(rms_index[-1] + diff)
+
+        rate_control = reader.read(NUM_CATEGORIZATION_CONTROL_BITS)
+    except OutOfBits:
+        # Not even an envelope; treat as silence.
+        return coefs
+
+    categories, balances = categorize(reader.remaining(), rms_index)
+    for i in range(rate_control):
+        categories[balances[i]] += 1
+
+    standard_deviation = 2.0 ** (0.5 * np.asarray(rms_index, dtype=np.float64))
+    out_of_bits = False
+
+    for region in range(NUMBER_OF_REGIONS):
+
+        category = categories[region]
+        start = region * REGION_SIZE
+        region_coefs = coefs[start:start + REGION_SIZE]
+
+        if (category < NUM_CATEGORIES - 1) and not out_of_bits:
+            try:
+                dimension = VECTOR_DIMENSION[category]
+                base = MAX_BIN[category] + 1
+                centroids = tables.centroids[category]
+                decoder = tables.vector_decoders[category]
+
+                for vector in range(NUMBER_OF_VECTORS[category]):
+                    index = reader.read_code(decoder)
+
+                    # The vector index holds one bin per coefficient, first one most significant.
+                    bins = [0] * dimension
+                    for j in range(dimension - 1, -1, -1):
+                        index, bins[j] = divmod(index, base)
+
+                    nonzero = [j for j in range(dimension) if bins[j]]
+                    signs = reader.read(len(nonzero))
+                    for n, j in enumerate(nonzero):
+                        positive = (signs >> (len(nonzero) - 1 - n)) & 1
+                        region_coefs[vector * dimension + j] = centroids[bins[j]] if positive else -centroids[bins[j]]
+
+                if category in NOISE_FILL_FACTOR:
+                    zeros = np.flatnonzero(region_coefs == 0)
+                    region_coefs[zeros] = _noise(rng, len(zeros), NOISE_FILL_FACTOR[category])
+
+                region_coefs *= standard_deviation[region]
+                continue
+
+            except OutOfBits:
+                out_of_bits = True
+
+        # Category 7 (or we've run out of bits): noise at the region's power.
+        region_coefs[:] = _noise(rng, REGION_SIZE, NOISE_FILL_FACTOR[NUM_CATEGORIES - 1] * standard_deviation[region])
+
+    return coefs
+
+
+_mlt_basis_cache = {}
+
+
+def mlt_basis(num_samples=FRAME_SAMPLES):
+    """
+    The (2N x N) windowed MLT basis. Frames of 2N samples times this
+    matrix give N coefficients; coefficients times its transpose give 2N
+    samples to overlap-add. It is orthonormal, so the pair reconstructs
+    perfectly.
+    """
+    if num_samples not in _mlt_basis_cache:
+        n = np.arange(2 * num_samples)
+        k = np.arange(num_samples)
+        window = np.sin(np.pi * (n + 0.5) / (2 * num_samples))
+        # As defined in G.722.1: cos((n - 159.5)(k + 0.5) pi / 320)
+        cosines = np.cos(np.pi / num_samples * (n[:, None] + 0.5 - num_samples / 2) * (k[None, :] + 0.5))
+        _mlt_basis_cache[num_samples] = np.sqrt(2.0 / num_samples) * window[:, None] * cosines
+    return _mlt_basis_cache[num_samples]
+
+
+def imlt(coefs):
+    """
+    Inverse MLT of every frame at once, with overlap-add.
+
+    Args:
+        coefs: (num_frames, FRAME_SAMPLES) array of MLT coefficients
+
+    Returns:
+        float array of num_frames * FRAME_SAMPLES samples, aligned with
+        the input that produced the coefficients (see mlt()). The last
+        frame only has half its overlap, so is only exact if it's padding.
+    """
+    num_frames = coefs.shape[0]
+    if num_frames == 0:
+        return np.zeros(0)
+
+    blocks = coefs @ mlt_basis().T
+    samples = blocks[:, FRAME_SAMPLES:].copy()
+    samples[:-1] += blocks[1:, :FRAME_SAMPLES]
+    return samples.reshape(-1)
+
+
+def mlt(samples):
+    """
+    Forward MLT of a whole signal at once.
+
+    Args:
+        samples: 1-D array of samples
+
+    Returns:
+        (num_frames, FRAME_SAMPLES) array of MLT coefficients: one frame
+        per 320 samples (zero-padded), plus one to flush the overlap
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    num_frames = -(-len(samples) // FRAME_SAMPLES) + 1
+    # One frame of leading zeros, so frame t's coefficients cover samples
+    # from (t - 1) * 320 to (t + 1) * 320.
+    padded = np.zeros((num_frames + 1) * FRAME_SAMPLES)
+    padded[FRAME_SAMPLES:FRAME_SAMPLES + len(samples)] = samples
+
+    blocks = np.lib.stride_tricks.as_strided(
+        padded,
+        shape=(num_frames, 2 * FRAME_SAMPLES),
+        strides=(FRAME_SAMPLES * padded.strides[0], padded.strides[0]),
+    )
+    return blocks @ mlt_basis()
+
+
+def to_pcm16(samples):
+    """Round and clip float samples to int16."""
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+
+def decode(data, tables=None, seed=0):
+    """
+    Decode an a18 file or AMF track to 16 kHz mono PCM.
+
+    Args:
+        data: bytes-like a18 data (see parse_track())
+        tables: A1800Tables, or a path to the table file
+        seed: Seed for the noise used to fill coarsely-coded regions
+
+    Returns:
+        int16 numpy array of samples
+    """
+    tables = _resolve_tables(tables)
+    bitrate, frames = parse_track(data)
+    rng = np.random.default_rng(seed)
+
+    bits = _frame_bits(frames)
+    coefs = np.zeros((len(frames), FRAME_SAMPLES))
+    for i, frame in enumerate(bits.tolist()):
+        coefs[i] = _decode_frame(frame, tables, rng)
+
+    return to_pcm16(imlt(coefs))
+
+
+def decode_file(path, tables=None, seed=0):
+    """Decode an .a18 file on disk. See decode()."""
+    with open(path, "rb") as f:
+        return decode(f.read(), tables, seed)
+
+
+def _decode_job(job):
+    data, tables, seed = job
+    return decode(data, tables, seed)
+
+
+def decode_tracks(tracks, tables=None, workers=None, seed=0):
+    """
+    Decode many tracks, optionally across a pool of worker processes.
+
+    Args:
+        tracks: iterable of bytes-like a18 tracks
+        tables: A1800Tables, or a path to the table file
+        workers: Number of worker processes (default: decode in-process)
+        seed: Noise seed used for every track
+
+    Returns:
+        list of int16 numpy arrays, in the same order as tracks
+    """
+    tables = _resolve_tables(tables)
+    jobs = [(bytes(t), tables, seed) for t in tracks]
+
+    if (workers is None) or (workers <= 1) or (len(jobs) <= 1):
+        return [_decode_job(job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_decode_job, jobs))
+
+
+def decode_dlc(source, tables=None, workers=None, seed=0):
+    """
+    Decode every track in a DLC's AMF section.
+
+    Args:
+        source: a furby.dlc, or the path to a DLC file
+        tables, workers, seed: as for decode_tracks()
+
+    Returns:
+        list of int16 numpy arrays, indexed by AMF track number
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        from furby import dlc
+        source = dlc(source)
+
+    return decode_tracks(source.dlc_sections["AMF"].tracks, tables, workers, seed)
+
+
+def a18_file_header(bitrate=DEFAULT_BITRATE):
+    """The 0x30-byte GeneralPlus header that starts an .a18 file."""
+    return (
+        A18_HEADER
+        + b"\xfe\x02\x0e\x00\x10\x00"
+        + struct.pack("<HHH", bitrate, 0, bitrate)
+        + b"\x00" * 8
+        + b"\x00\x01"
+        + b"\x00" * 6
+    )
+
+
+def _region_power_indices(coefs):
+    """
+    Quantized power envelope of every frame at once.
+
+    Returns a (num_frames, NUMBER_OF_REGIONS) int array whose neighbouring
+    differences fit the differential code.
+    """
+    regions = coefs[:, :NUMBER_OF_REGIONS * REGION_SIZE].reshape(len(coefs), NUMBER_OF_REGIONS, REGION_SIZE)
+    power = np.mean(regions ** 2, axis=2)
+    rms_index = np.rint(np.log2(np.maximum(power, 2.0 ** (2 * MIN_RMS_INDEX)))).astype(np.int64)
+
+    rms_index = np.clip(rms_index, MIN_RMS_INDEX, MAX_RMS_INDEX)
+    rms_index[:, 0] = np.clip(rms_index[:, 0], -ESF_ADJUSTMENT_TO_RMS_INDEX, (1 << REGION_POWER_BITS) - 1 - ESF_ADJUSTMENT_TO_RMS_INDEX)
+
+    # Raise quiet regions that sit too far below the next one...
+    for region in range(NUMBER_OF_REGIONS - 2, -1, -1):
+        rms_index[:, region] = np.maximum(rms_index[:, region], rms_index[:, region + 1] - DRP_DIFF_MAX)
+
+    # ...then limit how fast the envelope can fall.
+    for region in range(1, NUMBER_OF_REGIONS):
+        rms_index[:, region] = np.maximum(rms_index[:, region], rms_index[:, region - 1] + DRP_DIFF_MIN)
+
+    return rms_index
+
+
+def _quantize_regions(coefs, rms_index, tables):
+    """
+    Quantize every region of every frame at every category.
+
+    Returns, per category, nested lists of the vector indices, sign bits
+    and sign bit counts of every vector, and a (num_frames, NUMBER_OF_REGIONS, NUM_CATEGORIES) array of
+    the bits each choice would cost.
+    """
+    num_frames = len(coefs)
+    regions = coefs[:, :NUMBER_OF_REGIONS * REGION_SIZE].reshape(num_frames, NUMBER_OF_REGIONS, REGION_SIZE)
+    standard_deviation = 2.0 ** (0.5 * rms_index)
+    normalized = np.abs(regions) / standard_deviation[:, :, None]
+
+    region_bits = np.zeros((num_frames, NUMBER_OF_REGIONS, NUM_CATEGORIES), dtype=np.int64)
+    quantized = []
+
+    for category in range(NUM_CATEGORIES - 1):
+        dimension = VECTOR_DIMENSION[category]
+        base = MAX_BIN[category] + 1
+
+        bins = np.floor(normalized / STEP_SIZE[category] + DEAD_ZONE[category])
+        bins = np.minimum(bins, MAX_BIN[category]).astype(np.int64)
+        bins = bins.reshape(num_frames, NUMBER_OF_REGIONS, NUMBER_OF_VECTORS[category], dimension)
+
+        powers = base ** np.arange(dimension - 1, -1, -1)
+        indices = bins @ powers
+        nonzero = bins > 0
+        positive = regions.reshape(bins.shape) > 0
+
+        # Sign bits of each vector's nonzero coefficients, first one most significant.
+        signs = np.zeros(indices.shape, dtype=np.int64)
+        for j in range(dimension):
+            signs = np.where(nonzero[..., j], (signs << 1) | positive[..., j], signs)
+        sign_counts = nonzero.sum(axis=3)
+
+        region_bits[:, :, category] = tables.vector_lengths[category][indices].sum(axis=2) + sign_counts.sum(axis=2)
+        quantized.append((indices.tolist(), signs.tolist(), sign_counts.tolist()))
+
+    return quantized, region_bits
+
+
+def _choose_categories(available_bits, rms_index, region_bits):
+    """
+    Pick the finest categorization (lowest rate control) whose bits fit.
+
+    Returns (rate_control, power_categories).
+    """
+    categories, balances = categorize(available_bits, rms_index)
+    regions = range(NUMBER_OF_REGIONS)
+
+    for rate_control in range(NUM_CATEGORIZATION_CONTROL_POSSIBILITIES):
+        if rate_control > 0:
+            categories[balances[rate_control - 1]] += 1
+        if sum(region_bits[r][categories[r]] for r in regions) <= available_bits:
+            break
+
+    return rate_control, categories
+
+
+def _encode_frames(coefs, tables, frame_bits):
+    """Encode MLT coefficients into a (num_frames, frame_bits // 16) uint16 array."""
+
+    rms_index = _region_power_indices(coefs)
+    quantized, region_bits = _quantize_regions(coefs, rms_index, tables)
+
+    # Envelope cost of every frame, from the differential code lengths.
+    diffs = np.diff(rms_index, axis=1) - DRP_DIFF_MIN
+    envelope_lengths = np.asarray(tables.region_power_lengths, dtype=np.int64)
+    envelope_bits = REGION_POWER_BITS + envelope_lengths[np.arange(NUMBER_OF_REGIONS - 1), diffs].sum(axis=1)
+    available = frame_bits - envelope_bits - NUM_CATEGORIZATION_CONTROL_BITS
+
+    rms_list = rms_index.tolist()
+    diff_list = diffs.tolist()
+    region_bit_list = region_bits.tolist()
+    packed = bytearray()
+
+    for f in range(len(coefs)):
+        rate_control, categories = _choose_categories(int(available[f]), rms_list[f], region_bit_list[f])
+
+        acc = rms_list[f][0] + ESF_ADJUSTMENT_TO_RMS_INDEX
+        count = REGION_POWER_BITS
+        for region in range(1, NUMBER_OF_REGIONS):
+            code, length = tables.region_power_codes[region - 1][diff_list[f][region - 1]]
+            acc = (acc << length) | code
+            count += length
+        acc = (acc << NUM_CATEGORIZATION_CONTROL_BITS) | rate_control
+        count += NUM_CATEGORIZATION_CONTROL_BITS
+
+        for region in range(NUMBER_OF_REGIONS):
+            category = categories[region]
+            if category == NUM_CATEGORIES - 1:
+                continue
+            indices, signs, sign_counts = quantized[category]
+            codes = tables.vector_codes[category]
+            for vector in range(NUMBER_OF_VECTORS[category]):
+                code, length = codes[indices[f][region][vector]]
+                num_signs = sign_counts[f][region][vector]
+                acc = (((acc << length) | code) << num_signs) | signs[f][region][vector]
+                count += length + num_signs
+
+        # Truncate if even the coarsest categorization overran; pad with ones otherwise.
+        if count > frame_bits:
+            acc >>= count - frame_bits
+        else:
+            padding = frame_bits - count
+            acc = (acc << padding) | ((1 << padding) - 1)
+        packed += acc.to_bytes(frame_bits // 8, "big")
+
+    return np.frombuffer(bytes(packed), dtype=">u2").reshape(len(coefs), -1)
+
+
+def encode(samples, tables=None, bitrate=DEFAULT_BITRATE, header=False):
+    """
+    Encode 16 kHz mono PCM as A1800.
+
+    Args:
+        samples: 1-D array of samples (int16, or floats on the same scale)
+        tables: A1800Tables, or a path to the table file
+        bitrate: Bits per second (16000 for Furby)
+        header: Prepend the GeneralPlus file header, as in an .a18 file
+
+    Returns:
+        bytes; without the header, these can be assigned straight into
+        an AMF section's tracks
+    """
+    tables = _resolve_tables(tables)
+    frame_bits = frame_size(bitrate) * 8
+
+    frames = _encode_frames(mlt(samples), tables, frame_bits)
+    payload = frames.astype("<u2").tobytes()
+    track = struct.pack("<IH", len(payload) + 2, bitrate) + payload
+
+    if header:
+        return a18_file_header(bitrate) + track
+    return track
+
+
+def silent_frame(tables=None, bitrate=DEFAULT_BITRATE):
+    """One encoded frame of silence, for padding tracks without re-encoding them."""
+    track = encode(np.zeros(FRAME_SAMPLES), tables, bitrate)
+    return track[6:6 + frame_size(bitrate)]
+
+
+def read_wav(path):
+    """
+    Read a 16 kHz, mono, 16-bit WAV file into an int16 array.
+
+    Raises ValueError for anything else; use load_audio() to convert it.
+    """
+    with wave.open(str(path), "rb") as w:
+        if (w.getframerate() != SAMPLE_RATE) or (w.getnchannels() != 1) or (w.getsampwidth() != 2):
+            raise ValueError("%s is not 16 kHz, mono, 16-bit PCM." % path)
+        return np.frombuffer(w.readframes(w.getnframes()), dtype="<i2").astype(np.int16)
+
+
+def resample(samples, from_rate, to_rate):
+    """Band-limited resampling of a whole signal, by truncating or padding its spectrum."""
+    if from_rate == to_rate:
+        return np.asarray(samples, dtype=np.float64)
+    length = int(round(len(samples) * to_rate / from_rate))
+    spectrum = np.fft.rfft(samples)[:length // 2 + 1]
+    return np.fft.irfft(spectrum, length) * (length / len(samples))
+
+
+def load_audio(path, sample_rate=SAMPLE_RATE):
+    """
+    Load an audio file as mono int16 PCM at the given sample rate.
+
+    WAV files (8, 16 or 32-bit, any rate and channel count) are read,
+    mixed down and resampled in-process. Anything else is converted by
+    ffmpeg, which streams the samples back over a pipe.
+    """
+    try:
+        with wave.open(str(path), "rb") as w:
+            width = w.getsampwidth()
+            channels = w.getnchannels()
+            rate = w.getframerate()
+            data = w.readframes(w.getnframes())
+    except (wave.Error, EOFError):
+        return _load_with_ffmpeg(path, sample_rate)
+
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float64) - 128) * 256
+    elif width == 2:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float64)
+    elif width == 4:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float64) / 65536
+    else:
+        return _load_with_ffmpeg(path, sample_rate)
+
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    return to_pcm16(resample(samples, rate, sample_rate))
+
+
+def _load_with_ffmpeg(path, sample_rate):
+    cmd = [
+        "ffmpeg", "-i", str(path),
+        "-ar", str(sample_rate),
+        "-ac", "1",
+        "-f", "s16le",
+        "-loglevel", "error",
+        "-",
+    ]
+    try:
+        pcm = subprocess.check_output(cmd)
+    except OSError:
+        raise RuntimeError("ffmpeg is needed to read %s; install it or convert to WAV first." % path)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError("ffmpeg could not read %s (exit code %d)." % (path, e.returncode))
+    return np.frombuffer(pcm, dtype="<i2").astype(np.int16)
+
+
+def encode_file(path, samples, tables=None, bitrate=DEFAULT_BITRATE):
+    """Encode samples to an .a18 file on disk, header included."""
+    with open(path, "wb") as f:
+        f.write(encode(samples, tables, bitrate, header=True))
+
+
+def write_wav(path, samples, sample_rate=SAMPLE_RATE):
+    """Write int16 mono samples to a WAV file."""
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(np.asarray(samples, dtype="<i2").tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Decode a18 audio (or every track in a DLC) to WAV without a1800.dll.',
+        epilog='Example: python a1800.py ./dlc/dlc2/tu003410.dlc -o wavs/ -j 4'
+    )
+    parser.add_argument(
+        'input_file',
+        nargs='?',
+        help='Input .a18 or .dlc file'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help='Output WAV file (for .a18) or directory (for .dlc)'
+    )
+    parser.add_argument(
+        '-t', '--tables',
+        help='Path to the codec table file (default: $A1800_TABLES or ./%s)' % DEFAULT_TABLES_PATH
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=None,
+        help='Number of worker processes for DLCs (default: 1)'
+    )
+    parser.add_argument(
+        '--make-tables',
+        metavar='SOURCE_DIR',
+        help='Write the codec table file (to -t or ./%s) from the G.722.1 reference source code, then exit' % DEFAULT_TABLES_PATH
+    )
+
+    args = parser.parse_args()
+
+    if args.make_tables:
+        output = args.tables or DEFAULT_TABLES_PATH
+        try:
+            data = tables_from_reference(args.make_tables)
+            A1800Tables.from_dict(data)
+        except ValueError as e:
+            print("Error: %s" % e)
+            return 1
+        with open(output, "w") as f:
+            json.dump(data, f)
+        print("Wrote codec tables to %s" % output)
+        return 0
+
+    if args.input_file is None:
+        parser.error("an input file is needed")
+
+    if not os.path.exists(args.input_file):
+        print("Error: Input file not found: %s" % args.input_file)
+        return 1
+
+    try:
+        tables = load_tables(args.tables)
+    except (FileNotFoundError, ValueError) as e:
+        print("Error: %s" % e)
+        return 1
+
+    stem, ext = os.path.splitext(args.input_file)
+
+    if ext.lower() == ".dlc":
+        outdir = args.output or (stem + "_wavs")
+        os.makedirs(outdir, exist_ok=True)
+        name = os.path.basename(stem)
+        for i, samples in enumerate(decode_dlc(args.input_file, tables, args.jobs)):
+            write_wav(os.path.join(outdir, "%s_%04d.wav" % (name, i)), samples)
+        print("Decoded DLC audio to %s" % outdir)
+    else:
+        output = args.output or (stem + ".wav")
+        write_wav(output, decode_file(args.input_file, tables))
+        print("Decoded to %s" % output)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Convert many audio files to a18 format at once, in parallel, with caching.
+
+Each input is loaded, resampled to 16 kHz (the only rate A1800 takes)
+and encoded inside a worker process. There are two encoders (backends):
+
+- dll (the default): GeneralPlus's a1800.dll, as convert_to_a18.py uses
+  it on Windows and convert_mac_linux.py under Wine elsewhere. Each input
+  goes to the DLL as a temporary 16 kHz mono WAV file.
+- native: the encoder in a1800.py, so PCM never touches the disk. It
+  hasn't been checked against a1800.dll yet (see a1800.py).
+
+Encoded tracks are kept in a content-addressed cache keyed by the
+input's hash, the bitrate, the backend and what it encodes with (the
+encoder version and codec tables, or the DLL), so rebuilding an audio
+pack where nothing changed only costs a copy per file. Input hashes are
+themselves remembered by path, size and mtime, so unchanged inputs
+aren't even re-read.
+
+Requirements:
+- numpy
+- dll: a1800.dll, and Wine on Mac and Linux
+- native: the a1800 codec table file (see a1800.py)
+- ffmpeg (only for inputs that aren't WAV)
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import a1800
+
+DEFAULT_CACHE_DIR = '.a18_cache'
+DEFAULT_DLL_PATH = 'a1800.dll'
+BACKENDS = ('dll', 'native')
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.ogg', '.flac', '.m4a', '.aac')
+
+
+def find_inputs(paths):
+    """
+    Expand directories into the audio files they contain.
+
+    Returns a list of (input path, output path) pairs, the output path
+    being relative to the output directory: files found in a directory
+    keep their path within it, and files given directly just their name.
+
+    Raises ValueError if two inputs would be written to the same output.
+    """
+    inputs = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            for p in sorted(p for p in path.rglob('*') if p.suffix.lower() in AUDIO_EXTENSIONS):
+                inputs.append((p, p.relative_to(path).with_suffix('.a18')))
+        else:
+            inputs.append((path, Path(path.with_suffix('.a18').name)))
+
+    seen = {}
+    for input_path, output_path in inputs:
+        key = str(output_path).lower()
+        if key in seen:
+            raise ValueError("%s and %s would both be written to %s" % (seen[key], input_path, output_path))
+        seen[key] = input_path
+    return inputs
+
+
+class ConversionCache:
+    """
+    Content-addressed store of encoded tracks.
+
+    Entries live at <cache_dir>/<key[:2]>/<key>.a18. index.json remembers
+    the hash of each input by path, size and mtime.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.cache_dir / 'index.json'
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def input_hash(self, path):
+        path = Path(path)
+        stat = path.stat()
+        entry = self.index.get(str(path.resolve()))
+        if entry and (entry[0] == stat.st_size) and (entry[1] == stat.st_mtime_ns):
+            return entry[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        self.index[str(path.resolve())] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return self.cache_dir / key[:2] / (key + '.a18')
+
+    def get(self, key):
+        path = self.entry_path(key)
+        return path if path.exists() else None
+
+    def put(self, key, data):
+        path = self.entry_path(key)
+        path.parent.mkdir(exist_ok=True)
+        # Write then rename, so a crash never leaves a truncated entry behind.
+        temp_path = path.with_suffix('.tmp%d' % os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return path
+
+    def save_index(self):
+        temp_path = self.index_path.with_suffix('.tmp%d' % os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(temp_path, self.index_path)
+
+
+def encoder_fingerprint(backend, encoder):
+    """What a backend encodes with, as a string: the encoder version and tables, or the DLL's hash."""
+    if backend == 'native':
+        return 'native:%d:%s' % (a1800.ENCODER_VERSION, encoder.fingerprint)
+    digest = hashlib.sha256()
+    with open(encoder, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return 'dll:%s' % digest.hexdigest()
+
+
+def cache_key(input_hash, bitrate, fingerprint):
+    """Key for an encoded track: everything that affects the encoder's output."""
+    settings = '%s:%d:%s' % (input_hash, bitrate, fingerprint)
+    return hashlib.sha256(settings.encode('ascii')).hexdigest()
+
+
+def encode_with_dll(samples, dll_path):
+    """Encode 16 kHz samples with a1800.dll: through ctypes on Windows, Wine elsewhere."""
+    # convert_to_a18.py and convert_mac_linux.py sit beside this script.
+    here = os.path.dirname(os.path.abspath(__file__))
+    if here not in sys.path:
+        sys.path.insert(0, here)
+    with tempfile.TemporaryDirectory() as work_dir:
+        wav_path = os.path.join(work_dir, 'input.wav')
+        a18_path = os.path.join(work_dir, 'output.a18')
+        a1800.write_wav(wav_path, samples)
+        if os.name == 'nt':
+            import convert_to_a18
+            encfunc, _ = convert_to_a18.load_a1800_dll(dll_path)
+            converted = convert_to_a18.convert_wav_to_a18(wav_path, a18_path, encfunc)
+        else:
+            import convert_mac_linux
+            converted = convert_mac_linux.convert_with_wine(wav_path, a18_path, dll_path)
+        if not (converted and os.path.exists(a18_path)):
+            raise RuntimeError('a1800.dll failed to encode a file')
+        with open(a18_path, 'rb') as f:
+            return f.read()
+
+
+def _convert_job(job):
+    """Worker: load, resample and encode one input."""
+    input_path, bitrate, backend, encoder = job
+    samples = a1800.load_audio(input_path)
+    if backend == 'native':
+        return a1800.encode(samples, encoder, bitrate, header=True)
+    return encode_with_dll(samples, encoder)
+
+
+def convert_batch(inputs, output_dir, tables=None, jobs=None, bitrate=a1800.DEFAULT_BITRATE,
+                  cache_dir=DEFAULT_CACHE_DIR, backend='dll', dll_path=DEFAULT_DLL_PATH):
+    """
+    Convert many audio files to a18.
+
+    Args:
+        inputs: Paths of audio files (or directories of them)
+        output_dir: Directory for the .a18 files (named after the inputs;
+                    see find_inputs())
+        tables: A1800Tables, or a path to the codec table file (native only)
+        jobs: Number of worker processes (default: one per CPU)
+        bitrate: a18 bitrate (the DLL only encodes at 16000)
+        cache_dir: Cache directory, or None to always re-encode
+        backend: 'dll' or 'native' (see above)
+        dll_path: Path to a1800.dll (dll only)
+
+    Returns:
+        dict with lists of the output paths that were "encoded" and
+        those that were "cached"
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend %r (use one of %s)" % (backend, ', '.join(BACKENDS)))
+    inputs = find_inputs(inputs)
+    if backend == 'native':
+        encoder = tables if isinstance(tables, a1800.A1800Tables) else a1800.load_tables(tables)
+    else:
+        if bitrate != a1800.DEFAULT_BITRATE:
+            raise ValueError("The dll backend only encodes at %d bits/s" % a1800.DEFAULT_BITRATE)
+        if not os.path.exists(dll_path):
+            raise FileNotFoundError("a1800.dll not found at %s (or use the native backend)" % dll_path)
+        encoder = os.path.abspath(dll_path)
+    fingerprint = encoder_fingerprint(backend, encoder)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cache = ConversionCache(cache_dir) if cache_dir else None
+
+    report = {'encoded': [], 'cached': []}
+    pending = []
+    for input_path, output_path in inputs:
+        output_path = output_dir / output_path
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        key = cache_key(cache.input_hash(input_path), bitrate, fingerprint) if cache else None
+        cached = cache.get(key) if cache else None
+        if cached:
+            shutil.copyfile(cached, output_path)
+            report['cached'].append(output_path)
+        else:
+            pending.append((input_path, output_path, key))
+
+    if pending:
+        work = [(str(p[0]), bitrate, backend, encoder) for p in pending]
+        parallel = (jobs != 1) and (len(work) > 1)
+        with (ProcessPoolExecutor(max_workers=jobs) if parallel else contextlib.nullcontext()) as pool:
+            results = pool.map(_convert_job, work) if parallel else map(_convert_job, work)
+            for (input_path, output_path, key), data in zip(pending, results):
+                with open(output_path, 'wb') as f:
+                    f.write(data)
+                if cache:
+                    cache.put(key, data)
+                report['encoded'].append(output_path)
+
+    if cache:
+        cache.save_index()
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert many audio files to a18 format for Furby Connect, in parallel and with caching.'
+    )
+    parser.add_argument(
+        'inputs',
+        nargs='+',
+        help='Input audio files, or directories to search for them'
+    )
+    parser.add_argument(
+        '-o', '--output-dir',
+        default='.',
+        help='Directory for the a18 files (default: current directory)'
+    )
+    parser.add_argument(
+        '-b', '--backend',
+        choices=BACKENDS,
+        default='dll',
+        help='Encoder: a1800.dll (through Wine on Mac/Linux), or the native one in a1800.py (default: dll)'
+    )
+    parser.add_argument(
+        '-d', '--dll-path',
+        default=DEFAULT_DLL_PATH,
+        help=f'Path to a1800.dll, for the dll backend (default: {DEFAULT_DLL_PATH})'
+    )
+    parser.add_argument(
+        '-t', '--tables',
+        help='Path to the codec table file, for the native backend (default: $A1800_TABLES or ./a1800_tables.json)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=None,
+        help='Number of worker processes (default: one per CPU)'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=DEFAULT_CACHE_DIR,
+        help=f'Cache directory (default: {DEFAULT_CACHE_DIR})'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always re-encode, and leave the cache alone'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        report = convert_batch(
+            args.inputs,
+            args.output_dir,
+            tables=args.tables,
+            jobs=args.jobs,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            backend=args.backend,
+            dll_path=args.dll_path,
+        )
+    except (FileNotFoundError, ValueError, RuntimeError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"Encoded {len(report['encoded'])} file(s), {len(report['cached'])} from cache, into {args.output_dir}")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,10 @@
 #  This script helps convert WAV files to .a18 format on Mac/Linux
 #  using Wine to run the Windows a1800.dll
 #
+#  With --native it uses the Python encoder in a1800.py instead, which
+#  needs neither Wine nor the DLL. That encoder hasn't been checked
+#  against a1800.dll yet, so the DLL stays the default.
+#
 
 import os
 import sys
@@ -105,11 +109,52 @@ print("Conversion result: " + str(ret))
     finally:
         os.unlink(script_path)
 
+def convert_native(input_file, a18_file, tables_path=None):
+    """
+    Convert an audio file to .a18 in-process with the native encoder.
+    
+    WAV files are read and resampled in-process. Anything else is
+    converted by FFmpeg, which streams the samples back over a pipe
+    rather than via a temporary WAV file.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import a1800
+    
+    try:
+        tables = a1800.load_tables(tables_path)
+        print("Loading %s as 16kHz mono PCM..." % input_file)
+        samples = a1800.load_audio(input_file)
+        print("Encoding to .a18 with the native encoder...")
+        a1800.encode_file(a18_file, samples, tables)
+    except (FileNotFoundError, ValueError, RuntimeError) as e:
+        print("ERROR: %s" % e)
+        return False
+    
+    print(".a18 file created: %s" % a18_file)
+    return True
+
 def main():
     """Main conversion workflow."""
     print("=== Furby Audio Converter for Mac/Linux ===")
     print()
     
+    args = sys.argv[1:]
+    native = '--native' in args
+    if native:
+        args.remove('--native')
+        if len(args) < 2:
+            print("Usage: python convert_mac_linux.py --native <input_audio> <output.a18> [tables.json]")
+            return 1
+        if not os.path.exists(args[0]):
+            print("ERROR: Input file not found: %s" % args[0])
+            return 1
+        if not convert_native(args[0], args[1], args[2] if len(args) > 2 else None):
+            return 1
+        print()
+        print("SUCCESS! Audio converted to: %s" % args[1])
+        print("You can now use this file with demo_toccata.py")
+        return 0
+    
     # Check dependencies
     missing = check_dependencies()
     if missing:
@@ -131,6 +176,7 @@ def main():
         print("  python convert_mac_linux.py toccata.mp3 toccata_in_d_minor.a18 a1800.dll")
         print()
         print("The a1800.dll file can be extracted from GeneralPlus Gadget utility")
+        print("(or use --native to encode without Wine or the DLL)")
         return 1
     
     input_file = sys.argv[1]
@@ -1,25 +1,207 @@
-# extract a18 audio files from a DLC file
-
-dlcfile = 'tu012700.dlc'
-with open(dlcfile, 'rb') as f:
-    dlcdata = bytearray(f.read())
-
-print(type(dlcdata))
-
-audioheader = bytes([0,0,0x80, 0x3e])
-pos = 0
-n=0
-
-while True:
-    pos = dlcdata.find(audioheader, pos)-2
-    if pos < 0:
-        break
-    audiolen = dlcdata[pos+1] << 8 | dlcdata[pos]
-    print("found audio at 0x{:x} len 0x{:x}".format(pos, audiolen))
-    chunk = bytes(dlcdata[pos:pos+audiolen+4])
-    with open('chunks/{}.chunk{:04}.a18'.format(dlcfile, n), 'wb') as f:
-        f.write(chunk)
-    n += 1
-    pos += 3
-
-print(type(chunk))
\ No newline at end of file
+#!/usr/bin/env python3
+"""
+Extract the GeneralPlus a18-encoded audio tracks from DLC files.
+
+Rather than searching the file for something that looks like an a18
+header (which can also turn up inside audio data), this reads the DLC
+header to find the AMF section, then walks the section's track offset
+table. Each track is written straight from a memory map of the DLC, so
+only the header and offset table are ever parsed, and many DLCs can be
+extracted in parallel.
+
+Each DLC's tracks go into a directory named after it (with a suffix if
+two DLCs have the same name), and a manifest (manifest.json) records
+where every track came from.
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from furby import dlc, FormatError
+
+
+def track_spans(mapped, amf_offset, amf_length):
+    """
+    Find each track in a mapped DLC from the AMF section's offset table.
+
+    Args:
+        mapped: bytes-like view of the whole DLC
+        amf_offset: File offset of the AMF section
+        amf_length: Length of the AMF section
+
+    Returns:
+        list of (file offset, size) per track, where size includes the
+        track's length dword
+    """
+    if (amf_length < 4) or (amf_offset + amf_length > len(mapped)):
+        raise FormatError("AMF section runs past the end of the file (0x%x bytes at 0x%x in 0x%x)."
+                          % (amf_length, amf_offset, len(mapped)))
+
+    (track_count,) = struct.unpack_from("<I", mapped, amf_offset)
+    if 4 * (1 + track_count) > amf_length:
+        raise FormatError("AMF track table runs past the end of the section.")
+
+    spans = []
+    for track_offset in struct.unpack_from("<%dI" % track_count, mapped, amf_offset + 4):
+        if track_offset + 4 > amf_length:
+            raise FormatError("AMF track offset 0x%x is outside the section." % track_offset)
+        (length,) = struct.unpack_from("<I", mapped, amf_offset + track_offset)
+        if track_offset + 4 + length > amf_length:
+            raise FormatError("AMF track at 0x%x runs past the end of the section." % track_offset)
+        spans.append((amf_offset + track_offset, 4 + length))
+
+    return spans
+
+
+def extract_dlc(dlc_path, output_dir):
+    """
+    Write every track in a DLC's AMF section to its own .a18 file.
+
+    Args:
+        dlc_path: Path to the DLC
+        output_dir: Directory for the tracks (created if need be)
+
+    Returns:
+        list of manifest entries, one per track
+    """
+    dlc_path = Path(dlc_path)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with open(dlc_path, "rb") as f:
+        data = f.read(dlc.HEADER_section.main_header_length)
+        if len(data) < dlc.HEADER_section.main_header_length:
+            raise FormatError("%s is too short to be a DLC." % dlc_path)
+        header = dlc.HEADER_section(data)
+        sections = {name: (length, offset) for (name, length, offset) in header.map_dlc()}
+        if "AMF" not in sections:
+            return []
+        amf_length, amf_offset = sections["AMF"]
+
+        entries = []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            for n, (offset, size) in enumerate(track_spans(mapped, amf_offset, amf_length)):
+                track_path = output_dir / ("%s.track%04d.a18" % (dlc_path.stem, n))
+                with view[offset:offset + size] as track, open(track_path, "wb") as out:
+                    out.write(track)
+                    entries.append({
+                        "dlc": str(dlc_path),
+                        "track": n,
+                        "offset": offset,
+                        "length": size,
+                        "sha256": hashlib.sha256(track).hexdigest(),
+                        "file": str(track_path),
+                    })
+
+    return entries
+
+
+def _extract_job(job):
+    """Worker: (manifest entries, None), or ([], the error) if the DLC can't be read."""
+    try:
+        return extract_dlc(*job), None
+    except (OSError, ValueError, FormatError) as e:
+        return [], "%s: %s" % (job[0], e)
+
+
+def output_names(dlc_paths):
+    """
+    A directory name for each DLC: its name, plus a hash of its full path
+    when another DLC has the same name.
+    """
+    stems = [Path(p).stem for p in dlc_paths]
+    names = []
+    for path, stem in zip(dlc_paths, stems):
+        if stems.count(stem) > 1:
+            stem += "-" + hashlib.sha256(str(Path(path).resolve()).encode("utf-8")).hexdigest()[:8]
+        names.append(stem)
+    return names
+
+
+def extract_many(dlc_paths, output_dir, jobs=None, errors=None):
+    """
+    Extract the tracks of many DLCs, one worker process per DLC at a time,
+    and write a manifest of them all to <output_dir>/manifest.json.
+
+    A DLC that can't be read (empty, truncated, not a DLC...) is skipped,
+    and the rest are still extracted.
+
+    Args:
+        errors: List to append a message to for each DLC skipped
+
+    Returns:
+        The manifest (list of entries)
+    """
+    output_dir = Path(output_dir)
+    work = [(p, output_dir / name) for p, name in zip(dlc_paths, output_names(dlc_paths))]
+
+    if (jobs == 1) or (len(work) <= 1):
+        results = [_extract_job(job) for job in work]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_extract_job, work))
+
+    manifest = [entry for entries, _ in results for entry in entries]
+    if errors is not None:
+        errors.extend(error for _, error in results if error)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Extract the a18 audio tracks from Furby Connect DLC files.'
+    )
+    parser.add_argument(
+        'dlc_files',
+        nargs='+',
+        help='DLC files, or directories to search for them'
+    )
+    parser.add_argument(
+        '-o', '--output-dir',
+        default='chunks',
+        help='Output directory (default: chunks)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=None,
+        help='Number of worker processes (default: one per CPU)'
+    )
+
+    args = parser.parse_args()
+
+    dlc_paths = []
+    for path in map(Path, args.dlc_files):
+        if path.is_dir():
+            dlc_paths.extend(sorted(path.rglob('*.dlc')))
+        else:
+            dlc_paths.append(path)
+
+    errors = []
+    try:
+        manifest = extract_many(dlc_paths, args.output_dir, args.jobs, errors)
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    for error in errors:
+        print(f"Error: {error}")
+    print(f"Extracted {len(manifest)} tracks from {len(dlc_paths) - len(errors)} DLC(s) into {args.output_dir}")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Make the a1800.dll reference files the native codec is tested against.
+
+Every .a18 file in the directory (audio/new_audio by default) is decoded
+with a1800.dll to <name>.dll.wav beside it, and every .wav file (16 kHz
+mono 16-bit PCM) is encoded with it to <name>.dll.a18.
+test_furby.TestA1800Reference then decodes the same .a18 files with
+a1800.py, and encodes the same .wav files, and compares the results.
+
+Requirements:
+- Windows OS (for a1800.dll)
+- a1800.dll from GeneralPlus Gadget utility
+"""
+
+import argparse
+import sys
+import wave
+from ctypes.wintypes import LPCSTR
+from pathlib import Path
+
+from convert_to_a18 import load_a1800_dll
+
+DEFAULT_DIRECTORY = Path(__file__).resolve().parent.parent / 'audio' / 'new_audio'
+
+
+def is_reference(path):
+    """Whether a file is one this script made."""
+    return path.name.endswith(('.dll.wav', '.dll.a18'))
+
+
+def decode_references(directory, decfunc):
+    """Decode each .a18 in directory with the DLL. Returns the files written."""
+    written = []
+    for a18_path in sorted(Path(directory).glob('*.a18')):
+        if is_reference(a18_path):
+            continue
+        wav_path = a18_path.with_name(a18_path.stem + '.dll.wav')
+        if wav_path.exists():
+            wav_path.unlink()
+        decfunc(infile=LPCSTR(str(a18_path).encode('utf-8')), outfile=LPCSTR(str(wav_path).encode('utf-8')))
+        if not wav_path.exists():
+            raise RuntimeError(f"a1800.dll didn't decode {a18_path}")
+        print(f"Decoded {a18_path} to {wav_path}")
+        written.append(wav_path)
+    return written
+
+
+def encode_references(directory, encfunc):
+    """Encode each .wav in directory with the DLL. Returns the files written."""
+    written = []
+    for wav_path in sorted(Path(directory).glob('*.wav')):
+        if is_reference(wav_path):
+            continue
+        with wave.open(str(wav_path), 'rb') as w:
+            if (w.getnchannels(), w.getsampwidth(), w.getframerate()) != (1, 2, 16000):
+                raise RuntimeError(f"{wav_path} isn't 16 kHz mono 16-bit PCM")
+        a18_path = wav_path.with_name(wav_path.stem + '.dll.a18')
+        if a18_path.exists():
+            a18_path.unlink()
+        encfunc(infile=LPCSTR(str(wav_path).encode('utf-8')), outfile=LPCSTR(str(a18_path).encode('utf-8')))
+        if not a18_path.exists():
+            raise RuntimeError(f"a1800.dll didn't encode {wav_path}")
+        print(f"Encoded {wav_path} to {a18_path}")
+        written.append(a18_path)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Make a1800.dll reference decodings and encodings for testing the native A1800 codec.'
+    )
+    parser.add_argument(
+        'directory',
+        nargs='?',
+        default=str(DEFAULT_DIRECTORY),
+        help='Directory of .a18 and .wav files (default: audio/new_audio)'
+    )
+    parser.add_argument(
+        '-d', '--dll-path',
+        default='a1800.dll',
+        help='Path to a1800.dll (default: a1800.dll in current directory)'
+    )
+
+    args = parser.parse_args()
+
+    encfunc, decfunc = load_a1800_dll(args.dll_path)
+    try:
+        written = decode_references(args.directory, decfunc)
+        written += encode_references(args.directory, encfunc)
+    except (OSError, RuntimeError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"\nWrote {len(written)} reference file(s).")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
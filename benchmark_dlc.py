@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Benchmark parsing and compiling Furby Connect DLC files.
+
+For each DLC, and for copies of it scaled up 10x and 100x, this times
+every section's parse (__initialise__) and compile (__compile__), plus a
+full dlc() load and build(), and measures the peak memory of each with
+tracemalloc. Results are written as JSON, tagged with the git commit, so
+runs from different commits can be compared:
+
+    python benchmark_dlc.py -o before.json
+    (make changes)
+    python benchmark_dlc.py -o after.json --compare before.json
+
+With --compare, anything more than --threshold times slower than the
+baseline is listed, and the exit status is 1.
+
+It also times importing furby in a fresh interpreter, as CLI tools do on
+every run. That has a fixed budget (--import-budget), and furby mustn't
+pull in heavy modules (PIL, numpy, asyncio) when it's imported; either
+failing also makes the exit status 1.
+"""
+
+import argparse
+import copy
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from furby import dlc, PackedPlaylists
+
+DEFAULT_DLC = './dlc/dlc2/tu003410.dlc'
+DEFAULT_SCALES = (1, 10, 100)
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 1.25
+IMPORT_BUDGET_MS = 60.0
+HEAVY_MODULES = ('PIL', 'numpy', 'asyncio')
+
+
+def git_commit():
+    """The commit being benchmarked, or None outside a git checkout."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def import_time(module='furby', repeat=DEFAULT_REPEAT):
+    """
+    Time importing a module in fresh interpreters, with -X importtime.
+
+    Bytecode caching is allowed (and the first run, which may write the
+    cache, isn't counted), so this is the cost a tool pays on every run.
+
+    Returns:
+        dict with the median and minimum import time, and which of
+        HEAVY_MODULES the import loaded
+    """
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    command = [sys.executable, '-X', 'importtime', '-c', code]
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    times = []
+    for n in range(repeat + 1):
+        result = subprocess.run(command, cwd=cwd, env=env, capture_output=True, text=True, check=True)
+        if n == 0:
+            continue
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            if (len(fields) == 3) and (fields[2].strip() == module):
+                times.append(int(fields[1]) / 1e6)
+
+    return {
+        'module': module,
+        'median_s': statistics.median(times),
+        'min_s': min(times),
+        'heavy_modules': result.stdout.split(),
+    }
+
+
+def scale_dlc(D, factor):
+    """
+    Make a DLC `factor` times bigger in cels, sprite frames, actions and
+    audio, by repeating its contents with every reference kept valid.
+
+    Each copy of the cels gets its own copy of the sprite frames (pointing
+    at it), and the frame playlists run through every copy. XLS entries,
+    tracks, playlists (and their lip-sync phrases), sequences and motor
+    animations are repeated the same way. Sequences past the first 256
+    can't be referenced from XLS, so the extra action entries use the
+    original sequences.
+    """
+    if factor == 1:
+        return D
+
+    sections = D.dlc_sections
+    copies = range(1, factor)
+
+    if 'CEL' in sections:
+        cels = sections['CEL'].cels
+        num_cels = len(cels)
+        sections['CEL'].cels = cels * factor
+
+        if 'SPR' in sections:
+            spr = sections['SPR']
+            num_frames = len(spr.frames)
+            for c in copies:
+                for frame in spr.frames[:num_frames]:
+                    scaled = list(frame)
+                    scaled[0:8:2] = [cel + c * num_cels for cel in frame[0:8:2]]
+                    spr.frames.append(scaled)
+            for fp in spr.frame_playlists:
+                fp['frame_indices'] = [f + c * num_frames for c in range(factor) for f in fp['frame_indices']]
+                fp['framecount'] = len(fp['frame_indices'])
+
+    if 'XLS' in sections:
+        xls = sections['XLS']
+        tree = xls.action_tree
+        num_actions = len(tree)
+        for c in copies:
+            for i in range(1, num_actions + 1):
+                tree[c * num_actions + i] = copy.deepcopy(tree[i])
+        xls.pack_tree()
+
+    num_tracks = 0
+    if 'AMF' in sections:
+        num_tracks = len(sections['AMF'].tracks)
+        sections['AMF'].tracks = sections['AMF'].tracks * factor
+
+    num_playlists = 0
+    if 'APL' in sections:
+        playlists = [list(pl) for pl in sections['APL'].playlists]
+        num_playlists = len(playlists)
+        sections['APL'].playlists = PackedPlaylists(
+            [(value + c * num_tracks if kind == 'AUDIO' else value, kind) for value, kind in pl]
+            for c in range(factor) for pl in playlists
+        )
+
+    if 'LPS' in sections:
+        sections['LPS'].phrases = [list(ph) for ph in sections['LPS'].phrases] * factor
+
+    if 'SEQ' in sections:
+        sequences = [list(seq) for seq in sections['SEQ'].sequences]
+        sections['SEQ'].sequences = [
+            seq[:1] + [seq[1] + c * num_playlists] + seq[2:]
+            for c in range(factor) for seq in sequences
+        ]
+
+    if 'MTR' in sections:
+        sections['MTR'].animations = [list(a) for a in sections['MTR'].animations] * factor
+
+    return D
+
+
+def measure(fn, repeat):
+    """Time fn() `repeat` times, then run it once more under tracemalloc."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'median_s': statistics.median(times),
+        'min_s': min(times),
+        'peak_bytes': peak,
+    }
+
+
+def bench_file(path, repeat, label, scale, work_dir):
+    """Benchmark every section of the DLC at path, and a full load and build."""
+    D = dlc(str(path))
+    section_classes = {name: getattr(dlc, name + '_section') for name in D.dlc_sections}
+
+    results = []
+    for name in D.dlc_header.section_order():
+        raw = D.dlc_sections[name].write_out()
+        section = section_classes[name](raw)
+
+        for stage, fn in (('parse', lambda: section_classes[name](raw)),
+                          ('compile', lambda: section.__compile__())):
+            row = {'dlc': label, 'scale': scale, 'stage': stage, 'section': name, 'bytes': len(raw)}
+            row.update(measure(fn, repeat))
+            results.append(row)
+
+    out_path = Path(work_dir) / 'build.dlc'
+    size = os.path.getsize(path)
+    for stage, fn in (('load', lambda: dlc(str(path))),
+                      ('build', lambda: D.build(str(out_path)))):
+        row = {'dlc': label, 'scale': scale, 'stage': stage, 'section': None, 'bytes': size}
+        row.update(measure(fn, repeat))
+        results.append(row)
+
+    return results
+
+
+def run_benchmarks(dlc_paths, scales=DEFAULT_SCALES, repeat=DEFAULT_REPEAT, progress=None):
+    """
+    Benchmark each DLC at each scale.
+
+    Returns:
+        dict with the commit, environment and a list of result rows
+    """
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'repeat': repeat,
+        'import': import_time(repeat=repeat),
+        'results': [],
+    }
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        for dlc_path in map(Path, dlc_paths):
+            for scale in scales:
+                if progress:
+                    progress(f"{dlc_path.name} x{scale}")
+                path = dlc_path
+                if scale != 1:
+                    path = Path(work_dir) / f"{dlc_path.stem}_x{scale}.dlc"
+                    scale_dlc(dlc(str(dlc_path)), scale).build(str(path))
+                report['results'] += bench_file(path, repeat, dlc_path.name, scale, work_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+    return report
+
+
+def result_key(row):
+    return (row['dlc'], row['scale'], row['stage'], row['section'])
+
+
+def compare(baseline, report, threshold=DEFAULT_THRESHOLD):
+    """
+    Match up results with a baseline report.
+
+    Returns:
+        list of (key, baseline row, new row, time ratio, memory ratio), and
+        the subset of those over the threshold in time or memory
+    """
+    old_rows = {result_key(r): r for r in baseline['results']}
+    rows = []
+    for row in report['results']:
+        old = old_rows.get(result_key(row))
+        if old is None:
+            continue
+        time_ratio = row['median_s'] / old['median_s'] if old['median_s'] else 1.0
+        memory_ratio = row['peak_bytes'] / old['peak_bytes'] if old['peak_bytes'] else 1.0
+        rows.append((result_key(row), old, row, time_ratio, memory_ratio))
+
+    regressions = [r for r in rows if (r[3] > threshold) or (r[4] > threshold)]
+    return rows, regressions
+
+
+def format_key(key):
+    dlc_name, scale, stage, section = key
+    return f"{dlc_name} x{scale} {stage} {section or 'dlc'}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark parsing and compiling Furby Connect DLC files.'
+    )
+    parser.add_argument(
+        'dlc_files',
+        nargs='*',
+        default=[DEFAULT_DLC],
+        help=f'DLC files to benchmark (default: {DEFAULT_DLC})'
+    )
+    parser.add_argument(
+        '-s', '--scales',
+        type=int,
+        nargs='+',
+        default=list(DEFAULT_SCALES),
+        help='Scale factors to benchmark at (default: 1 10 100)'
+    )
+    parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        default=DEFAULT_REPEAT,
+        help=f'Timed runs per measurement; the median is reported (default: {DEFAULT_REPEAT})'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help='Write the results to this JSON file'
+    )
+    parser.add_argument(
+        '-c', '--compare',
+        help='Baseline JSON results to compare against'
+    )
+    parser.add_argument(
+        '-t', '--threshold',
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f'Slowdown (or memory growth) ratio counted as a regression (default: {DEFAULT_THRESHOLD})'
+    )
+    parser.add_argument(
+        '--import-budget',
+        type=float,
+        default=IMPORT_BUDGET_MS,
+        help=f'Most milliseconds importing furby may take (default: {IMPORT_BUDGET_MS:g})'
+    )
+
+    args = parser.parse_args()
+
+    for path in args.dlc_files:
+        if not os.path.exists(path):
+            print(f"Error: DLC file not found: {path}")
+            return 1
+
+    report = run_benchmarks(args.dlc_files, args.scales, args.repeat,
+                            progress=lambda what: print(f"Benchmarking {what}...", file=sys.stderr))
+
+    print(f"{'benchmark':<32} {'bytes':>12} {'median ms':>12} {'peak KiB':>12}")
+    for row in report['results']:
+        print(f"{format_key(result_key(row)):<32} {row['bytes']:>12} "
+              f"{1000 * row['median_s']:>12.2f} {row['peak_bytes'] / 1024:>12.1f}")
+
+    imported = report['import']
+    print(f"\nimport furby: {1000 * imported['median_s']:.1f} ms (budget {args.import_budget:g} ms)")
+    failed = False
+    if 1000 * imported['median_s'] > args.import_budget:
+        print("Importing furby is over budget")
+        failed = True
+    if imported['heavy_modules']:
+        print(f"Importing furby loads {', '.join(imported['heavy_modules'])}")
+        failed = True
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(baseline, report, args.threshold)
+        print(f"\nCompared with {baseline.get('commit') or args.compare}:")
+        for key, old, new, time_ratio, memory_ratio in rows:
+            flag = '  <-- regression' if (time_ratio > args.threshold) or (memory_ratio > args.threshold) else ''
+            print(f"{format_key(key):<32} time x{time_ratio:.2f}  memory x{memory_ratio:.2f}{flag}")
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over x{args.threshold}")
+            return 1
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
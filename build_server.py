@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+A local build server for Furby Connect DLCs.
+
+Loading a DLC means parsing every section, which takes far longer than
+making a few edits and building the result. This server parses its base
+DLCs (templates) once and keeps them in memory; each build job works on a
+clone of a warm template (see dlc.clone(), which only copies what the job
+edits), applies its edits, and streams the finished DLC straight back, so
+a job costs the edits and the build, not a parse.
+
+Jobs are JSON, POSTed to /build over HTTP (TCP, or a UNIX socket with
+--socket):
+
+    {
+        "template": "tu003410",
+        "edits": [
+            {"op": "replace_audio", "action_code": [75, 0, 0, 0], "files": ["hello.a18"]},
+            {"op": "replace_cels", "image": "eyes.gif", "at": 2},
+            {"op": "fit_to_budget", "budget": 900000}
+        ]
+    }
+
+The response is the DLC. GET /templates lists the templates. Audio can be
+given inline as base64 (a18_base64) or as files in the server's --assets
+directory (files); images likewise (image_base64, or image). Paths are
+relative to --assets, and nothing outside it can be read. Without
+--assets, only inline data is accepted.
+
+Memory is bounded by keeping at most --max-templates templates (least
+recently used are dropped, and reparsed if asked for again) and running
+at most --max-jobs jobs at once; jobs that can't start within
+--queue-timeout seconds get a 503.
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from furby import dlc, FormatError
+
+DEFAULT_PORT = 8417
+DEFAULT_MAX_TEMPLATES = 4
+DEFAULT_MAX_JOBS = 4
+DEFAULT_QUEUE_TIMEOUT = 30.0
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+logger = logging.getLogger("furby.build_server")
+
+
+class JobError(Exception):
+    """A job that can't be done as described; reported to the client as a 400."""
+
+
+class TemplateCache(object):
+    """Parsed templates by name, keeping at most max_templates in memory."""
+
+    def __init__(self, paths, max_templates=DEFAULT_MAX_TEMPLATES):
+        self.paths = dict(paths)
+        self.max_templates = max_templates
+        self.loaded = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def __cached(self, name):
+        D = self.loaded.get(name)
+        if D is not None:
+            self.loaded.move_to_end(name)
+        return D
+
+    def get(self, name):
+        if name not in self.paths:
+            raise JobError("Unknown template %r" % name)
+        with self.lock:
+            D = self.__cached(name)
+            if D is not None:
+                return D
+            load_lock = self.loading.setdefault(name, threading.Lock())
+
+        # Parse outside self.lock, so jobs on other templates aren't held up;
+        # jobs wanting the same template wait here and then find it loaded.
+        with load_lock:
+            with self.lock:
+                D = self.__cached(name)
+            if D is not None:
+                return D
+            try:
+                logger.info("Loading template %s from %s", name, self.paths[name])
+                D = dlc(self.paths[name])
+                with self.lock:
+                    self.loaded[name] = D
+                    while len(self.loaded) > self.max_templates:
+                        dropped, _ = self.loaded.popitem(last=False)
+                        logger.info("Dropped template %s", dropped)
+            finally:
+                with self.lock:
+                    self.loading.pop(name, None)
+            return D
+
+    def warm(self):
+        for name in list(self.paths)[:self.max_templates]:
+            self.get(name)
+
+
+def asset_path(assets, path):
+    """path, looked up in the assets directory; refuses anything outside it."""
+    if assets is None:
+        raise JobError("This server has no assets directory; send %s inline" % path)
+    assets = os.path.realpath(assets)
+    full = os.path.realpath(os.path.join(assets, path))
+    if os.path.commonpath([assets, full]) != assets:
+        raise JobError("%s is outside the assets directory" % path)
+    return full
+
+
+def inline_file(data, work_dir, suffix):
+    """Write base64 data from a job to a file in work_dir."""
+    with tempfile.NamedTemporaryFile(dir=work_dir, suffix=suffix, delete=False) as f:
+        f.write(base64.b64decode(data))
+    return f.name
+
+
+def check_a18(path, name):
+    """Refuse an a18 file that isn't a length, a bitrate and whole frames."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(dlc.AMF_section.a18_header):
+        data = data[0x30:]
+    if len(data) < 6:
+        raise JobError("%s is too short to be an a18 file" % name)
+    length, bitrate = struct.unpack_from("<IH", data)
+    if length != len(data) - 4:
+        raise JobError("%s says it holds %d bytes, but holds %d" % (name, length, len(data) - 4))
+    if (bitrate < 400) or (bitrate % 400) or ((length - 2) % (bitrate // 400)):
+        raise JobError("%s isn't whole frames at %d bits/s" % (name, bitrate))
+
+
+def audio_files(edit, work_dir, assets=None):
+    """The a18 files an edit refers to, writing any inline ones to work_dir."""
+    files = [asset_path(assets, path) for path in edit.get("files", [])]
+    for path, name in zip(files, edit.get("files", [])):
+        check_a18(path, name)
+    for n, data in enumerate(edit.get("a18_base64", [])):
+        files.append(inline_file(data, work_dir, ".a18"))
+        check_a18(files[-1], "a18_base64[%d]" % n)
+    if not files:
+        raise JobError("%s needs files or a18_base64" % edit["op"])
+    return files
+
+
+def apply_edit(D, edit, work_dir, assets=None):
+    """Apply one edit from a job to D, reading files only from assets."""
+    op = edit.get("op")
+    sections = D.dlc_sections
+
+    if op == "replace_audio":
+        D.replace_audio_bulk({tuple(edit["action_code"]): audio_files(edit, work_dir, assets)})
+    elif op == "replace_track":
+        sections["AMF"].replace_track(edit["track"], audio_files(edit, work_dir, assets)[0])
+    elif op == "trim_track":
+        amf = sections["AMF"]
+        amf.tracks[edit["track"]] = amf.trim_track(amf.tracks[edit["track"]], edit.get("start", 0), edit.get("end"))
+    elif op == "minify_audio":
+        sections["AMF"].minify_audio(edit.get("bytes", 16000))
+    elif op == "fit_to_budget":
+        priorities = {int(k): v for k, v in edit.get("priorities", {}).items()}
+        report = D.fit_to_budget(edit["budget"], priorities, edit.get("min_track_bytes", 8000))
+        if not report["fits"]:
+            raise JobError("Can't fit the DLC in %d bytes (got it down to %d)" % (edit["budget"], report["size_after"]))
+    elif op == "replace_cels":
+        if "image_base64" in edit:
+            image = inline_file(edit["image_base64"], work_dir, ".gif")
+        else:
+            image = asset_path(assets, edit["image"])
+        cels = sections["CEL"].quarterize(image)
+        if not cels:
+            raise JobError("Couldn't read cels from %s" % edit.get("image", "image_base64"))
+        at = edit.get("at", len(sections["CEL"].cels))
+        sections["CEL"].cels[at:at + len(cels)] = cels
+    elif op == "copy_cel":
+        cels = sections["CEL"].cels
+        cels[edit["to"]] = [row[:] for row in cels[edit["from"]]]
+    else:
+        raise JobError("Unknown edit %r" % op)
+
+
+def run_job(templates, job, assets=None):
+    """Make the DLC a job describes (from a clone of its template)."""
+    D = templates.get(job.get("template")).clone()
+    with tempfile.TemporaryDirectory() as work_dir:
+        for edit in job.get("edits", []):
+            try:
+                apply_edit(D, edit, work_dir, assets)
+            except (KeyError, IndexError, TypeError, ValueError, FormatError, OSError, struct.error, AssertionError) as e:
+                raise JobError("Edit %r failed: %s" % (edit.get("op"), e))
+    return D
+
+
+class BuildHandler(BaseHTTPRequestHandler):
+
+    def address_string(self):
+        # UNIX socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/templates":
+            self.send_json(200, {"templates": sorted(self.server.templates.paths),
+                                 "loaded": list(self.server.templates.loaded)})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/build":
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_json(400, {"error": "Bad Content-Length"})
+            return
+        if length > MAX_REQUEST_BYTES:
+            self.send_json(413, {"error": "Job is over %d bytes" % MAX_REQUEST_BYTES})
+            return
+
+        # Take a job slot before reading the body, so at most --max-jobs
+        # request bodies are held in memory at once.
+        if not self.server.jobs.acquire(timeout=self.server.queue_timeout):
+            self.send_json(503, {"error": "Too busy"})
+            return
+        try:
+            try:
+                job = json.loads(self.rfile.read(length))
+            except ValueError as e:
+                self.send_json(400, {"error": "Bad JSON: %s" % e})
+                return
+            if not isinstance(job, dict):
+                self.send_json(400, {"error": "A job is a JSON object"})
+                return
+            try:
+                D = run_job(self.server.templates, job, self.server.assets)
+            except JobError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(D.compiled_size()))
+            self.end_headers()
+            D.write_to(self.wfile)
+        finally:
+            self.server.jobs.release()
+
+
+class BuildServerMixin(object):
+
+    daemon_threads = True
+
+    def setup_jobs(self, templates, max_jobs, queue_timeout, assets):
+        self.templates = templates
+        self.assets = assets
+        self.jobs = threading.BoundedSemaphore(max_jobs)
+        self.queue_timeout = queue_timeout
+
+
+class BuildServer(BuildServerMixin, ThreadingHTTPServer):
+    pass
+
+
+class UnixBuildServer(BuildServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def make_server(templates, address=("127.0.0.1", DEFAULT_PORT), socket_path=None,
+                max_jobs=DEFAULT_MAX_JOBS, queue_timeout=DEFAULT_QUEUE_TIMEOUT, assets=None):
+    """
+    Make (but don't start) a build server.
+
+    Args:
+        templates: a TemplateCache
+        address: (host, port) to listen on
+        socket_path: Listen on this UNIX socket instead
+        max_jobs: Jobs to run at once
+        queue_timeout: Seconds a job waits to start before getting a 503
+        assets: Directory that jobs' files and images are read from (None: inline data only)
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixBuildServer(socket_path, BuildHandler)
+    else:
+        server = BuildServer(address, BuildHandler)
+    server.setup_jobs(templates, max_jobs, queue_timeout, assets)
+    return server
+
+
+def parse_template(text):
+    name, sep, path = text.partition("=")
+    if not sep:
+        path = name
+        name = os.path.splitext(os.path.basename(path))[0]
+    return name, path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve Furby Connect DLC builds from warm, parsed templates.',
+        epilog='Example: python build_server.py dlc/dlc2/tu003410.dlc -p 8417'
+    )
+    parser.add_argument(
+        'templates',
+        nargs='+',
+        type=parse_template,
+        help='Template DLCs, as path or name=path (the name defaults to the file name)'
+    )
+    parser.add_argument(
+        '-H', '--host',
+        default='127.0.0.1',
+        help='Address to listen on (default: 127.0.0.1)'
+    )
+    parser.add_argument(
+        '-p', '--port',
+        type=int,
+        default=DEFAULT_PORT,
+        help=f'Port to listen on (default: {DEFAULT_PORT})'
+    )
+    parser.add_argument(
+        '-s', '--socket',
+        help='Listen on this UNIX socket instead of TCP'
+    )
+    parser.add_argument(
+        '--max-templates',
+        type=int,
+        default=DEFAULT_MAX_TEMPLATES,
+        help=f'Templates to keep parsed in memory (default: {DEFAULT_MAX_TEMPLATES})'
+    )
+    parser.add_argument(
+        '-j', '--max-jobs',
+        type=int,
+        default=DEFAULT_MAX_JOBS,
+        help=f'Jobs to run at once (default: {DEFAULT_MAX_JOBS})'
+    )
+    parser.add_argument(
+        '--queue-timeout',
+        type=float,
+        default=DEFAULT_QUEUE_TIMEOUT,
+        help=f'Seconds a job may wait to start before being refused (default: {DEFAULT_QUEUE_TIMEOUT:g})'
+    )
+    parser.add_argument(
+        '-a', '--assets',
+        help='Directory jobs may read audio and image files from (default: none, inline data only)'
+    )
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+    for name, path in args.templates:
+        if not os.path.exists(path):
+            print(f"Error: Template not found: {path}")
+            return 1
+
+    if args.assets and not os.path.isdir(args.assets):
+        print(f"Error: Assets directory not found: {args.assets}")
+        return 1
+
+    templates = TemplateCache(args.templates, args.max_templates)
+    templates.warm()
+    server = make_server(templates, (args.host, args.port), args.socket, args.max_jobs, args.queue_timeout, args.assets)
+    print(f"Serving {len(templates.paths)} template(s) on {args.socket or '%s:%d' % (args.host, args.port)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
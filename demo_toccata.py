@@ -48,7 +48,7 @@ NOTE: If you get syntax errors about 'print' statements, you are running
 Python 3. This project requires Python 2.7.
 """
 
-from furby import dlc
+from furby import dlc, FormatError
 import os
 
 
@@ -117,6 +117,16 @@ def make_toccata_furby(dlc_in="./dlc/dlc2/tu003410.dlc",
     except Exception as e:
         print("Error replacing audio for action code 75-0-0-3: %s" % e)
     
+    # Regenerate the lip-sync for the new audio, so the mouth moves with the music.
+    # This decodes the audio, which needs numpy and the codec tables (see a1800.py);
+    # without them the old lip-sync is kept.
+    print("Generating lip-sync for the replaced responses...")
+    try:
+        import lipsync
+        lipsync.sync_actions(D, [(75, 0, 0, 0), (75, 0, 0, 1), (75, 0, 0, 3)])
+    except (ImportError, FileNotFoundError, ValueError, KeyError, FormatError) as e:
+        print("Skipping lip-sync: %s" % e)
+    
     # Build the new DLC file
     print("Building new DLC file: %s" % dlc_out)
     D.build(dlc_out)
@@ -22,8 +22,21 @@
 #  
 #  
 
+import array
+import contextlib
+import copy
+import functools
+import logging
 import struct
-from PIL import Image as PILImage
+import sys
+import threading
+import time
+import weakref
+from collections import Counter, namedtuple
+from collections.abc import MutableSequence
+
+#PIL is imported by the imaging helpers that need it, rather than here, so tools
+#that never draw anything don't pay for loading it.
 
 class FormatError(Exception):
 	def __init__(self, value):
@@ -31,10 +44,777 @@ class FormatError(Exception):
 	def __str__(self):
 		return repr(self.value)
 
+#Logging. The library never prints; it logs to the "furby" logger, and stays
+#quiet unless the application configures logging. Records about a DLC carry
+#structured fields as attributes: `event` (a short name, like "dead_frames"),
+#`section`, and whatever else applies (`offset`, `count`...)
+log = logging.getLogger("furby")
+log.addHandler(logging.NullHandler())
+
+def log_event(level, event, message, *args, **fields):
+	fields["event"] = event
+	log.log(level, message, *args, extra=fields)
+
+#Collects furby log records as plain dicts, which can be pickled back from
+#worker processes and merged. Attach one with log.addHandler().
+class EventCollector(logging.Handler):
+
+	#Attributes every LogRecord has; anything else on a record is a field.
+	standard_attributes = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+	def __init__(self, level=logging.DEBUG):
+		logging.Handler.__init__(self, level)
+		self.events = []
+
+	def emit(self, record):
+		e = {k : v for k, v in record.__dict__.items() if k not in self.standard_attributes}
+		e["level"] = record.levelname
+		e["message"] = record.getMessage()
+		self.events.append(e)
+
+	def merge(self, events):
+		self.events.extend(events)
+
+	#How many times each (event, section) was seen, weighted by `count` where
+	#a record stands for several anomalies.
+	def counts(self):
+		totals = Counter()
+		for e in self.events:
+			totals[(e.get("event"), e.get("section"))] += e.get("count", 1)
+		return totals
+
+#One event in a response timeline (see dlc.sequence_timeline.) Events are
+#shared between memoized timelines, so they're immutable.
+TimelineEvent = namedtuple("TimelineEvent", ["t_ms", "kind", "duration_ms", "value", "source"])
+
+#A problem found by dlc.validate(): the section and entry holding the bad value,
+#the section it should refer to (if any), the value itself, and what's wrong.
+ValidationIssue = namedtuple("ValidationIssue", ["section", "entry", "target", "value", "message"])
+
+#Profiling. dlc() and build() report each stage of their work as a span: the
+#file reads, mapping the header, each section's parse and compile, and the
+#header write. A span records its stage, section, the bytes it handled and any
+#file read()/write() calls; profilers that time spans add the wall time and the
+#change in allocated blocks (and traced bytes, if tracemalloc is running.)
+class ProfileSpan(object):
+
+	__slots__ = ("stage", "section", "bytes", "reads", "writes", "wall_s", "alloc_blocks", "alloc_bytes")
+
+	def __init__(self, stage, section=None, nbytes=0):
+		self.stage = stage
+		self.section = section
+		self.bytes = nbytes
+		self.reads = 0
+		self.writes = 0
+		self.wall_s = None
+		self.alloc_blocks = None
+		self.alloc_bytes = None
+
+	def as_dict(self):
+		return {k : getattr(self, k) for k in self.__slots__}
+
+	def __repr__(self):
+		return "ProfileSpan(%s)" % ", ".join("%s=%r" % (k, getattr(self, k)) for k in self.__slots__)
+
+#The default profiler, which does nothing. Subclass it and override span() to
+#send spans somewhere else; set `enabled` to have file write() calls counted.
+class Profiler(object):
+
+	enabled = False
+
+	def span(self, stage, section=None, nbytes=0):
+		return contextlib.nullcontext(ProfileSpan(stage, section, nbytes))
+
+#Keeps every span (and passes each to `callback`, if given, as it finishes.)
+class SpanRecorder(Profiler):
+
+	enabled = True
+
+	def __init__(self, callback=None):
+		self.spans = []
+		self.callback = callback
+
+	@contextlib.contextmanager
+	def span(self, stage, section=None, nbytes=0):
+
+		import tracemalloc
+		record = ProfileSpan(stage, section, nbytes)
+		tracing = tracemalloc.is_tracing()
+		traced = tracemalloc.get_traced_memory()[0] if tracing else None
+		blocks = sys.getallocatedblocks()
+		start = time.perf_counter()
+		try:
+			yield record
+		finally:
+			record.wall_s = time.perf_counter() - start
+			record.alloc_blocks = sys.getallocatedblocks() - blocks
+			if tracing:
+				record.alloc_bytes = tracemalloc.get_traced_memory()[0] - traced
+			self.spans.append(record)
+			if (self.callback is not None):
+				self.callback(record)
+
+	#Totals per (stage, section), in the order first seen.
+	def summary(self):
+
+		totals = {}
+		for r in self.spans:
+			t = totals.setdefault((r.stage, r.section), {"stage" : r.stage, "section" : r.section, "count" : 0, "wall_s" : 0.0, "bytes" : 0, "reads" : 0, "writes" : 0})
+			t["count"] += 1
+			t["wall_s"] += r.wall_s
+			t["bytes"] += r.bytes
+			t["reads"] += r.reads
+			t["writes"] += r.writes
+		return list(totals.values())
+
+#Passes write() calls through to a file, counting them.
+class CountingWriter(object):
+
+	def __init__(self, target):
+		self.target = target
+		self.writes = 0
+
+	def write(self, data):
+		self.writes += 1
+		return self.target.write(data)
+
+#Per-track audio metadata, one dict per row. Sortable, printable, and can be
+#saved next to a DLC so other tools don't need to parse it again.
+class TrackIndex(list):
+
+	columns = ["track", "bitrate", "sample_rate", "frames", "duration_ms", "bytes"]
+
+	def sort_by(self, column, reverse=False):
+		return TrackIndex(sorted(self, key=lambda row: row[column], reverse=reverse))
+
+	def column(self, name):
+		return [row[name] for row in self]
+
+	def total(self, name):
+		return sum(self.column(name))
+
+	def __str__(self):
+
+		widths = [max([len(c)] + [len(str(row[c])) for row in self]) for c in self.columns]
+		lines = ["  ".join(c.rjust(w) for c, w in zip(self.columns, widths))]
+		for row in self:
+			lines.append("  ".join(str(row[c]).rjust(w) for c, w in zip(self.columns, widths)))
+		return "\n".join(lines)
+
+	def save(self, path):
+
+		import json
+		with open(path, "w") as f:
+			json.dump({"columns" : self.columns, "rows" : [[row[c] for c in self.columns] for row in self]}, f)
+
+	@classmethod
+	def load(cls, path):
+
+		import json
+		with open(path, "r") as f:
+			data = json.load(f)
+		return cls(dict(zip(data["columns"], row)) for row in data["rows"])
+
+#A list of word lists, packed compressed-sparse-row style: every list's words
+#back to back in one array of uint16 values, plus an array of offsets where
+#offsets[i]:offsets[i+1] is list i. Indexing gives a PackedRow view that acts
+#like a list, so code that treats these as lists of lists keeps working, while
+#the values array can be written out, or analysed, in one go.
+#
+#Views that are held on to follow their list as rows are inserted or deleted
+#before it, and one whose list is replaced or deleted keeps a private copy of
+#it, as a list of lists would. tolist() gives plain lists (for json, say.)
+class PackedLists(MutableSequence):
+
+	def __init__(self, lists=None):
+
+		self.values = array.array("H")
+		self.offsets = array.array("I", [0])
+		self.views = weakref.WeakValueDictionary()
+		if (lists is not None):
+			for row in lists:
+				self.values.extend(self.__encode_row__(row))
+				self.offsets.append(len(self.values))
+
+	@classmethod
+	def from_arrays(cls, values, offsets):
+
+		packed = cls()
+		packed.values = values
+		packed.offsets = offsets
+		return packed
+
+	#Hooks for subclasses that store something other than plain words.
+	def __encode__(self, item):
+		return item
+
+	def __decode__(self, word):
+		return word
+
+	def __encode_row__(self, row):
+		return array.array("H", [self.__encode__(item) for item in row])
+
+	def __row_index__(self, i):
+
+		if (i < 0):
+			i += len(self)
+		if not (0 <= i < len(self)):
+			raise IndexError("list index out of range")
+		return i
+
+	#Shift every offset after row i by delta.
+	def __shift__(self, i, delta):
+
+		if (delta != 0):
+			self.offsets[i+1:] = array.array("I", [o + delta for o in self.offsets[i+1:]])
+
+	#Move the views of rows i onwards by delta rows.
+	def __move_views__(self, i, delta):
+
+		moved = [(r, self.views.pop(r, None)) for r in [r for r in self.views.keys() if (r >= i)]]
+		for r, view in moved:
+			if (view is not None):
+				view.row = r + delta
+				self.views[r + delta] = view
+
+	#Give the view of row i, if anyone holds one, its own copy of the row, as
+	#the row is about to be replaced or deleted.
+	def __detach_view__(self, i):
+
+		view = self.views.pop(i, None)
+		if (view is not None):
+			start, end = self.offsets[i], self.offsets[i+1]
+			view.parent = self.__class__.from_arrays(self.values[start:end], array.array("I", [0, end - start]))
+			view.row = 0
+			view.parent.views[0] = view
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, i):
+
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		i = self.__row_index__(i)
+		view = self.views.get(i)
+		if (view is None):
+			view = self.views[i] = PackedRow(self, i)
+		return view
+
+	def __setitem__(self, i, row):
+
+		if isinstance(i, slice):
+			indices = range(*i.indices(len(self)))
+			rows = [list(r) for r in self]
+			rows[i] = [list(r) for r in row]
+			for j in indices:
+				self.__detach_view__(j)
+			if (indices.step == 1):
+				self.__move_views__(max(indices.start, indices.stop), len(rows) - len(self))
+			replacement = self.__class__(rows)
+			self.values, self.offsets = replacement.values, replacement.offsets
+			return
+
+		i = self.__row_index__(i)
+		self.__detach_view__(i)
+		self.__replace_row__(i, row)
+
+	#Replace row i's words in place (its view, if any, stays with it.)
+	def __replace_row__(self, i, row):
+
+		new_words = self.__encode_row__(row)
+		start, end = self.offsets[i], self.offsets[i+1]
+		self.values[start:end] = new_words
+		self.__shift__(i, len(new_words) - (end - start))
+
+	def __delitem__(self, i):
+
+		if isinstance(i, slice):
+			for j in sorted(range(*i.indices(len(self))), reverse=True):
+				del self[j]
+			return
+
+		i = self.__row_index__(i)
+		self.__detach_view__(i)
+		start, end = self.offsets[i], self.offsets[i+1]
+		del self.values[start:end]
+		del self.offsets[i+1]
+		self.__shift__(i, start - end)
+		self.__move_views__(i + 1, -1)
+
+	def insert(self, i, row):
+
+		i = max(0, min(len(self), (i + len(self)) if (i < 0) else i))
+		new_words = self.__encode_row__(row)
+		start = self.offsets[i]
+		self.values[start:start] = new_words
+		self.offsets.insert(i+1, start)
+		self.__shift__(i, len(new_words))
+		self.__move_views__(i, 1)
+
+	def row_lengths(self):
+		return [self.offsets[i+1] - self.offsets[i] for i in range(len(self))]
+
+	def __eq__(self, other):
+
+		if isinstance(other, PackedLists):
+			return (self.values == other.values) and (self.offsets == other.offsets)
+		try:
+			return (len(self) == len(other)) and all(a == b for a, b in zip(self, other))
+		except TypeError:
+			return NotImplemented
+
+	__hash__ = None
+
+	def copy(self):
+		return self.__class__.from_arrays(array.array(self.values.typecode, self.values), array.array(self.offsets.typecode, self.offsets))
+
+	#Views can't be pickled (or deep-copied), but they're rebuilt on demand.
+	def __reduce__(self):
+		return (self.__class__.from_arrays, (self.values, self.offsets))
+
+	def tolist(self):
+		return [row.tolist() for row in self]
+
+	def __repr__(self):
+		return repr(self.tolist())
+
+	#The values as little-endian bytes; a view rather than a copy where possible.
+	def packed_bytes(self):
+
+		if (sys.byteorder == "little"):
+			return memoryview(self.values).cast("B")
+		swapped = array.array("H", self.values)
+		swapped.byteswap()
+		return swapped.tobytes()
+
+#One list in a PackedLists.
+class PackedRow(MutableSequence):
+
+	__slots__ = ("parent", "row", "__weakref__")
+
+	def __init__(self, parent, row):
+		self.parent = parent
+		self.row = row
+
+	def __bounds__(self):
+		return self.parent.offsets[self.row], self.parent.offsets[self.row+1]
+
+	def __len__(self):
+
+		start, end = self.__bounds__()
+		return end - start
+
+	def __iter__(self):
+
+		start, end = self.__bounds__()
+		decode = self.parent.__decode__
+		for word in self.parent.values[start:end]:
+			yield decode(word)
+
+	def __getitem__(self, i):
+
+		start, end = self.__bounds__()
+		if isinstance(i, slice):
+			return [self.parent.__decode__(w) for w in self.parent.values[start:end][i]]
+		if (i < 0):
+			i += end - start
+		if not (0 <= i < end - start):
+			raise IndexError("list index out of range")
+		return self.parent.__decode__(self.parent.values[start + i])
+
+	def __setitem__(self, i, item):
+
+		if isinstance(i, slice):
+			items = list(self)
+			items[i] = item
+			self.parent.__replace_row__(self.row, items)
+			return
+
+		start, end = self.__bounds__()
+		if (i < 0):
+			i += end - start
+		if not (0 <= i < end - start):
+			raise IndexError("list assignment index out of range")
+		self.parent.values[start + i] = self.parent.__encode__(item)
+
+	def __delitem__(self, i):
+
+		items = list(self)
+		del items[i]
+		self.parent.__replace_row__(self.row, items)
+
+	def insert(self, i, item):
+
+		items = list(self)
+		items.insert(i, item)
+		self.parent.__replace_row__(self.row, items)
+
+	def __eq__(self, other):
+
+		try:
+			return list(self) == list(other)
+		except TypeError:
+			return NotImplemented
+
+	__hash__ = None
+
+	def __add__(self, other):
+		return list(self) + list(other)
+
+	def __radd__(self, other):
+		return list(other) + list(self)
+
+	def __mul__(self, n):
+		return list(self) * n
+
+	__rmul__ = __mul__
+
+	def copy(self):
+		return list(self)
+
+	def tolist(self):
+
+		start, end = self.__bounds__()
+		decode = self.parent.__decode__
+		return [decode(w) for w in self.parent.values[start:end]]
+
+	def __repr__(self):
+		return repr(self.tolist())
+
+#APL playlists: only the words are stored, since an entry's kind follows from
+#its value. Entries read back as (value, kind) tuples; either a tuple or a bare
+#word can be stored.
+class PackedPlaylists(PackedLists):
+
+	AUDIO, PAUSE, EOF = 0, 1, 2
+	kind_names = ("AUDIO", "PAUSE", "EOF")
+	entry_terminator = 0xf000
+
+	@classmethod
+	def kind_of(cls, word):
+
+		if (word == cls.entry_terminator):
+			return cls.EOF
+		elif (word & 0x1000 == 0x1000):
+			return cls.PAUSE
+		return cls.AUDIO
+
+	def __encode__(self, item):
+		return item[0] if isinstance(item, tuple) else item
+
+	def __decode__(self, word):
+		return (word, self.kind_names[self.kind_of(word)])
+
+	#The kind (AUDIO, PAUSE or EOF) of every entry, aligned with values.
+	def kinds(self):
+		return array.array("B", [self.kind_of(w) for w in self.values])
+
+#A section attribute that's always a PackedLists (of packed_class): a list of
+#lists assigned to it is packed there and then, so nothing that reads it (a
+#build, or a size query) ever has to.
+class PackedAttribute(object):
+
+	def __init__(self, packed_class):
+		self.packed_class = packed_class
+
+	def __set_name__(self, owner, name):
+		self.name = name
+
+	def __get__(self, obj, objtype=None):
+
+		if (obj is None):
+			return self
+		try:
+			return obj.__dict__[self.name]
+		except KeyError:
+			raise AttributeError(self.name)
+
+	def __set__(self, obj, value):
+
+		if not isinstance(value, self.packed_class):
+			value = self.packed_class(value)
+		obj.__dict__[self.name] = value
+
+#A list whose items start out shared with another list. A shared item is
+#copied (with copy_item) the first time it's read from this list, so changes
+#made through either list never show up in the other. Reading the items raw,
+#without copying, is list.__iter__(self).
+class CopyOnWriteList(list):
+
+	def __init__(self, items=(), copy_item=copy.deepcopy):
+		#Keep the shared items alive, so their ids can't be reused.
+		self.originals = tuple(items)
+		list.__init__(self, self.originals)
+		self.copy_item = copy_item
+		self.shared = set(map(id, self.originals))
+
+	def __own__(self, i):
+		item = list.__getitem__(self, i)
+		if id(item) in self.shared:
+			item = self.copy_item(item)
+			list.__setitem__(self, i, item)
+		return item
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self.__own__(j) for j in range(*i.indices(len(self)))]
+		return self.__own__(i)
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self.__own__(i)
+
+	def __reversed__(self):
+		for i in reversed(range(len(self))):
+			yield self.__own__(i)
+
+	def pop(self, i=-1):
+		item = self.__own__(i)
+		list.pop(self, i)
+		return item
+
+	def copy(self):
+		return list(self)
+
+	def __add__(self, other):
+		return list(self) + list(other)
+
+	def __mul__(self, n):
+		return list(self) * n
+
+	__rmul__ = __mul__
+
+	def __reduce_ex__(self, protocol):
+		return (list, (list(self),))
+
+#dlc.dlc_sections. After dlc.clone(), a section is shared between the clones
+#until one of them looks it up, at which point that clone gets its own copy
+#(from the section's __clone__()); untouched sections are never copied.
+#
+#A section that has been looked up (or put in) may still be held by whoever
+#got it, and edited in place, so it's never shared by clone(): the clone gets
+#a copy straight away, and the original stays with the map it came from.
+class _SectionMap(dict):
+
+	def __init__(self, *args, **kwargs):
+		dict.__init__(self, *args, **kwargs)
+		self.shared = set()
+		#Names of the sections handed out (see above.)
+		self.handed = set()
+
+	def __getitem__(self, name):
+		section = dict.__getitem__(self, name)
+		if name in self.shared:
+			section = section.__clone__()
+			dict.__setitem__(self, name, section)
+			self.shared.discard(name)
+		self.handed.add(name)
+		return section
+
+	def __setitem__(self, name, section):
+		self.shared.discard(name)
+		self.handed.add(name)
+		dict.__setitem__(self, name, section)
+
+	def __delitem__(self, name):
+		self.shared.discard(name)
+		self.handed.discard(name)
+		dict.__delitem__(self, name)
+
+	def get(self, name, default=None):
+		return self[name] if (name in self) else default
+
+	def values(self):
+		return [self[name] for name in self]
+
+	def items(self):
+		return [(name, self[name]) for name in self]
+
+	def pop(self, name, *default):
+		if (name not in self):
+			return dict.pop(self, name, *default)
+		section = self[name]
+		del self[name]
+		return section
+
+	def setdefault(self, name, default=None):
+		if (name not in self):
+			self[name] = default
+		return self[name]
+
+	def update(self, *args, **kwargs):
+		for name, section in dict(*args, **kwargs).items():
+			self[name] = section
+
+	#A new map sharing every section with this one (which shares them back.)
+	def share(self):
+		self.shared.update(self.keys())
+		new = _SectionMap()
+		dict.update(new, dict.items(self))
+		new.shared.update(self.keys())
+		new.handed.update(self.handed)
+		return new
+
+	#A new map for dlc.clone() or an EditJournal snapshot: shares the sections
+	#nobody has been handed, and gives it its own copies of the rest.
+	def fork(self):
+		new = _SectionMap()
+		for name, section in dict.items(self):
+			if (name in self.handed):
+				dict.__setitem__(new, name, section.__clone__(deep=True))
+			else:
+				self.shared.add(name)
+				dict.__setitem__(new, name, section)
+				new.shared.add(name)
+		return new
+
+	#Look up a section without copying it.
+	def peek(self, name):
+		return dict.__getitem__(self, name)
+
+#One transaction in an EditJournal: its label, the sections as they were
+#before it, and what it changed ({section : keys of the assets changed}.)
+JournalEntry = namedtuple("JournalEntry", ["label", "before", "changes"])
+
+#Records edits to a dlc (see dlc.start_journal()), so they can be undone and
+#redone, and lets build() recompile only the sections changed since the last
+#build. Edits are made inside `with journal.edit(label):`; if one raises, the
+#DLC is rolled back to how it was before it.
+#
+#This leans on copy-on-write (see _SectionMap): before each edit the sections
+#nobody has been handed are shared with a snapshot, so the edit gets copies of
+#whatever it looks up, and the snapshot is left as it was. Sections that have
+#been handed out may be edited in place through a reference held from before,
+#so the snapshot gets its own copies of those (see _SectionMap.fork().)
+#
+#Builds don't rely on that either: a section is only reused whole if it has
+#never been handed out, and cels are checked against their pixels before
+#their packed bytes are reused.
+class EditJournal(object):
+
+	#Section attributes that aren't part of its content.
+	bookkeeping = ("rawbytes", "cursor", "length")
+
+	def __init__(self, D):
+		self.dlc = D
+		self.undo_stack = []
+		self.redo_stack = []
+		#The sections as of the last build (or when the journal was started.)
+		self.base = D.dlc_sections.fork()
+		#What the last build wrote: {section : (section object, chunks)}
+		self.compiled = {}
+		#Packed cels from the last build (see CEL_section.iter_chunks_cached.)
+		self.cel_cache = {}
+
+	@contextlib.contextmanager
+	def edit(self, label=None):
+
+		before = self.dlc.dlc_sections.fork()
+		try:
+			yield
+		except BaseException:
+			self.dlc.dlc_sections = before.share()
+			raise
+
+		changes = self.diff(before, self.dlc.dlc_sections)
+		if (changes):
+			self.undo_stack.append(JournalEntry(label, before, changes))
+			self.redo_stack = []
+
+	#Undoes the last edit, returning its entry (or None if there's nothing to undo.)
+	def undo(self):
+
+		if (not self.undo_stack):
+			return None
+		entry = self.undo_stack.pop()
+		self.redo_stack.append((entry, self.dlc.dlc_sections.fork()))
+		self.dlc.dlc_sections = entry.before.share()
+		return entry
+
+	def redo(self):
+
+		if (not self.redo_stack):
+			return None
+		entry, after = self.redo_stack.pop()
+		self.undo_stack.append(entry)
+		self.dlc.dlc_sections = after.share()
+		return entry
+
+	#What's changed since the last build: {section : keys of the assets changed}.
+	def touched(self):
+		return self.diff(self.base, self.dlc.dlc_sections)
+
+	#Compares two section maps. Sections are compared by identity first (a
+	#section nobody has looked up is still the same object), then asset by
+	#asset. A section in the result with no assets listed had some other
+	#field changed; None means the section was added or removed.
+	def diff(self, before, after):
+
+		changes = {}
+		for name in set(before) | set(after):
+
+			if ((name not in before) or (name not in after)):
+				changes[name] = None
+				continue
+
+			old, new = dict.__getitem__(before, name), dict.__getitem__(after, name)
+			if (old is new):
+				continue
+
+			assets = self.__asset_changes__(old, new)
+			fields = [k for k in vars(new) if (k not in self.bookkeeping) and (k != new.assets) and (vars(old).get(k) != vars(new)[k])]
+			if (assets or fields):
+				changes[name] = assets
+		return changes
+
+	@staticmethod
+	def __asset_changes__(old, new):
+
+		if (new.assets is None):
+			return set()
+		a, b = getattr(old, old.assets), getattr(new, new.assets)
+
+		if isinstance(a, dict):
+			return {k for k in set(a) | set(b) if (k not in a) or (k not in b) or not ((a[k] is b[k]) or (a[k] == b[k]))}
+
+		if (isinstance(a, PackedLists) and isinstance(b, PackedLists)):
+			item = lambda l, i: l.values[l.offsets[i]:l.offsets[i+1]]
+		else:
+			item = lambda l, i: list.__getitem__(l, i) if isinstance(l, list) else l[i]
+
+		changed = set(range(min(len(a), len(b)), max(len(a), len(b))))
+		for i in range(min(len(a), len(b))):
+			x, y = item(a, i), item(b, i)
+			if not ((x is y) or (x == y)):
+				changed.add(i)
+		return changed
+
+	#Called by build() with what it wrote.
+	def __built__(self, sections, compiled):
+
+		#Keep chunks that are views of anything but immutable bytes as copies.
+		self.compiled = {
+			name : (sections[name], [bytes(c) if (isinstance(c, memoryview) and not isinstance(c.obj, bytes)) else c for c in chunks])
+			for name, chunks in compiled.items()
+		}
+		if ("CEL" in sections):
+			live = {id(cel) for cel in list.__iter__(sections["CEL"].cels)}
+			self.cel_cache = {k : v for k, v in self.cel_cache.items() if k in live}
+		self.base = self.dlc.dlc_sections.fork()
+
+#Sections that compile into their own buffer can't be compiled by two builds
+#at once; this is held while a build compiles such a section that's shared.
+shared_compile_lock = threading.Lock()
+
 class dlc(object):
 
 	class dlcsection(object):
 
+		#The attribute holding the section's assets (cels, tracks...), which
+		#EditJournal reports changes to one by one.
+		assets = None
+
 		def __init__(self, bytes_in=None):
 
 			if (bytes_in is not None):
@@ -85,7 +865,12 @@ class dlc(object):
 				self.rawbytes = self.rawbytes[:self.cursor] + bytes_in_encoded + self.rawbytes[self.cursor+len(bytes_in_encoded):]
 				self.cursor += len(bytes_in_encoded)
 			elif (t == bytes):
-				self.rawbytes = self.rawbytes[:self.cursor] + bytes_in + self.rawbytes[self.cursor+len(bytes_in):]
+				#Sections that write piecemeal can compile into a bytearray, which is
+				#overwritten in place rather than rebuilt on every write.
+				if (type(self.rawbytes) == bytearray):
+					self.rawbytes[self.cursor:self.cursor+len(bytes_in)] = bytes_in
+				else:
+					self.rawbytes = self.rawbytes[:self.cursor] + bytes_in + self.rawbytes[self.cursor+len(bytes_in):]
 				self.cursor += len(bytes_in)
 			elif (t == int):
 				self.rawbytes = self.rawbytes[:self.cursor] + bytes([bytes_in]) + self.rawbytes[self.cursor+1:]
@@ -117,15 +902,86 @@ class dlc(object):
 
 		def write_out(self, target=None):
 
-			self.__compile__()
-			
 			#If no file handle supplied, simply return the string.
 			if (target is None):
+				self.__compile__()
 				return self.rawbytes
 
-			#Otherwise, attempt to write to file handle.
+			#Otherwise, stream the section out to the file handle.
 			else:
-				target.write(self.rawbytes)
+				for chunk in self.iter_chunks():
+					target.write(chunk)
+
+		#Yields the compiled section a piece at a time. Sections that can work
+		#out their content piecemeal override this (and compiled_size()) so they
+		#never need to be held in memory as one string.
+		def iter_chunks(self):
+			self.__compile__()
+			yield self.rawbytes
+
+		#iter_chunks(), for sections that can reuse pieces of an earlier build
+		#kept in `cache` (see EditJournal.)
+		def iter_chunks_cached(self, cache):
+			return self.iter_chunks()
+
+		#Length of this section once compiled.
+		def compiled_size(self):
+			self.__compile__()
+			return len(self.rawbytes)
+
+		#For sections that implement iter_chunks(): compile by joining the chunks.
+		def __join_chunks__(self):
+			self.rawbytes = b"".join(self.iter_chunks())
+			self.length = len(self.rawbytes)
+			self.__seek__(0)
+
+		#The section's bytes as an array of little-endian words, starting at byte 0 or 1.
+		def __words__(self, parity=0):
+
+			words = array.array("H")
+			words.frombytes(self.rawbytes[parity:parity + ((self.length - parity) & ~1)])
+			if (sys.byteorder == "big"):
+				words.byteswap()
+			return words
+
+		#Reads the terminated word lists at each of the given byte offsets, in bulk:
+		#each list's terminator is found with one scan over the section's words,
+		#and the list is sliced out whole into a PackedLists (or the given
+		#subclass.) Each list keeps its terminator.
+		def __read_word_lists__(self, byte_offsets, terminator, packed_class=None):
+
+			views = {}
+			values = array.array("H")
+			offsets = array.array("I", [0])
+			for offset in byte_offsets:
+
+				parity = offset & 1
+				if (parity not in views):
+					views[parity] = self.__words__(parity)
+				words = views[parity]
+				start = offset >> 1
+
+				try:
+					end = words.index(terminator, start) + 1
+				except ValueError:
+					raise FormatError("Unterminated entry at offset 0x%x in %s section." % (offset, self.get_name()))
+
+				values.extend(words[start:end])
+				offsets.append(len(values))
+
+			return (packed_class or PackedLists).from_arrays(values, offsets)
+
+		#An independent copy of this section, for dlc.clone(). Bytes are
+		#immutable, so they're shared; everything else is copied.
+		def __clone__(self, deep=False):
+
+			new = copy.copy(self)
+			for attr, value in vars(self).items():
+				if isinstance(value, PackedLists):
+					setattr(new, attr, value.copy())
+				elif not isinstance(value, (bytes, memoryview, int, str, type(None))):
+					setattr(new, attr, copy.deepcopy(value))
+			return new
 
 		#Implement these per-class.
 		def __compile__(self):
@@ -141,9 +997,10 @@ class dlc(object):
 	#couple of weird magic values tho
 	class HEADER_section(dlcsection):
 		
-		magic_bytes = (b"\x00".join([bytes([c]) for c in b"FURBY"])) + (b"\x00" * 23) + (b"\x78\x56\x34\x12\x02\x00\x08\x00")
+		#"FURBY" in UTF-16LE, padding, then what looks like a version stamp.
+		magic_bytes = b"F\x00U\x00R\x00B\x00Y\x00" + (b"\x00" * 22) + b"\x78\x56\x34\x12\x02\x00\x08\x00"
 		main_header_length = 0x288
-		default_prefix = (b"\x00".join([bytes([c]) for c in b"DLC_0000."]))+ b"\x00"
+		default_prefix = b"D\x00L\x00C\x00_\x000\x000\x000\x000\x00.\x00"	#"DLC_0000." in UTF-16LE
 		weird_counter_initial_value = 0x0040cfb5
 		section_entry_length = 38
 
@@ -253,6 +1110,8 @@ class dlc(object):
 	#All fields identified.
 	class PAL_section(dlcsection):
 
+		assets = "palettes"
+
 		palette_size = 0x80
 		num_colours = 64
 
@@ -291,11 +1150,14 @@ class dlc(object):
 					self.palettes.append(this_pal)
 
 		def __compile__(self):
+			self.__join_chunks__()
 
-			self.rawbytes = b""
-			self.__seek__(0)
+		#One palette per chunk.
+		def iter_chunks(self):
 
 			for p in self.palettes:
+
+				colours = []
 				for C in p:
 					
 					#Unpack into 16-bit RGBA.
@@ -305,14 +1167,20 @@ class dlc(object):
 					B = (C[2] & 0b11111000) >> 3
 					A = 0b1000000000000000 if (C[3] == 0) else 0
 					
-					single_colour = R+G+B+A
-					self.__pack__(single_colour, 2)
+					colours.append(R+G+B+A)
+
+				yield struct.pack("<%dH" % len(colours), *colours)
+
+		def compiled_size(self):
+			return 2 * sum(len(p) for p in self.palettes)
 
 		def get_name(self):
 			return "PAL"
 
 		def extract_palette(self, filename_in, pad=True):
 
+			from PIL import Image as PILImage
+
 			im = PILImage.open(filename_in)
 
 			p = im.palette.getdata()
@@ -372,12 +1240,20 @@ class dlc(object):
 	#One weird byte left to identify.
 	class SPR_section(dlcsection):
 
+		assets = "frames"
+
 		t1_terminator = 0x40
 		t3_terminator = 0xffff
 		t1_length = 0xe0
 
 		channels_per_anim = 8
 
+		#Frames are four (cel, ???) word pairs then the terminator. The second word
+		#of each pair looks to pick the palette in bits 10-11 (it's always 0x10f2,
+		#0x14f2, 0x18f2 or the same with 0xf6 in the wild; the rest is still unknown.)
+		palette_shift = 10
+		palette_mask = 0x3
+
 		def __initialise__(self):
 
 			self.frame_playlists = []
@@ -424,17 +1300,20 @@ class dlc(object):
 
 				#Build "frames", checking for missing/unreferenced frames.
 				all_frame_offsets = list(range(self.t1_length//2, max(interim_frames)+1, 9))
-				for i in all_frame_offsets:
-					
-					if i not in interim_frames:
-						print("dead frame at index %02d" % i)
-						interim_frames[i] = [0,1,0,1,0,1,0,1,self.t3_terminator]
+				dead_frames = [i for i in all_frame_offsets if i not in interim_frames]
+				for i in dead_frames:
+					interim_frames[i] = [0,1,0,1,0,1,0,1,self.t3_terminator]
+
+				if (dead_frames):
+					log_event(logging.DEBUG, "dead_frames", "SPR: %d unreferenced frame(s) filled in", len(dead_frames),
+						section="SPR", offset=dead_frames[0] * 2, count=len(dead_frames), offsets=[i * 2 for i in dead_frames])
 
 				self.frames = [interim_frames[i] for i in all_frame_offsets]
 
 				#Fix up t3 indices.
+				frame_index = {offset : n for n, offset in enumerate(all_frame_offsets)}
 				for w in range(16):
-					self.frame_playlists[w]["frame_indices"] = [all_frame_offsets.index(i) for i in self.frame_playlists[w]["t3_offsets_raw"]]
+					self.frame_playlists[w]["frame_indices"] = [frame_index[i] for i in self.frame_playlists[w]["t3_offsets_raw"]]
 
 				#Fix up t2 indices.
 				t2offsets = sorted(list(t2offsets))
@@ -448,10 +1327,7 @@ class dlc(object):
 			self.__seek__(0)
 
 			#build t3.
-			t3_raw = b""
-			for f in self.frames:
-				for i in f:
-					t3_raw += struct.pack("<H", i)
+			t3_raw = b"".join([struct.pack("<%dH" % len(f), *f) for f in self.frames])
 
 			#Fix up t3 offsets.
 			word_offset, checknum = divmod(self.t1_length,2)
@@ -460,7 +1336,7 @@ class dlc(object):
 				self.frame_playlists[w]["t3_offsets_raw"] = [ ((i * 9) + word_offset) for i in self.frame_playlists[w]["frame_indices"] ]
 
 			#Fix up t2 offsets (and build t2.)
-			t2_raw = b""
+			t2_chunks = []
 			word_offset, checknum = divmod((self.t1_length+len(t3_raw)),2)
 			assert(checknum == 0)
 			ordered_by_t2_index = sorted(range(len(self.frame_playlists)), key=lambda w : self.frame_playlists[w]["framelist_index"])
@@ -468,8 +1344,9 @@ class dlc(object):
 				self.frame_playlists[w]["t2_offset_raw"] = word_offset
 				word_offset += 2 * len(self.frame_playlists[w]["frame_indices"])
 				
-				for i in self.frame_playlists[w]["t3_offsets_raw"]:
-					t2_raw += struct.pack("<I", i)
+				offsets = self.frame_playlists[w]["t3_offsets_raw"]
+				t2_chunks.append(struct.pack("<%dI" % len(offsets), *offsets))
+			t2_raw = b"".join(t2_chunks)
 
 			#Build t1.
 			for w in range(16):
@@ -484,6 +1361,9 @@ class dlc(object):
 			#Lay down t2.
 			self.__write__(t2_raw)
 
+		def compiled_size(self):
+			return self.t1_length + (18 * len(self.frames)) + (4 * sum(len(w["frame_indices"]) for w in self.frame_playlists))
+
 		def get_name(self):
 			return "SPR"
 
@@ -507,6 +1387,8 @@ class dlc(object):
 	#All fields identified.
 	class CEL_section(dlcsection):
 
+		assets = "cels"
+
 		frame_length = 0xc00
 		frame_width = 0x30	#	Thanks Jeija
 		frame_height = 0x40	#	Thanks Jeija
@@ -566,29 +1448,62 @@ class dlc(object):
 					self.cels.append(this_cel)
 
 		def __compile__(self):
+			self.__join_chunks__()
+
+		#One cel per chunk. (Cels are only read, so shared ones aren't copied.)
+		def iter_chunks(self):
+			for cel in list.__iter__(self.cels):
+				yield self.__pack_cel__(cel)
+
+		#Packing cels is the slowest part of a build, so reuse the packed bytes of
+		#any cel that's the very same object as last time, and still holds the
+		#same pixels (it may have been edited in place since.) cache maps id(cel)
+		#to (cel, a copy of its pixels, bytes); the cel is kept so its id can't
+		#be reused.
+		def iter_chunks_cached(self, cache):
+
+			for cel in list.__iter__(self.cels):
+				cached = cache.get(id(cel))
+				if ((cached is None) or (cached[1] != cel)):
+					cached = cache[id(cel)] = (cel, [row[:] for row in cel], self.__pack_cel__(cel))
+				yield cached[2]
+
+		#Cels are big and rarely all edited, so a clone shares them; each cel
+		#is copied when it's first used (see CopyOnWriteList.) A deep clone
+		#copies them all, so edits made in place to this section's cels can't
+		#show up in it.
+		def __clone__(self, deep=False):
+
+			new = copy.copy(self)
+			if (deep):
+				new.cels = [[row[:] for row in cel] for cel in list.__iter__(self.cels)]
+			else:
+				new.cels = CopyOnWriteList(list.__iter__(self.cels), lambda cel: [row[:] for row in cel])
+			return new
 
-			self.rawbytes = b""
-			self.__seek__(0)
+		def compiled_size(self):
+			return self.frame_length * len(self.cels)
+
+		def __pack_cel__(self, cel):
 
 			#Pretty easy.
-			for cel in self.cels:
+			packed = bytearray()
 
-				for row in range(self.cel_height):
-					
-					#four pixels are packed into three bytes.
-					assert(len(cel[row]) == self.cel_width)
-					for column in range(self.cel_width // 4):
+			for row in range(self.cel_height):
+				
+				#four pixels are packed into three bytes.
+				assert(len(cel[row]) == self.cel_width)
+				for column in range(self.cel_width // 4):
 
-						pixels = cel[row][(column*4):((column+1)*4)]
-						
-						bytevals = [
-							(pixels[0] << 2) + (pixels[1] >> 4),
-							((pixels[1] & 0x0f) << 4) + (pixels[2] >> 2),
-							((pixels[2] & 0x03) << 6) + pixels[3]
-						]
+					pixels = cel[row][(column*4):((column+1)*4)]
+					
+					packed.extend((
+						(pixels[0] << 2) + (pixels[1] >> 4),
+						((pixels[1] & 0x0f) << 4) + (pixels[2] >> 2),
+						((pixels[2] & 0x03) << 6) + pixels[3]
+					))
 
-						for b in bytevals:
-							self.__pack__(b, 1)
+			return bytes(packed)
 
 
 		def get_name(self):
@@ -596,6 +1511,8 @@ class dlc(object):
 
 		def draw_frame_greyscale(self, cel_number, filename_out):
 
+			from PIL import Image as PILImage
+
 			im = PILImage.new("RGB", (self.cel_width, self.cel_height), "white")
 
 			cel = self.cels[cel_number]
@@ -612,6 +1529,8 @@ class dlc(object):
 
 		def quarterize(self, filename_in, demo_palette=None):
 
+			from PIL import Image as PILImage
+
 			quarters = []
 
 			try:
@@ -660,6 +1579,8 @@ class dlc(object):
 
 		def peek_image(self, im_in, colourmap_in):
 
+			from PIL import Image as PILImage
+
 			h = len(im_in)
 			w = len(im_in[0])
 
@@ -693,6 +1614,8 @@ class dlc(object):
 	#several fields in the T3 and T4 entries in need of identification tho
 	class XLS_section(dlcsection):
 
+		assets = "action_tree"
+
 		default_header_entry_length = 0x03
 
 		def __initialise__(self):
@@ -833,13 +1756,9 @@ class dlc(object):
 									"seq"		:	rawbytes[0]
 								}
 
-		def __compile__(self):
-
-			#Initialise.
-			self.rawbytes = b""
-			self.__seek__(0)
+		#The sizes of the type-1, -2, -3, and -4 sub-sections.
+		def __subsection_lengths__(self):
 
-			#Work out the sizes of the type-1, -2, -3, and -4 sub-sections.
 			# Simplified from nested comprehensions for better readability and performance
 			type1_len = 6 * (1 + len(self.action_tree))
 			type2_len = sum(6 * self.action_tree[i]["entries"] for i in self.action_tree)
@@ -857,9 +1776,17 @@ class dlc(object):
 					for k in range(self.action_tree[i][j]["entries"]):
 						type4_len += 10 * self.action_tree[i][j][k]["entries"]
 
+			return [type1_len, type2_len, type3_len, type4_len]
+
+		def compiled_size(self):
+			return sum(self.__subsection_lengths__())
+
+		def __compile__(self):
+
 			#Prepopulate this section's content with zeroes (as we'll 
 			#be hopping around quite a bit.)
-			self.__write__(b"\x00" * sum([type1_len, type2_len, type3_len, type4_len]))
+			self.rawbytes = bytearray(self.compiled_size())
+			self.length = len(self.rawbytes)
 			self.__seek__(0)
 
 			#Start with the "number of type-1 entries" word.
@@ -920,17 +1847,60 @@ class dlc(object):
 								self.__pack__(self.action_tree[i][j][k][l]["vals"][3], 2)
 								self.__pack__(self.action_tree[i][j][k][l]["vals"][4], 2)
 
+			self.rawbytes = bytes(self.rawbytes)
 
 		def get_name(self):
 			return "XLS"
 
+		#Lays the tree's entries out back to back, the way Hasbro's tools do
+		#(type-1, type-2, type-4, then type-3 entries), re-pointing every entry.
+		#Needed after adding or removing entries, since __compile__() writes
+		#each entry where it points.
+		def pack_tree(self):
+
+			tree = self.action_tree
+			type1_len, type2_len, type3_len, type4_len = self.__subsection_lengths__()
+
+			type2_cursor = type1_len
+			type4_cursor = type1_len + type2_len
+			type3_cursor = type1_len + type2_len + type4_len
+
+			for n, i in enumerate(tree):
+				tree[i]["address"] = 6 * (1 + n)
+				tree[i]["points_at"] = type2_cursor
+				tree[i]["length"] = 6 * tree[i]["entries"]
+
+				for j in range(tree[i]["entries"]):
+					tree[i][j]["address"] = type2_cursor
+					tree[i][j]["points_at"] = type3_cursor
+					tree[i][j]["length"] = 20 * tree[i][j]["entries"]
+					type2_cursor += 6
+
+					for k in range(tree[i][j]["entries"]):
+						node = tree[i][j][k]
+						node["address"] = type3_cursor
+						node["points_at"] = type4_cursor
+						node["length"] = 10 * node["entries"]
+						node["raw"][2] = node["entries"]
+						node["raw"][3] = type4_cursor >> 1
+						type3_cursor += 20
+
+						for l in range(node["entries"]):
+							node[l]["address"] = type4_cursor
+							type4_cursor += 10
+
 	#Passes tests;
 	#All fields identified.
 	class AMF_section(dlcsection):
 
+		assets = "tracks"
+
 		a18_header = b"\x00\xff\x00\xffGENERALPLUS SP\x00\x00"
 		samplerate = 16000
 
+		#Tracks are kept as memoryviews into rawbytes (length dword included) until
+		#they're replaced, so parsing and rebuilding don't copy the audio around.
+		#Use bytes(track) if you need a copy of your own.
 		def __initialise__(self):
 			self.tracks = []
 
@@ -942,40 +1912,61 @@ class dlc(object):
 				track_count = self.__unpack__(4)
 
 				#Get track offsets.
-				track_offsets = []
-				for _ in range(track_count):
-					track_offsets.append(self.__unpack__(4))
+				track_offsets = struct.unpack_from("<%dI" % track_count, self.rawbytes, 4)
 
 				#Get tracks.
-				for track_offset in track_offsets:
-					self.__seek__(track_offset)
-					
-					lengthbytes = self.__read__(4)
-					length = struct.unpack("<I", lengthbytes)[0]
-					audiobytes = self.__read__(length)
-					self.tracks.append(lengthbytes + audiobytes)	
+				self.tracks = self.__track_views__(track_offsets)
 
-		def __compile__(self):
-			
-			#Initialise.
-			self.rawbytes = b""
-			self.__seek__(0)
+		#Slice each track (length dword + audio) out of rawbytes without copying it.
+		def __track_views__(self, track_offsets):
+
+			view = memoryview(self.rawbytes)
+			tracks = []
+			for track_offset in track_offsets:
+				length = struct.unpack_from("<I", self.rawbytes, track_offset)[0]
+				tracks.append(view[track_offset:(track_offset+4+length)])
+			return tracks
+
+		#The "number of entries" dword plus the offset to each track.
+		def __track_table__(self):
 
-			#Start with the "number of entries" dword.
-			self.__pack__(len(self.tracks), 4)
-			
 			#work out offset to first track
 			offset_to_next_track = 4 * (1 + len(self.tracks))
-			
-			#section header: write offsets to each track.
+
+			track_offsets = []
 			for t in self.tracks:
-				
-				self.__pack__(offset_to_next_track, 4)
+				track_offsets.append(offset_to_next_track)
 				offset_to_next_track += len(t)
 
-			#Lastly, write out the tracks proper.
+			return struct.pack("<%dI" % (1 + len(self.tracks)), len(self.tracks), *track_offsets)
+
+		def __compile__(self):
+
+			#Build the whole section in one go, then re-point the tracks at the new
+			#bytes so that whatever they used to reference can be freed.
+			track_table = self.__track_table__()
+			self.rawbytes = b"".join([track_table] + self.tracks)
+			self.length = len(self.rawbytes)
+			self.__seek__(0)
+
+			self.tracks = self.__track_views__(struct.unpack_from("<%dI" % len(self.tracks), track_table, 4))
+
+		def compiled_size(self):
+			return 4 * (1 + len(self.tracks)) + sum(len(t) for t in self.tracks)
+
+		#Stream the tracks straight out rather than compiling first.
+		def iter_chunks(self):
+
+			yield self.__track_table__()
 			for t in self.tracks:
-				self.__write__(t)
+				yield t
+
+		#Tracks are immutable (bytes, or views of the file), so a clone shares them.
+		def __clone__(self, deep=False):
+
+			new = copy.copy(self)
+			new.tracks = list(self.tracks)
+			return new
 
 		def get_name(self):
 			return "AMF"
@@ -1021,53 +2012,181 @@ class dlc(object):
 		def remove_track(self, track_number):
 			return self.tracks.pop(track_number)
 
+		#Keeps one copy of each distinct track (by content hash.)
+		#Returns a list mapping old track numbers to new ones, and the number of bytes saved.
+		def deduplicate(self):
+
+			import hashlib
+			survivors = {}
+			new_tracks = []
+			remap = []
+			reclaimed = 0
+
+			for t in self.tracks:
+				digest = hashlib.sha256(t).digest()
+				if digest in survivors:
+					remap.append(survivors[digest])
+					#The track itself, plus its entry in the offset table.
+					reclaimed += len(t) + 4
+				else:
+					survivors[digest] = len(new_tracks)
+					remap.append(len(new_tracks))
+					new_tracks.append(t)
+
+			self.tracks = new_tracks
+			return remap, reclaimed
+
 		def replace_track(self, tracknumber, trackpath):
 
 			self.remove_track(tracknumber)
 			self.add_track(trackpath, tracknumber)
 
+		#Each track is a length dword, a bitrate word, then fixed-size frames of
+		#20ms (bitrate/50 bits) each, so tracks can be cut and spliced at frame
+		#boundaries with plain byte copies; no decoding or re-encoding needed.
+		frame_ms = 20
+
+		#The frame a1800.dll encodes digital silence to at 16kbps (it makes up
+		#the gaps in the official DLC's tracks.)
+		silent_frame_16k = bytes.fromhex("8e0abd30833f00ff00000000000000000000ff00" + "ff" * 20)
+
+		def frame_size(self, bitrate=None):
+
+			if (bitrate is None):
+				bitrate = self.samplerate
+			if ((bitrate < 400) or (bitrate % 400)):
+				raise FormatError("Unsupported a18 bitrate %d." % bitrate)
+			return bitrate // 400
+
+		def track_bitrate(self, track):
+			return struct.unpack_from("<H", track, 4)[0]
+
+		#Returns a track's bitrate, and its frames as memoryviews into it.
+		def split_frames(self, track):
+
+			bitrate = self.track_bitrate(track)
+			size = self.frame_size(bitrate)
+			audio = memoryview(track)[6:]
+
+			if (len(audio) % size):
+				raise FormatError("Track is not a whole number of %d-byte frames." % size)
+
+			return bitrate, [audio[i:i+size] for i in range(0, len(audio), size)]
+
+		#Builds a track out of a list of frames.
+		def join_frames(self, frames, bitrate=None):
+
+			if (bitrate is None):
+				bitrate = self.samplerate
+			length = sum(len(f) for f in frames)
+			return b"".join([struct.pack("<IH", length + 2, bitrate)] + list(frames))
+
+		def frame_count(self, track):
+			return (len(track) - 6) // self.frame_size(self.track_bitrate(track))
+
+		#Frames [start, end) of a track; negative indices count from the end, as for slices.
+		def trim_track(self, track, start=0, end=None):
+
+			bitrate, frames = self.split_frames(track)
+			return self.join_frames(frames[start:end], bitrate)
+
+		def concat_tracks(self, tracks):
+
+			bitrate = None
+			frames = []
+			for t in tracks:
+				this_bitrate, these_frames = self.split_frames(t)
+				if (bitrate is None):
+					bitrate = this_bitrate
+				elif (this_bitrate != bitrate):
+					raise FormatError("Can't join tracks with different bitrates (%d and %d)." % (bitrate, this_bitrate))
+				frames += these_frames
+
+			return self.join_frames(frames, bitrate)
+
+		#Repeats a track a number of times, or until it's exactly num_frames frames long.
+		def loop_track(self, track, times=None, num_frames=None):
+
+			if ((times is None) == (num_frames is None)):
+				raise ValueError("Give loop_track() either times or num_frames.")
+
+			bitrate, frames = self.split_frames(track)
+
+			if (num_frames is None):
+				return self.join_frames(frames * times, bitrate)
+
+			if (len(frames) == 0):
+				raise FormatError("Can't loop an empty track.")
+			repeats = -(-num_frames // len(frames))
+			return self.join_frames((frames * repeats)[:num_frames], bitrate)
+
+		#A track of num_frames silent frames. At 16kbps the frame defaults to
+		#silent_frame_16k; at other bitrates one has to be given.
+		def silence(self, num_frames, bitrate=None, frame=None):
+
+			if (bitrate is None):
+				bitrate = self.samplerate
+			if (frame is None):
+				if (bitrate != 16000):
+					raise FormatError("No built-in silent frame at %d bps; pass one in." % bitrate)
+				frame = self.silent_frame_16k
+			if (len(frame) != self.frame_size(bitrate)):
+				raise FormatError("Silent frame is %d bytes, expected %d." % (len(frame), self.frame_size(bitrate)))
+
+			return self.join_frames([frame] * num_frames, bitrate)
+
+		#Metadata for every track, read from the track headers (no decoding.)
+		#Frames are always 320 samples (20ms) at 16kHz, whatever the bitrate.
+		def track_index(self):
+
+			index = TrackIndex()
+			for n, t in enumerate(self.tracks):
+				frames = self.frame_count(t)
+				index.append({
+					"track"       : n,
+					"bitrate"     : self.track_bitrate(t),
+					"sample_rate" : self.samplerate,
+					"frames"      : frames,
+					"duration_ms" : frames * self.frame_ms,
+					"bytes"       : len(t),
+				})
+			return index
+
 		def minify_audio(self, newlength_in=16000):
 			"""
 			Minify audio tracks to reduce DLC size for faster testing.
 			
 			Args:
-				newlength_in: Target audio length in bytes (default: 16000 = ~1 second at 16kHz)
+				newlength_in: Target audio length in bytes (default: 16000 = ~8 seconds at 16kbps)
+			
+			Tracks are cut at a frame boundary, so the target is rounded down to a
+			whole number of frames.
 			
-			Note: The default of 16000 bytes (~1 second) is the minimum recommended
+			Note: The default of 16000 bytes is the minimum recommended
 			      to avoid flash errors. Values below 8000 bytes may cause issues.
 			"""
 			
-			#This always needs to be a multiple of 8.
-			audio_length = ((newlength_in  >> 3 ) << 3)
+			audio_length = newlength_in
 			
 			# Ensure minimum safe length to avoid flash errors
 			if audio_length < 8000:
-				print "WARNING: Audio length %d is too small, using 8000 bytes minimum" % audio_length
+				log_event(logging.WARNING, "minify_floor", "Audio length %d is too small, using 8000 bytes minimum", audio_length, section="AMF")
 				audio_length = 8000
 			
-			sampling_length = 2
-			size_length = 4
-			
-			newlength_packed = struct.pack("<I", audio_length + sampling_length)
-			sample_rate = struct.pack("<H", self.samplerate)
-			
 			for i in range(len(self.tracks)):
-				# Check if track is long enough
-				track_data_length = len(self.tracks[i]) - 6  # Subtract header bytes
+				num_frames = audio_length // self.frame_size(self.track_bitrate(self.tracks[i]))
 				
-				if track_data_length >= audio_length:
-					# Truncate to new length
-					newtrack = newlength_packed + sample_rate + self.tracks[i][6:6+audio_length]
-				else:
-					# Track is shorter than target, keep original
-					newtrack = self.tracks[i]
-				
-				self.tracks[i] = newtrack
+				# Tracks that are already short enough are kept as they are.
+				if (self.frame_count(self.tracks[i]) > num_frames):
+					self.tracks[i] = self.trim_track(self.tracks[i], 0, num_frames)
 
 	#Passes tests;
 	#All fields identified.
 	class APL_section(dlcsection):
 
+		assets = "playlists"
+		playlists = PackedAttribute(PackedPlaylists)
+
 		default_major_offset = 0x4000	# needed by the SEQ section
 		default_minor_offset = 0x546
 		
@@ -1077,7 +2196,7 @@ class dlc(object):
 		default_header_entry_length = 0x04
 
 		def __initialise__(self):
-			self.playlists = []
+			self.playlists = PackedPlaylists()
 			self.header_entry_length = self.default_header_entry_length
 
 			#If this section has been initialised with a non-zero string
@@ -1097,49 +2216,31 @@ class dlc(object):
 				#Get playlist offsets.
 				playlist_offsets = [(2 * self.__unpack__(4)) for _ in range(playlist_count)]
 
-				#Make categorizer.
-				cat = lambda w: (w, "EOF") if (w == self.entry_terminator) else (w, "PAUSE") if (w & 0x1000 == 0x1000) else (w, "AUDIO")
-
-				#Get playlists.
-				for playlist_offset in playlist_offsets:
-
-					self.__seek__(playlist_offset)
-
-					this_playlist = [cat(self.__unpack__(2))]
-					
-					while (this_playlist[-1][1] != "EOF"):
-						this_playlist.append(cat(self.__unpack__(2)))
-
-					self.playlists.append(this_playlist)
+				#Get playlists. Entries read back as (word, "AUDIO"|"PAUSE"|"EOF").
+				self.playlists = self.__read_word_lists__(playlist_offsets, self.entry_terminator, PackedPlaylists)
 
 
 		def __compile__(self):
-			#Initialise.
-			self.rawbytes = b""
-			self.__seek__(0)
+			self.__join_chunks__()
+
+		def iter_chunks(self):
 
 			#Start with the "number of entries" word.
-			self.__pack__(len(self.playlists), 2)
+			#Then a value we're unsure how is used, but it appears to be the number of entries plus 0x546
+			#Then the header entry length (seems to normally be 4.)
+			header = [struct.pack("<HHI", len(self.playlists), len(self.playlists)+self.default_minor_offset, self.header_entry_length)]
 
-			#Unsure how this value is used, but it appears to be the number of entries plus 0x546
-			self.__pack__(len(self.playlists)+self.default_minor_offset, 2)
+			#section header: write offsets (in words) to each playlist.
+			first_playlist = 2 * (2 + len(self.playlists))
+			header.append(struct.pack("<%dI" % len(self.playlists), *[first_playlist + o for o in self.playlists.offsets[:-1]]))
 
-			#Header entry length (seems to normally be 4.)
-			self.__pack__(self.header_entry_length, 4)
+			yield b"".join(header)
 
-			#work out offset to first playlist
-			offset_to_next_playlist = 2 * (2 + len(self.playlists))
-			
-			#section header: write offsets to each playlist.
-			for pl in self.playlists:
-				
-				self.__pack__(offset_to_next_playlist, 4)
-				offset_to_next_playlist += len(pl) # This is 2 * (0.5 * len(pl))
+			#Lastly, write out the playlists proper, straight from the packed values.
+			yield self.playlists.packed_bytes()
 
-			#Lastly, write out the playlists proper.
-			for pl in self.playlists:
-				for e in pl:
-					self.__pack__(e[0], 2)
+		def compiled_size(self):
+			return 8 + (4 * len(self.playlists)) + (2 * len(self.playlists.values))
 
 		def get_name(self):
 			return "APL"
@@ -1161,23 +2262,27 @@ class dlc(object):
 				assert(pl_in[-1] == self.entry_terminator)
 				
 				#5: none of the other values are the entry terminator.
-				assert(all(i<self.entry_terminator for i in pl[0:-2:2]))
+				assert(all(i<self.entry_terminator for i in pl_in[0:-2:2]))
 			except:
 				raise FormatError("Invalid playlist description.")
 			else:
-				self.playlists.append(list(pl_in))
+				self.playlists.append(pl_in)
 
 	#Passes tests;
-	#Need to identify entry words (looks like 0x8xxx is "open mouth" and 0x1xxx is "shut mouth")
+	#One phrase per APL playlist: alternating "open mouth" (0x8000 | ms) and
+	#"shut mouth" (ms) words, covering the playlist's audio and pauses. See lipsync.py.
 	class LPS_section(dlcsection):
 
+		assets = "phrases"
+		phrases = PackedAttribute(PackedLists)
+
 		default_header_entry_length = 0x03
 		header_terminator = 0xffffffff
 		entry_terminator = 0xffff
 
 		def __initialise__(self):
 			
-			self.phrases = []
+			self.phrases = PackedLists()
 			self.header_entry_length = self.default_header_entry_length
 			
 			if (self.rawbytes != b""):
@@ -1194,45 +2299,32 @@ class dlc(object):
 				#Check for terminator.
 				assert(self.__unpack__(4) == self.header_terminator)
 
-				#Get animations.
-				for phrase_o in phrase_offsets:
-
-					self.__seek__(phrase_o)
-					this_phrase = [self.__unpack__(2)]
-					
-					while (this_phrase[-1] != self.entry_terminator):
-						this_phrase.append(self.__unpack__(2))
-				
-					self.phrases.append(this_phrase)
+				#Get phrases.
+				self.phrases = self.__read_word_lists__(phrase_offsets, self.entry_terminator)
 
 		def __compile__(self):
+			self.__join_chunks__()
 
-			#Initialise.
-			self.rawbytes = b""
-			self.__seek__(0)
+		def iter_chunks(self):
 
-			#Start with the "number of entries" word.
-			self.__pack__(len(self.phrases), 2)
+			#Start with the "number of entries" word,
+			#then the header entry length (seems to normally be 3.)
+			header = [struct.pack("<HI", len(self.phrases), self.header_entry_length)]
 
-			#Header entry length (seems to normally be 3.)
-			self.__pack__(self.header_entry_length, 4)
+			#section header: write offsets to each phrase (in words, after the first three.)
+			first_phrase = 2 * (1 + len(self.phrases))
+			header.append(struct.pack("<%dI" % len(self.phrases), *[first_phrase + o for o in self.phrases.offsets[:-1]]))
 
-			#work out offset to first phrase
-			offset_to_next_phrase =  2 * (1 + len(self.phrases))
-			
-			#section header: write offsets to each phrase.
-			for phrase in self.phrases:
+			#write header terminator
+			header.append(struct.pack("<I", self.header_terminator))
 
-				self.__pack__(offset_to_next_phrase, 4)
-				offset_to_next_phrase += len(phrase)
+			yield b"".join(header)
 
-			#write header terminator
-			self.__pack__(self.header_terminator, 4)
+			#Lastly, write out the phrases, straight from the packed values.
+			yield self.phrases.packed_bytes()
 
-			#Lastly, write out each phrase.
-			for phrase in self.phrases:
-				for p in phrase:
-					self.__pack__(p, 2)
+		def compiled_size(self):
+			return 10 + (4 * len(self.phrases)) + (2 * len(self.phrases.values))
 
 		def get_name(self):
 			return "LPS"
@@ -1241,13 +2333,16 @@ class dlc(object):
 	#need to deconstruct SEQ entries tho
 	class SEQ_section(dlcsection):
 
+		assets = "sequences"
+		sequences = PackedAttribute(PackedLists)
+
 		default_header_entry_length = 0x06	# in bytes
 		entry_terminator = 0
 		
 		playlist_offset = 0x4546
 
 		def __initialise__(self):
-			self.sequences = []
+			self.sequences = PackedLists()
 			self.header_entry_length = self.default_header_entry_length
 
 			#If this section has been initialised with a non-zero string
@@ -1264,45 +2359,32 @@ class dlc(object):
 				seq_offsets = [(2 * self.__unpack__(4)) for _ in range(seq_count)]
 
 				#Get sequences.
-				for seq_o in seq_offsets:
-
-					self.__seek__(seq_o)
-					this_sequence = [self.__unpack__(2)]
-					
-					#First word: 0x02 or 0x03
-					#Second word: Playlist select.
-					#Third word: MTR select (or pick one of the actions pre-programmed on the furby; first nibble determines which)
-					#Fourth -> (n-1)th word: Eye animation select. Every second word indicates inter-animation delay.
-					while (this_sequence[-1] != self.entry_terminator):
-						this_sequence.append(self.__unpack__(2))
-				
-					self.sequences.append(this_sequence)
+				#First word: 0x02 or 0x03
+				#Second word: Playlist select.
+				#Third word: MTR select (or pick one of the actions pre-programmed on the furby; first nibble determines which)
+				#Fourth -> (n-1)th word: Eye animation select. Every second word indicates inter-animation delay.
+				self.sequences = self.__read_word_lists__(seq_offsets, self.entry_terminator)
 
 		def __compile__(self):
+			self.__join_chunks__()
 
-			#Initialise.
-			self.rawbytes = b""
-			self.__seek__(0)
+		def iter_chunks(self):
 
-			#Start with the "number of entries" word.
-			self.__pack__(len(self.sequences), 2)
+			#Start with the "number of entries" word,
+			#then the header entry length.
+			header = [struct.pack("<HI", len(self.sequences), self.header_entry_length)]
 
-			#header entry length.
-			self.__pack__(self.header_entry_length, 4)
+			#section header: write offsets (in words) to each sequence.
+			first_sequence = (2 * (1 + len(self.sequences))) + 1
+			header.append(struct.pack("<%dI" % len(self.sequences), *[first_sequence + o for o in self.sequences.offsets[:-1]]))
 
-			#work out offset to first sequence
-			offset_to_next_sequence = (2 * (1 + len(self.sequences))) + 1
-			
-			#section header: write offsets to each playlist.
-			for seq in self.sequences:
+			yield b"".join(header)
 
-				self.__pack__(offset_to_next_sequence, 4)
-				offset_to_next_sequence += len(seq) # This is 2 * (0.5 * len(pl))
+			#Lastly, write out the sequences proper, straight from the packed values.
+			yield self.sequences.packed_bytes()
 
-			#Lastly, write out the sequences proper.
-			for seq in self.sequences:
-				for e in seq:
-					self.__pack__(e, 2)
+		def compiled_size(self):
+			return 6 + (4 * len(self.sequences)) + (2 * len(self.sequences.values))
 
 		def get_name(self):
 			return "SEQ"
@@ -1311,12 +2393,15 @@ class dlc(object):
 	#need to deconstruct MTR entries tho
 	class MTR_section(dlcsection):
 
+		assets = "animations"
+		animations = PackedAttribute(PackedLists)
+
 		default_header_entry_length = 0x03
 		entry_terminator = 0xf000
 
 		def __initialise__(self):
 			
-			self.animations = []
+			self.animations = PackedLists()
 			self.header_entry_length = self.default_header_entry_length
 			
 			if (self.rawbytes != b""):
@@ -1331,67 +2416,68 @@ class dlc(object):
 				anim_offsets = [(2 * (3 + self.__unpack__(4))) for _ in range(anim_count)]
 
 				#Get animations.
-				for anim_o in anim_offsets:
-
-					self.__seek__(anim_o)
-					this_anim = [self.__unpack__(2)]
-					
-					while (this_anim[-1] != self.entry_terminator):
-						this_anim.append(self.__unpack__(2))
-				
-					self.animations.append(this_anim)
+				self.animations = self.__read_word_lists__(anim_offsets, self.entry_terminator)
 
 		def __compile__(self):
+			self.__join_chunks__()
 
-			#Initialise.
-			self.rawbytes = b""
-			self.__seek__(0)
+		def iter_chunks(self):
 
-			#Start with the "number of entries" word.
-			self.__pack__(len(self.animations), 2)
+			#Start with the "number of entries" word,
+			#then the header entry length (seems to normally be 3.)
+			header = [struct.pack("<HI", len(self.animations), self.header_entry_length)]
 
-			#Header entry length (seems to normally be 3.)
-			self.__pack__(self.header_entry_length, 4)
+			#section header: write offsets to each animation (in words, after the first three.)
+			first_animation = 2 * len(self.animations)
+			header.append(struct.pack("<%dI" % len(self.animations), *[first_animation + o for o in self.animations.offsets[:-1]]))
 
-			#work out offset to first animation
-			offset_to_next_animation = 2 * len(self.animations)
-			
-			#section header: write offsets to each animation.
-			for anim in self.animations:
+			yield b"".join(header)
 
-				self.__pack__(offset_to_next_animation, 4)
-				offset_to_next_animation += len(anim)
+			#Lastly, write out the animations proper, straight from the packed values.
+			yield self.animations.packed_bytes()
 
-			#Lastly, write out the playlists proper.
-			for anim in self.animations:
-				for a in anim:
-					self.__pack__(a, 2)
+		def compiled_size(self):
+			return 6 + (4 * len(self.animations)) + (2 * len(self.animations.values))
 
 		def get_name(self):
 			return "MTR"
 
 	#Creates the class.
 	#Also includes a self-test - to run it, just set self_test to something.
-	def __init__(self, filepath_in=None, self_test=None):
+	#profiler (see Profiler) is told about each read, parse and compile.
+	def __init__(self, filepath_in=None, self_test=None, profiler=None):
 
 		self.dlc_header = None
-		self.dlc_sections = {}
+		self.dlc_sections = _SectionMap()
+		self.profiler = profiler or Profiler()
+		self.journal = None
 
 		if filepath_in is not None:
 
-			# Read all file data first, then close the file before processing
+			# Read all file data first, then close the file before processing.
+			# Each section is read straight into its own buffer, so the file
+			# is only held in memory once.
 			with open(filepath_in, "rb") as f:
-				header_bytes = f.read(0x288)
-				file_content = f.read()  # Read remaining content
+				with self.profiler.span("read", "HEADER", 0x288) as span:
+					header_bytes = f.read(0x288)
+					span.reads = 1
 
-			# Parse header
-			self.dlc_header = self.HEADER_section(header_bytes)
+				with self.profiler.span("map", "HEADER", len(header_bytes)):
+					# Parse header
+					self.dlc_header = self.HEADER_section(header_bytes)
 
-			# Map sections
-			section_map = self.dlc_header.map_dlc()
+					# Map sections
+					section_map = self.dlc_header.map_dlc()
+
+				filemap = { e[0] : {"l" : e[1], "o" : e[2]} for e in section_map}
+
+				section_bytes = {}
+				for sec in filemap:
+					with self.profiler.span("read", sec, filemap[sec]["l"]) as span:
+						f.seek(filemap[sec]["o"])
+						section_bytes[sec] = f.read(filemap[sec]["l"])
+						span.reads = 1
 
-			filemap = { e[0] : {"l" : e[1], "o" : e[2]} for e in section_map}
-			
 			# Generate section objects
 			section_generators = {
 				"PAL"   	:	self.PAL_section,
@@ -1407,56 +2493,154 @@ class dlc(object):
 
 			for sec in filemap:
 
-				# Extract section data from file content (offset is relative to start of file after header)
-				offset = filemap[sec]["o"] - 0x288  # Adjust offset since we already read header
-				length = filemap[sec]["l"]
-				rawbytes = file_content[offset:offset+length]
+				# Hand the section its bytes; we keep no other reference to them.
+				rawbytes = section_bytes.pop(sec)
 
-				d = section_generators[sec](rawbytes)
+				with self.profiler.span("parse", sec, len(rawbytes)):
+					d = section_generators[sec](rawbytes)
 				
-				self.dlc_sections[sec] = d
+				#Not handed out: nobody else keeps hold of d.
+				dict.__setitem__(self.dlc_sections, sec, d)
 				
 				if (self_test is not None):
 
-					print("testing %s at offset %d" % (sec, filemap[sec]["o"]))
 					newbytes = d.write_out()
 					try:
-						print(len(rawbytes) == len(newbytes))
 						assert(rawbytes == newbytes)
 					except:
 						i=0
 						for i in range(min(len(rawbytes), len(newbytes))):
 							if rawbytes[i] != newbytes[i]:
 								break
+						log_event(logging.ERROR, "self_test", "%s self-test failed at offset 0x%x", sec, i, section=sec, offset=filemap[sec]["o"] + i)
 						raise AssertionError("Test failed: error at offset 0x%x\n\texpected %02x, got %02x" % (i, rawbytes[i], newbytes[i]))
 					else:
-						print("\tTest Successful!")
+						log_event(logging.INFO, "self_test", "%s at offset %d: self-test successful", sec, filemap[sec]["o"], section=sec, offset=filemap[sec]["o"])
+
+	#A copy of this DLC that can be edited independently. Sections are shared
+	#with this DLC until either one looks them up in dlc_sections, and then only
+	#that section is copied (cels one at a time, as they're used), so a clone
+	#costs what's edited in it rather than a whole parse.
+	def clone(self):
+
+		new = dlc(profiler=self.profiler)
+		new.dlc_header = self.dlc_header.__clone__() if (self.dlc_header is not None) else None
+		if isinstance(self.dlc_sections, _SectionMap):
+			new.dlc_sections = self.dlc_sections.fork()
+		else:
+			new.dlc_sections = _SectionMap((name, section.__clone__(deep=True)) for name, section in self.dlc_sections.items())
+		return new
+
+	#Starts recording edits (see EditJournal), which also makes build()
+	#incremental.
+	def start_journal(self):
+
+		if (self.journal is None):
+			self.journal = EditJournal(self)
+		return self.journal
+
+	#Async versions of dlc() and build(), for use in an asyncio event loop; the
+	#work is done by `jobs` (an AsyncJobs), or by default_jobs.
+	@staticmethod
+	async def aopen(filepath_in, jobs=None, **kwargs):
+		return await (jobs or default_jobs).open(filepath_in, **kwargs)
+
+	async def abuild(self, filepath_in, jobs=None):
+		await (jobs or default_jobs).build(self, filepath_in)
 
 	#Builds a new DLC.
+	#filepath_in can be a path, or any writable file-like object.
 	def build(self, filepath_in):
 
-		#Generate each of the sections we'd like to include.
-		#Also re-generate the header as we go.
-		self.dlc_header.registered_fields = {}
-		generated_sections = {}
-		for sec in self.dlc_header.header_fields:
-			if sec in self.dlc_sections:
-				generated_sections[sec] = self.dlc_sections[sec].write_out()
-				self.dlc_header.register_section(sec, len(generated_sections[sec]))
+		if hasattr(filepath_in, "write"):
+			self.write_to(filepath_in)
+			return
 
 		#Open the file.
 		with open(filepath_in, "wb") as f:
+			self.write_to(f)
 
-			#Write header.
-			f.write(self.dlc_header.write_out())
-			
-			#Try to write out each section.
+	#Streams a new DLC into a file-like object (a file, pipe, socket file, BytesIO...)
+	#Sections are written a chunk at a time, never as a whole.
+	def write_to(self, target):
+
+		#Work out the size of each of the sections we'd like to include,
+		#re-generating the header as we go.
+		#(Sections are looked up without copying any shared with a clone; we only read them.)
+		sections = {sec : dict.__getitem__(self.dlc_sections, sec) for sec in self.dlc_sections}
+		shared = getattr(self.dlc_sections, "shared", ())
+
+		with self.profiler.span("layout", "HEADER"):
+			self.dlc_header.registered_fields = {}
 			for sec in self.dlc_header.header_fields:
-				if sec in self.dlc_sections:
-					f.write(self.dlc_sections[sec].write_out())
+				if sec in sections:
+					self.dlc_header.register_section(sec, sections[sec].compiled_size())
+
+		#Only count write() calls if someone is listening.
+		if (self.profiler.enabled):
+			target = CountingWriter(target)
+
+		#Write header.
+		with self.profiler.span("write", "HEADER", 0x288) as span:
+			target.write(self.dlc_header.write_out())
+			span.writes = 1
+		
+		#Try to write out each section.
+		if (self.journal is not None):
+			self.__write_sections_incremental__(target, sections, shared)
+			return
+
+		for sec in self.dlc_header.header_fields:
+			if sec in sections:
+				with self.profiler.span("compile", sec, self.dlc_header.registered_fields.get(sec, 0)) as span:
+					writes = getattr(target, "writes", 0)
+					section = sections[sec]
+					if ((sec in shared) and (type(section).iter_chunks is self.dlcsection.iter_chunks)):
+						with shared_compile_lock:
+							compiled = section.write_out()
+						target.write(compiled)
+					else:
+						section.write_out(target)
+					span.writes = getattr(target, "writes", 0) - writes
+
+	#write_to() with a journal: sections that are the same objects as at the
+	#last build, and that nobody has been handed since they were loaded (who
+	#might have edited them in place), haven't changed, so what was written
+	#then is reused.
+	def __write_sections_incremental__(self, target, sections, shared):
+
+		journal = self.journal
+		handed = self.dlc_sections.handed
+		compiled = {}
+
+		for sec in self.dlc_header.header_fields:
+			if sec not in sections:
+				continue
+
+			section = sections[sec]
+			last = journal.compiled.get(sec)
+			reuse = ((last is not None) and (last[0] is section) and (sec in shared) and (sec not in handed))
+
+			with self.profiler.span("reuse" if reuse else "compile", sec, self.dlc_header.registered_fields.get(sec, 0)) as span:
+				if (reuse):
+					chunks = last[1]
+				elif ((sec in shared) and (type(section).iter_chunks is self.dlcsection.iter_chunks)):
+					with shared_compile_lock:
+						chunks = [section.write_out()]
+				else:
+					chunks = list(section.iter_chunks_cached(journal.cel_cache))
+
+				for chunk in chunks:
+					target.write(chunk)
+				span.writes = len(chunks)
+				compiled[sec] = chunks
+
+		journal.__built__(sections, compiled)
 
 	def draw_cel(self, cel_number, pal_number, outfile):
 
+		from PIL import Image as PILImage
+
 		target_cel = self.dlc_sections["CEL"].cels[cel_number]
 		target_palette = self.dlc_sections["PAL"].palettes[pal_number]
 		
@@ -1523,6 +2707,387 @@ class dlc(object):
 			
 			self.dlc_sections["AMF"].replace_track(a, t)
 
+	#XLS type-4 entries whose first word has this high byte refer to DLC sequences;
+	#the low byte is the index into the SEQ section. Other banks belong to the firmware.
+	dlc_sequence_bank = 0x10
+
+	#Walk every type-4 entry in the XLS tree, yielding (action code, entry).
+	def __action_leaves__(self):
+
+		action_tree = self.dlc_sections["XLS"].action_tree
+		for i in action_tree:
+			for j in range(action_tree[i]["entries"]):
+				for k in range(action_tree[i][j]["entries"]):
+					for l in range(action_tree[i][j][k]["entries"]):
+						yield ((i, j, k, l), action_tree[i][j][k][l])
+
+	#Point an XLS type-4 entry at a (DLC) sequence, keeping its cached fields in step.
+	def __repoint_leaf__(self, leaf, sequence_no):
+
+		vals = ((self.dlc_sequence_bank << 8) | sequence_no,) + tuple(leaf["vals"][1:])
+		leaf["vals"] = vals
+		leaf["rawbytes"] = struct.pack("<HHHHH", *vals)
+		leaf["bytes"] = [hex(b) for b in leaf["rawbytes"]]
+		leaf["seq"] = sequence_no
+
+	def replace_audio_bulk(self, replacements):
+		"""
+		Replace the audio responses of many action codes in one pass.
+
+		Unlike replace_audio(), nothing shared with an action code outside
+		`replacements` is modified: sequences, playlists (and their lip-sync
+		phrases) and AMF tracks that are also used elsewhere are cloned and
+		the references from the replaced actions are repointed at the clones.
+		Tracks only used by the replaced actions are overwritten in place.
+
+		Args:
+			replacements: dict mapping 4-tuple action codes to lists of paths
+			              of a18 files. As with replace_audio(), surplus files
+			              are dropped and the last file is looped if too few
+			              are given.
+
+		Returns:
+			dict mapping each action code to the AMF track numbers it now plays.
+
+		Raises FormatError, before changing anything, if the LPS section
+		doesn't have exactly one phrase per playlist, as cloned playlists
+		couldn't then be given their phrase at the same index.
+		"""
+
+		sequences = self.dlc_sections["SEQ"].sequences
+		apl = self.dlc_sections["APL"]
+		lps = self.dlc_sections["LPS"]
+		amf = self.dlc_sections["AMF"]
+		playlist_offset = self.dlc_sections["SEQ"].playlist_offset
+
+		if (len(lps.phrases) != len(apl.playlists)):
+			raise FormatError("LPS section has %d phrases for %d playlists." % (len(lps.phrases), len(apl.playlists)))
+
+		targets = {}
+		for action_code, audio_files in replacements.items():
+			assert((type(action_code) == tuple) and (len(action_code) == 4))
+			if (len(audio_files) == 0):
+				raise ValueError("No audio files given for action code %s" % (action_code,))
+			targets[action_code] = list(audio_files)
+
+		#Build the reference graph (XLS -> SEQ -> APL -> AMF) once.
+		leaves = {}
+		seq_refs = {}
+		for action_code, leaf in self.__action_leaves__():
+			if ((leaf["vals"][0] >> 8) == self.dlc_sequence_bank):
+				seq_refs.setdefault(leaf["seq"], []).append(action_code)
+				if action_code in targets:
+					leaves[action_code] = leaf
+
+		for action_code in targets:
+			if action_code not in leaves:
+				raise KeyError("Action code %s does not refer to a DLC sequence" % (action_code,))
+
+		apl_refs = {}
+		for seq_no, seq in enumerate(sequences):
+			apl_refs.setdefault(seq[1] - playlist_offset, []).append(seq_no)
+
+		track_refs = {}
+		for apl_no, pl in enumerate(apl.playlists):
+			for pos, e in enumerate(pl):
+				if (e[1] == "AUDIO"):
+					track_refs.setdefault(e[0], []).append((apl_no, pos))
+
+		#Sequences: actions wanting the same audio from the same sequence can share it;
+		#everyone else gets a private copy.
+		groups = {}
+		for action_code, audio_files in targets.items():
+			groups.setdefault((leaves[action_code]["seq"], tuple(audio_files)), []).append(action_code)
+
+		owned_sequences = {}
+		for (seq_no, audio_files), action_codes in groups.items():
+			if ((seq_no not in owned_sequences.values()) and (len(action_codes) == len(seq_refs[seq_no]))):
+				owned_sequences[(seq_no, audio_files)] = seq_no
+			else:
+				new_seq_no = len(sequences)
+				if (new_seq_no > 0xff):
+					raise FormatError("Too many sequences to clone for this replacement.")
+				sequences.append(list(sequences[seq_no]))
+				for action_code in action_codes:
+					self.__repoint_leaf__(leaves[action_code], new_seq_no)
+				owned_sequences[(seq_no, audio_files)] = new_seq_no
+
+		#Playlists (and the lip-sync phrase that goes with each one.)
+		owned_playlists = {}
+		for (old_seq_no, audio_files), seq_no in owned_sequences.items():
+			apl_no = sequences[seq_no][1] - playlist_offset
+			if ((seq_no == old_seq_no) and (apl_refs[apl_no] == [seq_no])):
+				owned_playlists[apl_no] = audio_files
+			else:
+				new_apl_no = len(apl.playlists)
+				apl.playlists.append(list(apl.playlists[apl_no]))
+				lps.phrases.append(list(lps.phrases[apl_no]))
+				sequences[seq_no][1] = new_apl_no + playlist_offset
+				owned_playlists[new_apl_no] = audio_files
+
+		#Work out which file each owned audio slot should end up playing.
+		slot_files = {}
+		for apl_no, audio_files in owned_playlists.items():
+			slots = [pos for pos, e in enumerate(apl.playlists[apl_no]) if (e[1] == "AUDIO")]
+			files = list(audio_files[:len(slots)])
+			files += [files[-1]] * (len(slots) - len(files))
+			for pos, f in zip(slots, files):
+				slot_files[(apl_no, pos)] = f
+
+		#Tracks: overwrite in place only if every reference wants the same new file.
+		new_tracks = {}
+		def load(f):
+			if f not in new_tracks:
+				new_tracks[f] = amf.__get_track__(f)
+			return new_tracks[f]
+
+		appended = {}
+		for (apl_no, pos), f in slot_files.items():
+			track_no = apl.playlists[apl_no][pos][0]
+			refs = track_refs.get(track_no, [])
+			if (all(((r in slot_files) and (slot_files[r] == f)) for r in refs) and (track_no < len(amf.tracks))):
+				amf.tracks[track_no] = load(f)
+				appended.setdefault(f, track_no)
+			else:
+				if f not in appended:
+					if (len(amf.tracks) >= 0x1000):
+						raise FormatError("Too many AMF tracks to reference from a playlist.")
+					amf.tracks.append(load(f))
+					appended[f] = len(amf.tracks) - 1
+				apl.playlists[apl_no][pos] = (appended[f], "AUDIO")
+
+		result = {}
+		for action_code in targets:
+			apl_no = sequences[leaves[action_code]["seq"]][1] - playlist_offset
+			result[action_code] = [e[0] for e in apl.playlists[apl_no] if (e[1] == "AUDIO")]
+
+		return result
+
+	def deduplicate_audio(self):
+		"""
+		Drop byte-identical AMF tracks, keeping the first copy of each, and
+		repoint the AUDIO entries in the APL playlists at the survivors.
+
+		Returns:
+			dict with the track count before and after, the number of bytes
+			reclaimed from the AMF section, and the old -> new track mapping.
+		"""
+
+		amf = self.dlc_sections["AMF"]
+		tracks_before = len(amf.tracks)
+		remap, reclaimed = amf.deduplicate()
+
+		for pl in self.dlc_sections["APL"].playlists:
+			for pos, e in enumerate(pl):
+				if ((e[1] == "AUDIO") and (e[0] < tracks_before) and (remap[e[0]] != e[0])):
+					pl[pos] = (remap[e[0]], "AUDIO")
+
+		return {
+			"tracks_before"  	:	tracks_before,
+			"tracks_after"   	:	len(amf.tracks),
+			"bytes_reclaimed"	:	reclaimed,
+			"remap"          	:	remap,
+		}
+
+	#The size of the DLC build() would write.
+	def compiled_size(self):
+		return 0x288 + sum(d.compiled_size() for d in dict.values(self.dlc_sections))
+
+	#Keeps the first of each run of items with equal keys, and the items
+	#keep(index) is true for. Returns the survivors, and a list mapping old
+	#indices to new ones (None for items dropped outright.)
+	def __compact__(self, items, key=None, keep=None):
+
+		survivors = {}
+		new_items = []
+		remap = []
+
+		for n, item in enumerate(items):
+			if ((keep is not None) and not keep(n)):
+				remap.append(None)
+				continue
+			k = n if (key is None) else key(item)
+			if k not in survivors:
+				survivors[k] = len(new_items)
+				new_items.append(item)
+			remap.append(survivors[k])
+
+		return new_items, remap
+
+	def __remap_frames__(self, remap):
+
+		for fp in self.dlc_sections["SPR"].frame_playlists:
+			fp["frame_indices"] = [remap[i] for i in fp["frame_indices"]]
+
+	def __remap_cels__(self, remap):
+
+		for frame in self.dlc_sections["SPR"].frames:
+			frame[0:8:2] = [remap[c] for c in frame[0:8:2]]
+
+	def __remap_tracks__(self, remap):
+
+		for pl in self.dlc_sections["APL"].playlists:
+			for pos, e in enumerate(pl):
+				if ((e[1] == "AUDIO") and (e[0] < len(remap)) and (remap[e[0]] != e[0])):
+					pl[pos] = (remap[e[0]], "AUDIO")
+
+	#Drops sprite frames identical to an earlier one, repointing the frame playlists.
+	def deduplicate_frames(self):
+
+		spr = self.dlc_sections["SPR"]
+		frames_before = len(spr.frames)
+		spr.frames, remap = self.__compact__(spr.frames, key=tuple)
+		self.__remap_frames__(remap)
+		return {"frames_before" : frames_before, "frames_after" : len(spr.frames), "remap" : remap}
+
+	#Drops cels identical to an earlier one, repointing the sprite frames.
+	def deduplicate_cels(self):
+
+		cel = self.dlc_sections["CEL"]
+		cels_before = len(cel.cels)
+		cel.cels, remap = self.__compact__(cel.cels, key=lambda c: tuple(map(tuple, c)))
+		self.__remap_cels__(remap)
+		return {"cels_before" : cels_before, "cels_after" : len(cel.cels), "remap" : remap}
+
+	#Drops AMF tracks no playlist plays, sprite frames no frame playlist shows,
+	#and then cels no sprite frame uses.
+	def drop_unused_assets(self):
+
+		sections = self.dlc_sections
+		dropped = {}
+
+		if (("AMF" in sections) and ("APL" in sections)):
+			used = {v for pl in sections["APL"].playlists for v, kind in pl if kind == "AUDIO"}
+			tracks = sections["AMF"].tracks
+			sections["AMF"].tracks, remap = self.__compact__(tracks, keep=used.__contains__)
+			self.__remap_tracks__(remap)
+			dropped["tracks"] = [n for n, r in enumerate(remap) if r is None]
+
+		if ("SPR" in sections):
+			spr = sections["SPR"]
+			used = {i for fp in spr.frame_playlists for i in fp["frame_indices"]}
+			spr.frames, remap = self.__compact__(spr.frames, keep=used.__contains__)
+			self.__remap_frames__(remap)
+			dropped["frames"] = [n for n, r in enumerate(remap) if r is None]
+
+			if ("CEL" in sections):
+				used = {c for frame in spr.frames for c in frame[0:8:2]}
+				sections["CEL"].cels, remap = self.__compact__(sections["CEL"].cels, keep=used.__contains__)
+				self.__remap_cels__(remap)
+				dropped["cels"] = [n for n, r in enumerate(remap) if r is None]
+
+		return dropped
+
+	#Trims AMF tracks (at frame boundaries) to save at least `needed` bytes.
+	#Tracks are trimmed a priority tier at a time, lowest first; within a tier
+	#the longest tracks are cut back first, evenly, to a common length, but
+	#never below min_track_bytes (or their own length, if already shorter.)
+	#Returns {track : (frames before, frames after)} for each trimmed track.
+	def __trim_audio__(self, needed, priorities, min_track_bytes):
+
+		amf = self.dlc_sections["AMF"]
+		tiers = {}
+		for n, t in enumerate(amf.tracks):
+			tiers.setdefault(priorities.get(n, 0), []).append(n)
+
+		trimmed = {}
+		for tier in sorted(tiers):
+
+			if (needed <= 0):
+				break
+
+			#frames, frame size and floor (in frames) of each track in the tier
+			info = {}
+			for n in tiers[tier]:
+				size = amf.frame_size(amf.track_bitrate(amf.tracks[n]))
+				frames = amf.frame_count(amf.tracks[n])
+				info[n] = (frames, size, min(frames, min_track_bytes // size))
+
+			def saved(cap):
+				return sum((frames - max(cap, floor)) * size for (frames, size, floor) in info.values() if frames > max(cap, floor))
+
+			#The longest common length that saves enough, or everything down to its floor.
+			low, high = 0, max([frames for (frames, size, floor) in info.values()] + [0])
+			if (saved(low) > needed):
+				while (low < high):
+					mid = (low + high + 1) // 2
+					if (saved(mid) >= needed):
+						low = mid
+					else:
+						high = mid - 1
+
+			for n, (frames, size, floor) in info.items():
+				keep = max(low, floor)
+				if (frames > keep):
+					amf.tracks[n] = amf.trim_track(amf.tracks[n], 0, keep)
+					trimmed[n] = (frames, keep)
+			needed -= saved(low)
+
+		return trimmed
+
+	#Strategies fit_to_budget() tries, in order: lossless ones first.
+	budget_strategies = ("deduplicate_audio", "deduplicate_frames", "deduplicate_cels", "drop_unused_assets", "trim_audio")
+
+	def fit_to_budget(self, budget, priorities=None, min_track_bytes=8000, strategies=None):
+		"""
+		Shrink the DLC until build() would write no more than `budget` bytes.
+
+		Strategies (see budget_strategies) are tried in order, each only if
+		the DLC is still too big: dropping duplicate tracks, sprite frames
+		and cels, dropping tracks, frames and cels nothing refers to, and
+		finally trimming the ends off tracks (see __trim_audio__.)
+
+		Args:
+			budget: Size to fit in, in bytes
+			priorities: dict of AMF track number -> priority; tracks with
+			            lower priorities (default 0) are trimmed first
+			min_track_bytes: Tracks are never trimmed shorter than this
+			strategies: The strategies to allow (default: all of them)
+
+		Returns:
+			dict with the size before and after, whether it fits, and a
+			step for each strategy used, with the bytes it saved and what
+			it did.
+		"""
+
+		priorities = priorities or {}
+		strategies = self.budget_strategies if (strategies is None) else strategies
+		for name in strategies:
+			if name not in self.budget_strategies:
+				raise ValueError("Unknown strategy %s" % name)
+
+		size_before = size = self.compiled_size()
+		steps = []
+
+		for name in self.budget_strategies:
+
+			if (size <= budget):
+				break
+			if name not in strategies:
+				continue
+
+			if (name == "trim_audio"):
+				result = {"tracks" : self.__trim_audio__(size - budget, priorities, min_track_bytes)}
+			else:
+				result = getattr(self, name)()
+				result.pop("remap", None)
+
+			new_size = self.compiled_size()
+			steps.append(dict(result, strategy=name, bytes_saved=size - new_size))
+			log_event(logging.INFO, "budget_step", "%s saved %d bytes", name, size - new_size, section=None, count=size - new_size)
+			size = new_size
+
+		if (size > budget):
+			log_event(logging.WARNING, "over_budget", "DLC is %d bytes, over the budget of %d", size, budget, section=None, count=size - budget)
+
+		return {
+			"budget"     	:	budget,
+			"size_before"	:	size_before,
+			"size_after" 	:	size,
+			"fits"       	:	size <= budget,
+			"steps"      	:	steps,
+		}
+
 	def trigger_custom_graphics(self, action_code):
 
 		assert((type(action_code) == tuple) and (len(action_code) == 4))
@@ -1544,3 +3109,322 @@ class dlc(object):
 			#else:
 			#	self.dlc_sections["SEQ"].sequences[sequence_no][i] = 0x1032
 
+	#SEQ words after the MTR select: eye animations (0x8xxx; 0x84xx are the DLC's
+	#own graphics, 0xaxxx picks one at random) separated by delays (0x1xxx, in ms.)
+	#The MTR select is either one of the DLC's own animations (0xc4xx; there are
+	#exactly as many of these as MTR entries) or one built into the furby (0xe0xx.)
+	dlc_motor_bank = 0xc4
+	dlc_eye_bank = 0x84
+
+	def __eye_source__(self, word):
+
+		if ((word >> 12) == 0x0a):
+			return "random"
+		elif ((word >> 8) == self.dlc_eye_bank):
+			return "dlc"
+		return "firmware"
+
+	#Audio, pause and lip events for a playlist, starting at t=0.
+	def __playlist_timeline__(self, apl_no, memo):
+
+		key = ("APL", apl_no)
+		if key in memo:
+			return memo[key]
+
+		amf = self.dlc_sections["AMF"]
+		events = []
+
+		t = 0
+		for (value, kind) in self.dlc_sections["APL"].playlists[apl_no]:
+			if (kind == "AUDIO"):
+				duration = amf.frame_count(amf.tracks[value]) * amf.frame_ms
+				events.append(TimelineEvent(t, "audio", duration, value, "dlc"))
+			elif (kind == "PAUSE"):
+				duration = value & 0xfff
+				events.append(TimelineEvent(t, "pause", duration, duration, None))
+			else:
+				break
+			t += duration
+
+		#Lip-sync phrases line up with playlists: alternating 0x8000|open and shut times.
+		phrases = self.dlc_sections["LPS"].phrases
+		if (apl_no < len(phrases)):
+			t = 0
+			for word in phrases[apl_no]:
+				if (word == self.dlc_sections["LPS"].entry_terminator):
+					break
+				is_open = bool(word & 0x8000)
+				duration = word & 0x7fff
+				events.append(TimelineEvent(t, "lips", duration, "open" if is_open else "shut", None))
+				t += duration
+
+		memo[key] = events
+		return events
+
+	def sequence_timeline(self, sequence_no, memo=None):
+		"""
+		Expand a SEQ entry into a list of TimelineEvents, sorted by start time.
+
+		Event kinds, and their values:
+			"motor" - the MTR select word (source "dlc" or "firmware"), at t=0
+			"eyes"  - the eye animation word (source "dlc", "random" or "firmware")
+			"audio" - the AMF track number, lasting the length of the track
+			"pause" - a playlist pause, in ms
+			"lips"  - "open" or "shut", from the playlist's LPS phrase
+
+		Expansions of sequences and playlists are memoized in `memo` (a dict),
+		so passing the same one for many calls expands each only once.
+		"""
+
+		if (memo is None):
+			memo = {}
+
+		key = ("SEQ", sequence_no)
+		if key in memo:
+			return memo[key]
+
+		seq = self.dlc_sections["SEQ"]
+		words = list(seq.sequences[sequence_no])
+
+		motor = words[2]
+		events = [TimelineEvent(0, "motor", None, motor, "dlc" if ((motor >> 8) == self.dlc_motor_bank) else "firmware")]
+
+		t = 0
+		for word in words[3:]:
+			if (word == seq.entry_terminator):
+				break
+			elif ((word >> 12) == 0x01):
+				t += word & 0xfff
+			else:
+				events.append(TimelineEvent(t, "eyes", None, word, self.__eye_source__(word)))
+
+		#Each eye animation runs until the next one starts. The last one's
+		#length is only known if there's a delay after it.
+		eyes = [i for i, e in enumerate(events) if (e.kind == "eyes")]
+		for i, j in zip(eyes, eyes[1:] + [None]):
+			end = t if (j is None) else events[j].t_ms
+			if ((j is not None) or (end > events[i].t_ms)):
+				events[i] = events[i]._replace(duration_ms=end - events[i].t_ms)
+
+		apl_no = words[1] - seq.playlist_offset
+		if (0 <= apl_no < len(self.dlc_sections["APL"].playlists)):
+			events += self.__playlist_timeline__(apl_no, memo)
+
+		#Stable sort, so simultaneous events keep the order above.
+		events.sort(key=lambda e: e.t_ms)
+
+		memo[key] = events
+		return events
+
+	def response_timeline(self, action_code, memo=None):
+
+		assert((type(action_code) == tuple) and (len(action_code) == 4))
+
+		leaf = self.dlc_sections["XLS"].action_tree[action_code[0]][action_code[1]][action_code[2]][action_code[3]]
+		if ((leaf["vals"][0] >> 8) != self.dlc_sequence_bank):
+			raise KeyError("Action code %s does not refer to a DLC sequence" % (action_code,))
+
+		return self.sequence_timeline(leaf["seq"], memo)
+
+	#Timelines for every action code that plays a DLC sequence, in one pass.
+	#Action codes sharing a sequence share its (memoized) timeline.
+	def response_timelines(self):
+
+		memo = {}
+		return {action_code : self.sequence_timeline(leaf["seq"], memo)
+			for (action_code, leaf) in self.__action_leaves__()
+			if ((leaf["vals"][0] >> 8) == self.dlc_sequence_bank)}
+
+	def validate(self):
+		"""
+		Check every cross-reference in the DLC, and that its header agrees
+		with its sections, in one pass over each section.
+
+		Checks XLS -> SEQ, SEQ -> APL/MTR/SPR, APL -> AMF, LPS phrases for
+		every playlist, SPR -> CEL/PAL, the XLS tree's internal pointers,
+		AMF track headers, and the header's section sizes. (Edits change
+		section sizes; build() rewrites the header to match, so a header
+		mismatch only means something for a DLC as loaded.)
+
+		Returns:
+			list of ValidationIssues; empty if nothing is wrong.
+		"""
+
+		issues = []
+		sections = self.dlc_sections
+
+		def count(name, attribute):
+			return len(getattr(sections[name], attribute)) if (name in sections) else 0
+
+		num_sequences = count("SEQ", "sequences")
+		num_playlists = count("APL", "playlists")
+		num_tracks = count("AMF", "tracks")
+		num_animations = count("MTR", "animations")
+		num_frame_playlists = count("SPR", "frame_playlists")
+		num_frames = count("SPR", "frames")
+		num_cels = count("CEL", "cels")
+		num_palettes = count("PAL", "palettes")
+
+		#Header: every section is one the header can describe, and sizes agree.
+		sizes = {}
+		for name, section in sections.items():
+			if ((name not in self.HEADER_section.header_fields) or (name == self.HEADER_section.unknown_field)):
+				issues.append(ValidationIssue("HEADER", name, None, None, "Section %s can't be described in the header" % name))
+			else:
+				sizes[name] = section.compiled_size()
+		if (self.dlc_header is not None):
+			for name, size in self.dlc_header.registered_fields.items():
+				if (name not in sections):
+					issues.append(ValidationIssue("HEADER", name, name, size, "Header lists a %s section that isn't present" % name))
+				elif (sizes.get(name, size) != size):
+					issues.append(ValidationIssue("HEADER", name, name, size, "Header gives %s as %d bytes, but it's %d" % (name, size, sizes[name])))
+
+		#XLS: tree pointers stay inside the section; DLC sequences exist.
+		if ("XLS" in sections):
+			tree = sections["XLS"].action_tree
+			xls_size = sizes.get("XLS", 0)
+			for i in tree:
+				nodes = [((i,), tree[i])]
+				for j in range(tree[i]["entries"]):
+					nodes.append(((i, j), tree[i][j]))
+					for k in range(tree[i][j]["entries"]):
+						nodes.append(((i, j, k), tree[i][j][k]))
+						for l in range(tree[i][j][k]["entries"]):
+							leaf = tree[i][j][k][l]
+							if (((leaf["vals"][0] >> 8) == self.dlc_sequence_bank) and (leaf["seq"] >= num_sequences)):
+								issues.append(ValidationIssue("XLS", (i, j, k, l), "SEQ", leaf["seq"], "Sequence %d doesn't exist" % leaf["seq"]))
+				for entry, node in nodes:
+					if (node["points_at"] + node["length"] > xls_size):
+						issues.append(ValidationIssue("XLS", entry, "XLS", node["points_at"], "Entry points past the end of the section"))
+
+		#SEQ: playlist, motor animation and DLC eye animations exist.
+		if ("SEQ" in sections):
+			seq = sections["SEQ"]
+			packed = seq.sequences
+			values, offsets = packed.values, packed.offsets
+			for n in range(len(packed)):
+				words = values[offsets[n]:offsets[n+1]]
+				if ((len(words) < 4) or (words[-1] != seq.entry_terminator)):
+					issues.append(ValidationIssue("SEQ", n, None, list(words), "Sequence is too short or unterminated"))
+					continue
+				apl_no = words[1] - seq.playlist_offset
+				if not (0 <= apl_no < num_playlists):
+					issues.append(ValidationIssue("SEQ", n, "APL", words[1], "Playlist %d doesn't exist" % apl_no))
+				if (((words[2] >> 8) == self.dlc_motor_bank) and ((words[2] & 0xff) >= num_animations)):
+					issues.append(ValidationIssue("SEQ", n, "MTR", words[2], "Motor animation %d doesn't exist" % (words[2] & 0xff)))
+				for word in words[3:-1]:
+					if (((word >> 8) == self.dlc_eye_bank) and ((word & 0xff) >= num_frame_playlists)):
+						issues.append(ValidationIssue("SEQ", n, "SPR", word, "Eye animation %d doesn't exist" % (word & 0xff)))
+
+		#APL: tracks exist, playlists are terminated, and each has a lip-sync phrase.
+		if ("APL" in sections):
+			apl = sections["APL"]
+			packed = apl.playlists
+			values, offsets, kinds = packed.values, packed.offsets, packed.kinds()
+			for n in range(len(packed)):
+				start, end = offsets[n], offsets[n+1]
+				if ((end == start) or (kinds[end-1] != PackedPlaylists.EOF)):
+					issues.append(ValidationIssue("APL", n, None, None, "Playlist is unterminated"))
+				for w in range(start, end):
+					if ((kinds[w] == PackedPlaylists.AUDIO) and (values[w] >= num_tracks)):
+						issues.append(ValidationIssue("APL", n, "AMF", values[w], "Track %d doesn't exist" % values[w]))
+			for n in range(count("LPS", "phrases"), num_playlists):
+				issues.append(ValidationIssue("APL", n, "LPS", None, "Playlist has no lip-sync phrase"))
+
+		#AMF: track headers agree with the track lengths.
+		if ("AMF" in sections):
+			amf = sections["AMF"]
+			for n, track in enumerate(amf.tracks):
+				if (len(track) < 6):
+					issues.append(ValidationIssue("AMF", n, None, len(track), "Track is too short for its header"))
+					continue
+				length, bitrate = struct.unpack_from("<IH", track)
+				if (length != len(track) - 4):
+					issues.append(ValidationIssue("AMF", n, None, length, "Track length is %d, but the track has %d bytes" % (length, len(track) - 4)))
+				elif ((bitrate < 400) or (bitrate % 400) or ((len(track) - 6) % amf.frame_size(bitrate))):
+					issues.append(ValidationIssue("AMF", n, None, bitrate, "Track isn't a whole number of frames at %d bps" % bitrate))
+
+		#SPR: frames exist, and frames' cels and palettes exist.
+		if ("SPR" in sections):
+			spr = sections["SPR"]
+			for n, fp in enumerate(spr.frame_playlists):
+				if (fp["framecount"] != len(fp["frame_indices"])):
+					issues.append(ValidationIssue("SPR", n, None, fp["framecount"], "Frame count is %d, but %d frames are listed" % (fp["framecount"], len(fp["frame_indices"]))))
+				for f in fp["frame_indices"]:
+					if (f >= num_frames):
+						issues.append(ValidationIssue("SPR", n, "SPR", f, "Frame %d doesn't exist" % f))
+			for n, frame in enumerate(spr.frames):
+				if ((len(frame) != 9) or (frame[-1] != spr.t3_terminator)):
+					issues.append(ValidationIssue("SPR", n, None, frame, "Frame isn't four cel/palette pairs and a terminator"))
+					continue
+				for cel in frame[0:8:2]:
+					if (cel >= num_cels):
+						issues.append(ValidationIssue("SPR", n, "CEL", cel, "Cel %d doesn't exist" % cel))
+				for word in frame[1:8:2]:
+					palette = (word >> spr.palette_shift) & spr.palette_mask
+					if (palette >= num_palettes):
+						issues.append(ValidationIssue("SPR", n, "PAL", word, "Palette %d doesn't exist" % palette))
+
+		return issues
+
+#Runs dlc loads and builds for asyncio. The blocking work (file I/O, parsing
+#and compiling) is handed to `executor` (default: the event loop's default
+#thread pool) so the loop keeps running, and at most max_jobs loads and builds
+#run at once; others wait their turn, which bounds memory under load.
+#Sections hold memoryviews, which can't be pickled, so the executor has to be
+#a thread pool rather than a process pool.
+class AsyncJobs(object):
+
+	def __init__(self, max_jobs=4, executor=None):
+		self.max_jobs = max_jobs
+		self.executor = executor
+		#asyncio semaphores belong to a loop (before Python 3.10), so keep one per loop.
+		self.semaphores = weakref.WeakKeyDictionary()
+
+	def __limit__(self, loop):
+
+		import asyncio
+		if loop not in self.semaphores:
+			self.semaphores[loop] = asyncio.Semaphore(self.max_jobs)
+		return self.semaphores[loop]
+
+	async def __run__(self, fn):
+
+		import asyncio
+		loop = asyncio.get_running_loop()
+		async with self.__limit__(loop):
+			return await loop.run_in_executor(self.executor, fn)
+
+	async def open(self, filepath_in, **kwargs):
+		return await self.__run__(functools.partial(dlc, filepath_in, **kwargs))
+
+	#target can be a path, a file-like object, or an asyncio StreamWriter; a
+	#StreamWriter is drained after every chunk, so a slow reader holds the
+	#build back instead of the whole DLC piling up in its buffer.
+	async def build(self, D, target):
+
+		import asyncio
+		if hasattr(target, "drain"):
+			loop = asyncio.get_running_loop()
+			await self.__run__(functools.partial(D.write_to, StreamWriterBridge(target, loop)))
+		else:
+			await self.__run__(functools.partial(D.build, target))
+
+#A file-like object that writes to an asyncio StreamWriter from another
+#thread, waiting for each write to drain.
+class StreamWriterBridge(object):
+
+	def __init__(self, writer, loop):
+		self.writer = writer
+		self.loop = loop
+
+	async def __write__(self, data):
+		self.writer.write(data)
+		await self.writer.drain()
+
+	def write(self, data):
+		import asyncio
+		asyncio.run_coroutine_threadsafe(self.__write__(data), self.loop).result()
+		return len(data)
+
+default_jobs = AsyncJobs()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generate LPS lip-sync phrases from audio.
+
+Each playlist in a DLC's APL section has a phrase in the LPS section, at
+the same index, that opens and shuts Furby's mouth while the playlist
+plays. A phrase is a list of words alternating between mouth open
+(0x8000 | milliseconds) and mouth shut (milliseconds), always starting
+with an open word and ending with a shut word, then 0xffff. It covers the
+whole playlist, pauses included.
+
+Replacing a playlist's audio leaves its old phrase in place, so the mouth
+no longer matches what's being said. This rebuilds phrases from the audio
+itself: each track is decoded (see a1800.py; this needs the codec
+tables) or taken from PCM you already have, the playlist's audio and
+pauses are laid end to end, and the RMS envelope of the result, in 10 ms
+windows, is thresholded into open and shut runs. Runs too short for the
+mouth motor to follow are merged into their neighbours.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+import a1800
+from furby import FormatError
+
+WINDOW_MS = 10
+MIN_RUN_MS = 60
+# Open when a window's RMS is above this fraction of the playlist's loud level
+OPEN_LEVEL = 0.2
+# Absolute floor on the threshold, so near-silence never opens the mouth
+MIN_THRESHOLD = 300.0
+
+OPEN_BIT = 0x8000
+MAX_WORD_MS = 0x7fff
+PHRASE_TERMINATOR = 0xffff
+
+
+def rms_envelope(samples, window_ms=WINDOW_MS, sample_rate=a1800.SAMPLE_RATE):
+    """RMS of each window_ms window of samples (the last window zero-padded)."""
+    window = sample_rate * window_ms // 1000
+    samples = np.asarray(samples, dtype=np.float64)
+    padded = np.zeros(-(-len(samples) // window) * window)
+    padded[:len(samples)] = samples
+    return np.sqrt(np.mean(padded.reshape(-1, window) ** 2, axis=1))
+
+
+def mouth_runs(envelope, threshold=None, min_windows=MIN_RUN_MS // WINDOW_MS):
+    """
+    Threshold an envelope into runs of open and shut windows.
+
+    Args:
+        envelope: RMS per window (see rms_envelope())
+        threshold: RMS above which the mouth is open (default: OPEN_LEVEL
+                   of the 95th percentile, but at least MIN_THRESHOLD)
+        min_windows: Runs shorter than this are merged into the one before
+
+    Returns:
+        list of (is_open, windows)
+    """
+    envelope = np.asarray(envelope, dtype=np.float64)
+    if len(envelope) == 0:
+        return []
+    if threshold is None:
+        threshold = max(MIN_THRESHOLD, OPEN_LEVEL * np.percentile(envelope, 95))
+
+    is_open = envelope > threshold
+    starts = np.concatenate(([0], np.flatnonzero(is_open[1:] != is_open[:-1]) + 1))
+    lengths = np.diff(np.concatenate((starts, [len(is_open)])))
+
+    runs = []
+    for state, length in zip(is_open[starts].tolist(), lengths.tolist()):
+        if runs and ((length < min_windows) or (runs[-1][0] == state)):
+            runs[-1] = (runs[-1][0], runs[-1][1] + length)
+        else:
+            runs.append((state, length))
+    return runs
+
+
+def phrase_words(runs, window_ms=WINDOW_MS):
+    """
+    Encode (is_open, windows) runs as an LPS phrase, terminator included.
+
+    Runs longer than a word can hold are split with zero-length words of
+    the other state, so the phrase always alternates open and shut.
+    """
+    words = []
+    for state, length in runs:
+        ms = length * window_ms
+        while True:
+            # Keep the open, shut, open, ... order
+            if bool(len(words) % 2) == state:
+                words.append(0 if state else OPEN_BIT)
+            chunk = min(ms, MAX_WORD_MS)
+            words.append((OPEN_BIT | chunk) if state else chunk)
+            ms -= chunk
+            if ms == 0:
+                break
+            words.append(0 if state else OPEN_BIT)
+
+    if len(words) % 2:
+        words.append(0)
+    return words + [PHRASE_TERMINATOR]
+
+
+def phrase_from_samples(samples, threshold=None, min_ms=MIN_RUN_MS, window_ms=WINDOW_MS):
+    """An LPS phrase for 16 kHz PCM samples."""
+    envelope = rms_envelope(samples, window_ms)
+    return phrase_words(mouth_runs(envelope, threshold, max(1, min_ms // window_ms)), window_ms)
+
+
+def playlist_samples(D, apl_no, pcm):
+    """
+    Lay a playlist's tracks and pauses end to end, as they'll be played.
+
+    Args:
+        D: a furby.dlc
+        apl_no: Playlist number
+        pcm: dict mapping AMF track numbers to 16 kHz PCM samples
+    """
+    parts = []
+    for value, kind in D.dlc_sections["APL"].playlists[apl_no]:
+        if kind == "AUDIO":
+            parts.append(np.asarray(pcm[value], dtype=np.float64))
+        elif kind == "PAUSE":
+            parts.append(np.zeros(a1800.SAMPLE_RATE * (value & 0xfff) // 1000))
+        else:
+            break
+    return np.concatenate(parts) if parts else np.zeros(0)
+
+
+def sync_playlists(D, apl_numbers, tables=None, pcm=None, workers=None, **kwargs):
+    """
+    Regenerate the LPS phrases of many playlists in one batch.
+
+    Every track the playlists use is decoded once (in a pool of worker
+    processes, if asked), unless its PCM is given in pcm.
+
+    Args:
+        D: a furby.dlc, updated in place
+        apl_numbers: Playlist numbers to sync
+        tables: A1800Tables, or a path to the codec table file
+        pcm: dict of AMF track number -> PCM samples already to hand
+        workers: Number of decoder processes
+        kwargs: passed on to phrase_from_samples()
+
+    Returns:
+        dict mapping each playlist number to its new phrase
+
+    Raises FormatError, before decoding anything, if the LPS section
+    doesn't have one phrase per playlist.
+    """
+    playlists = D.dlc_sections["APL"].playlists
+    phrases = D.dlc_sections["LPS"].phrases
+    if len(phrases) != len(playlists):
+        raise FormatError("LPS section has %d phrases for %d playlists." % (len(phrases), len(playlists)))
+    amf = D.dlc_sections["AMF"]
+    pcm = dict(pcm or {})
+    apl_numbers = sorted(set(apl_numbers))
+
+    needed = sorted({value for apl_no in apl_numbers
+                     for value, kind in playlists[apl_no]
+                     if (kind == "AUDIO") and (value not in pcm)})
+    if needed:
+        decoded = a1800.decode_tracks([amf.tracks[n] for n in needed], tables, workers)
+        pcm.update(zip(needed, decoded))
+
+    result = {}
+    for apl_no in apl_numbers:
+        result[apl_no] = phrase_from_samples(playlist_samples(D, apl_no, pcm), **kwargs)
+        phrases[apl_no] = result[apl_no]
+    return result
+
+
+def playlist_number(D, action_code):
+    """The APL playlist an action code plays."""
+    leaf = D.dlc_sections["XLS"].action_tree[action_code[0]][action_code[1]][action_code[2]][action_code[3]]
+    if (leaf["vals"][0] >> 8) != D.dlc_sequence_bank:
+        raise KeyError("Action code %s does not refer to a DLC sequence" % (action_code,))
+    seq = D.dlc_sections["SEQ"]
+    return seq.sequences[leaf["seq"]][1] - seq.playlist_offset
+
+
+def sync_actions(D, action_codes, tables=None, pcm=None, workers=None, **kwargs):
+    """
+    Regenerate the lip-sync for the responses to many action codes, for
+    instance every key of the dict given to dlc.replace_audio_bulk().
+    See sync_playlists().
+    """
+    return sync_playlists(D, [playlist_number(D, a) for a in action_codes], tables, pcm, workers, **kwargs)
+
+
+def parse_action_code(text):
+    code = tuple(int(n) for n in text.split("-"))
+    if len(code) != 4:
+        raise argparse.ArgumentTypeError("Action codes look like 75-0-0-0, not %s" % text)
+    return code
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Regenerate the LPS lip-sync of Furby Connect DLC responses from their audio.',
+        epilog='Example: python lipsync.py toccata_furby.dlc 75-0-0-0 75-0-0-1 -o synced.dlc'
+    )
+    parser.add_argument(
+        'dlc_file',
+        help='Input DLC file'
+    )
+    parser.add_argument(
+        'action_codes',
+        nargs='*',
+        type=parse_action_code,
+        help='Action codes to sync, like 75-0-0-0 (default: every playlist)'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help='Output DLC file (default: overwrite the input)'
+    )
+    parser.add_argument(
+        '-t', '--tables',
+        help='Path to the codec table file (default: $A1800_TABLES or ./%s)' % a1800.DEFAULT_TABLES_PATH
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=None,
+        help='Number of decoder processes (default: 1)'
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dlc_file):
+        print("Error: Input file not found: %s" % args.dlc_file)
+        return 1
+
+    from furby import dlc
+    D = dlc(args.dlc_file)
+
+    try:
+        tables = a1800.load_tables(args.tables)
+        if args.action_codes:
+            synced = sync_actions(D, args.action_codes, tables, workers=args.jobs)
+        else:
+            synced = sync_playlists(D, range(len(D.dlc_sections["APL"].playlists)), tables, workers=args.jobs)
+    except (FileNotFoundError, ValueError, KeyError, FormatError) as e:
+        print("Error: %s" % e)
+        return 1
+
+    output = args.output or args.dlc_file
+    D.build(output)
+    print("Synced %d playlist(s) into %s" % (len(synced), output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
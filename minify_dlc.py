@@ -9,6 +9,7 @@ faster uploads to Furby Connect.
 """
 
 import argparse
+import logging
 import sys
 from pathlib import Path
 
@@ -20,14 +21,17 @@ except ImportError:
     sys.exit(1)
 
 
-def minify_dlc_file(input_path, output_path, audio_length=128):
+def minify_dlc_file(input_path, output_path, audio_length=128, budget=None):
     """
     Minify a DLC file by shrinking audio tracks.
     
     Args:
         input_path: Path to input DLC file
         output_path: Path to output minified DLC file
-        audio_length: New audio length in bytes (must be multiple of 8, default: 128)
+        audio_length: New audio length in bytes, rounded down to whole frames (default: 128)
+        budget: If given, shrink the DLC only as far as needed to fit in this
+                many bytes (see dlc.fit_to_budget()), instead of cutting every
+                track to audio_length
     
     Returns:
         bool: True if successful, False otherwise
@@ -43,12 +47,22 @@ def minify_dlc_file(input_path, output_path, audio_length=128):
         print(f"Error: Failed to load DLC file: {e}")
         return False
     
-    # Get original file size
+    # Get original file size and audio duration
     original_size = input_path.stat().st_size
-    
-    # Minify audio
-    print(f"Minifying audio tracks to {audio_length} bytes...")
-    D.dlc_sections["AMF"].minify_audio(audio_length)
+    original_audio_ms = D.dlc_sections["AMF"].track_index().total("duration_ms")
+    
+    if budget is not None:
+        print(f"Fitting DLC into {budget:,} bytes...")
+        report = D.fit_to_budget(budget)
+        for step in report["steps"]:
+            print(f"  {step['strategy']}: saved {step['bytes_saved']:,} bytes")
+        if not report["fits"]:
+            print(f"Warning: could only get down to {report['size_after']:,} bytes")
+    else:
+        # Minify audio
+        print(f"Minifying audio tracks to {audio_length} bytes...")
+        D.dlc_sections["AMF"].minify_audio(audio_length)
+    new_audio_ms = D.dlc_sections["AMF"].track_index().total("duration_ms")
     
     # Build the minified DLC
     print(f"Building minified DLC to {output_path}...")
@@ -67,6 +81,7 @@ def minify_dlc_file(input_path, output_path, audio_length=128):
     print(f"Original size: {original_size:,} bytes")
     print(f"New size:      {new_size:,} bytes")
     print(f"Reduction:     {reduction:,} bytes ({reduction_pct:.1f}%)")
+    print(f"Audio:         {original_audio_ms / 1000:.1f}s -> {new_audio_ms / 1000:.1f}s")
     
     return True
 
@@ -88,23 +103,25 @@ def main():
         '-l', '--length',
         type=int,
         default=128,
-        help='Audio length in bytes (must be multiple of 8, default: 128)'
+        help='Audio length in bytes, rounded down to whole 40-byte frames (default: 128)'
+    )
+    parser.add_argument(
+        '-b', '--budget',
+        type=int,
+        help='Instead of cutting every track, shrink the DLC only as far as needed to fit in this many bytes'
     )
     
     args = parser.parse_args()
     
+    # Show the library's warnings (such as the minimum audio length)
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    
     # Check if input file exists
     input_path = Path(args.input_file)
     if not input_path.exists():
         print(f"Error: Input file not found: {input_path}")
         sys.exit(1)
     
-    # Validate audio length is multiple of 8
-    if args.length % 8 != 0:
-        print(f"Error: Audio length must be a multiple of 8 (got {args.length})")
-        print(f"Suggested: {(args.length // 8) * 8} or {((args.length // 8) + 1) * 8}")
-        sys.exit(1)
-    
     # Determine output path
     if args.output:
         output_path = Path(args.output)
@@ -120,7 +137,7 @@ def main():
             sys.exit(0)
     
     # Minify the DLC
-    success = minify_dlc_file(input_path, output_path, args.length)
+    success = minify_dlc_file(input_path, output_path, args.length, args.budget)
     
     if success:
         sys.exit(0)
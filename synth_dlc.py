@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic Furby Connect DLC files for load and scaling tests.
+
+DLCs are built through the section classes in furby.py, so they're laid
+out exactly as dlc.build() would lay out a real one, and every reference
+between sections is valid (dlc.validate() finds nothing wrong). Sizes are
+all configurable: cels and palettes, frames per sprite playlist, the
+fan-out of each level of the XLS action tree, and the number and length
+of AMF tracks, with playlists, lip-sync phrases, sequences and motor
+animations to match.
+
+Content is pseudo-random but deterministic: the same seed and sizes
+always give byte-identical output. Audio frames are random bytes (valid
+framing, but noise if decoded), which is by far the cheapest part to
+generate, so large corpora are mostly a matter of asking for more or
+longer tracks.
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from furby import dlc, PackedLists, PackedPlaylists
+
+DEFAULT_CELS = 64
+DEFAULT_PALETTES = 4
+DEFAULT_FRAMES = 8
+DEFAULT_FANOUT = (16, 4, 2, 4)
+DEFAULT_TRACKS = 64
+DEFAULT_TRACK_FRAMES = (25, 250)
+DEFAULT_SEQUENCES = 64
+DEFAULT_ANIMATIONS = 8
+
+# The SPR section always has 16 frame playlists; these are the sample's layers.
+SPR_LAYERS = (0, 64, 128, 128, 128, 128, 128, 128, 192, 192, 262400, 262400, 524608, 524608, 128, 128)
+# Only 256 sequences can be referred to from the XLS section.
+MAX_SEQUENCES = 256
+# Playlist words with bit 12 set are pauses, so higher track numbers can't be played.
+MAX_TRACKS = 0x1000
+AMF_BITRATE = 16000
+
+
+def _fanout(rng, spec):
+    """An int, or a random pick from a (low, high) range."""
+    return rng.randint(*spec) if isinstance(spec, (tuple, list)) else spec
+
+
+def _randbytes(rng, n):
+    """Same bytes as rng.randbytes(n), which needs Python 3.9."""
+    return rng.getrandbits(8 * n).to_bytes(n, "little") if n else b""
+
+
+def make_palettes(rng, count):
+    pal = dlc.PAL_section
+    palettes = []
+    for _ in range(count):
+        # Colours survive the 5-bit round trip; colour 0 is transparent.
+        colours = [(r & 0xf8, g & 0xf8, b & 0xf8, 0xff) for r, g, b in
+                   zip(*[iter(_randbytes(rng, 3 * pal.num_colours))] * 3)]
+        colours[0] = colours[0][:3] + (0,)
+        palettes.append(colours)
+    return palettes
+
+
+def make_cels(rng, count):
+    cel = dlc.CEL_section
+    mask = bytes(i & 0x3f for i in range(256))
+    cels = []
+    for _ in range(count):
+        pixels = _randbytes(rng, cel.cel_width * cel.cel_height).translate(mask)
+        cels.append([list(pixels[y * cel.cel_width:(y + 1) * cel.cel_width]) for y in range(cel.cel_height)])
+    return cels
+
+
+def make_sprites(rng, frames_per_playlist, num_cels, num_palettes):
+    spr = dlc.SPR_section
+    if frames_per_playlist < 1:
+        raise ValueError("Every sprite playlist needs at least one frame.")
+
+    # The palette of each quarter-frame is in bits 10-11 of its second word.
+    palettes = min(num_palettes, spr.palette_mask + 1)
+    frames = []
+    playlists = []
+    for w in range(16):
+        first = len(frames)
+        for _ in range(frames_per_playlist):
+            frame = []
+            for _ in range(4):
+                frame += [rng.randrange(num_cels), 0x10f2 | (rng.randrange(palettes) << spr.palette_shift)]
+            frames.append(frame + [spr.t3_terminator])
+        playlists.append({
+            "framecount"     : frames_per_playlist,
+            "t2_offset_raw"  : 0,
+            "layer"          : SPR_LAYERS[w],
+            "framelist_index": w,
+            "frame_indices"  : list(range(first, len(frames))),
+        })
+    return playlists, frames
+
+
+def make_action_tree(rng, fanout, num_sequences):
+    bank = dlc.dlc_sequence_bank
+    tree = {}
+    for i in range(1, _fanout(rng, fanout[0]) + 1):
+        tree[i] = {"entries": _fanout(rng, fanout[1])}
+        for j in range(tree[i]["entries"]):
+            tree[i][j] = {"entries": _fanout(rng, fanout[2])}
+            for k in range(tree[i][j]["entries"]):
+                entries = _fanout(rng, fanout[3])
+                # Laid out like the callable DLC actions; pack_tree() fills in the offset.
+                node = {"entries": entries, "callable": True, "raw": [0, 0x64, entries, 0, 5, 0, 0, 0, 0]}
+                for l in range(entries):
+                    vals = ((bank << 8) | rng.randrange(num_sequences), 0xff, 6, 1 << rng.randrange(16), 0)
+                    rawbytes = struct.pack("<HHHHH", *vals)
+                    node[l] = {
+                        "address" : 0,
+                        "rawbytes": rawbytes,
+                        "bytes"   : [hex(b) for b in rawbytes],
+                        "vals"    : vals,
+                        "seq"     : rawbytes[0],
+                    }
+                tree[i][j][k] = node
+    return tree
+
+
+def make_tracks(rng, amf, count, track_frames):
+    frame_size = amf.frame_size(AMF_BITRATE)
+    tracks = []
+    for _ in range(count):
+        audio = _randbytes(rng, frame_size * _fanout(rng, track_frames))
+        tracks.append(struct.pack("<IH", len(audio) + 2, AMF_BITRATE) + audio)
+    return tracks
+
+
+def make_playlists(rng, count, num_tracks):
+    """Playlists of one to three tracks with pauses between, every track used at least once."""
+    playlists = []
+    next_track = 0
+    for _ in range(count):
+        playlist = []
+        for n in range(rng.randint(1, 3)):
+            if n:
+                playlist.append(0x1000 | rng.randrange(50, 1000))
+            playlist.append(next_track % num_tracks)
+            next_track += 1
+        playlists.append(playlist)
+
+    # Any tracks left over go on the end of the last playlist.
+    for track in range(next_track, num_tracks):
+        playlists[-1] += [0x1000 | rng.randrange(50, 1000), track]
+
+    return [playlist + [dlc.APL_section.entry_terminator] for playlist in playlists]
+
+
+def make_phrase(rng, total_ms):
+    """Alternating mouth open (0x8000 | ms) and shut (ms) words, lasting about total_ms."""
+    words = []
+    while total_ms > 0:
+        open_ms = min(total_ms, rng.randrange(20, 400))
+        shut_ms = min(total_ms - open_ms, rng.randrange(50, 600))
+        words += [0x8000 | open_ms, shut_ms]
+        total_ms -= open_ms + shut_ms
+    return (words or [0x8000, 0]) + [dlc.LPS_section.entry_terminator]
+
+
+def make_sequences(rng, count, num_playlists, num_animations):
+    seq = dlc.SEQ_section
+    sequences = []
+    for n in range(count):
+        if num_animations and rng.random() < 0.5:
+            motor = (dlc.dlc_motor_bank << 8) | rng.randrange(num_animations)
+        else:
+            motor = 0xe000 | rng.randrange(0x30)
+        words = [rng.choice((0x2000, 0x3000)), seq.playlist_offset + (n % num_playlists), motor]
+        for e in range(rng.randint(1, 4)):
+            if e:
+                words.append(0x1000 | rng.randrange(50, 2000))
+            if rng.random() < 0.25:
+                words.append((dlc.dlc_eye_bank << 8) | rng.randrange(16))
+            else:
+                words.append(0x8000 | rng.randrange(0x40, 0x100))
+        sequences.append(words + [seq.entry_terminator])
+    return sequences
+
+
+def make_animations(rng, count):
+    animations = []
+    for _ in range(count):
+        words = [0x1000]
+        for _ in range(rng.randint(1, 6)):
+            words += [0x0c00 | rng.randrange(0x100), rng.randrange(16, 256)]
+        animations.append(words + [dlc.MTR_section.entry_terminator])
+    return animations
+
+
+def generate_dlc(seed=0, cels=DEFAULT_CELS, palettes=DEFAULT_PALETTES, frames=DEFAULT_FRAMES,
+                 fanout=DEFAULT_FANOUT, tracks=DEFAULT_TRACKS, track_frames=DEFAULT_TRACK_FRAMES,
+                 sequences=DEFAULT_SEQUENCES, animations=DEFAULT_ANIMATIONS):
+    """
+    Generate a DLC.
+
+    Args:
+        seed: Random seed; the same seed and sizes give the same DLC
+        cels: Number of cels
+        palettes: Number of palettes
+        frames: Frames in each of the 16 sprite playlists
+        fanout: Entries per node at each of the four XLS levels; each is
+                an int or a (low, high) range to pick from
+        tracks: Number of AMF tracks
+        track_frames: 20ms frames per track; an int or a (low, high) range
+        sequences: Number of sequences, each with its own playlist and
+                   lip-sync phrase (at most 256)
+        animations: Number of MTR motor animations
+
+    Returns:
+        a furby.dlc, ready to build()
+    """
+    if not (1 <= sequences <= MAX_SEQUENCES):
+        raise ValueError("Need between 1 and %d sequences." % MAX_SEQUENCES)
+    if (cels < 1) or (palettes < 1) or (tracks < 1):
+        raise ValueError("Need at least one cel, palette and track.")
+    if tracks > MAX_TRACKS:
+        raise ValueError("At most %d tracks can be played from a playlist." % MAX_TRACKS)
+
+    rng = random.Random(seed)
+    D = dlc()
+    D.dlc_header = dlc.HEADER_section()
+    sections = {name: getattr(dlc, name + "_section")() for name in
+                ("PAL", "SPR", "CEL", "XLS", "AMF", "APL", "LPS", "SEQ", "MTR")}
+
+    sections["PAL"].palettes = make_palettes(rng, palettes)
+    sections["CEL"].cels = make_cels(rng, cels)
+    sections["SPR"].frame_playlists, sections["SPR"].frames = make_sprites(rng, frames, cels, palettes)
+
+    sections["XLS"].action_tree = make_action_tree(rng, fanout, sequences)
+    sections["XLS"].pack_tree()
+
+    amf = sections["AMF"]
+    amf.tracks = make_tracks(rng, amf, tracks, track_frames)
+    track_ms = [amf.frame_count(t) * amf.frame_ms for t in amf.tracks]
+
+    playlists = make_playlists(rng, sequences, tracks)
+    sections["APL"].playlists = PackedPlaylists(playlists)
+    sections["LPS"].phrases = PackedLists(
+        make_phrase(rng, sum((w & 0xfff) if (w & 0x1000) else track_ms[w] for w in playlist[:-1]))
+        for playlist in playlists
+    )
+    sections["SEQ"].sequences = PackedLists(make_sequences(rng, sequences, sequences, animations))
+    sections["MTR"].animations = PackedLists(make_animations(rng, animations))
+
+    D.dlc_sections = sections
+    return D
+
+
+def _generate_job(job):
+    path, kwargs = job
+    generate_dlc(**kwargs).build(str(path))
+    return path
+
+
+def generate_corpus(output_dir, count, seed=0, jobs=None, **kwargs):
+    """
+    Write `count` DLCs, seeded seed, seed+1, ..., to output_dir/synth_<seed>.dlc.
+
+    Returns:
+        list of the paths written
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    work = [(output_dir / ("synth_%06d.dlc" % s), dict(kwargs, seed=s)) for s in range(seed, seed + count)]
+
+    if (jobs == 1) or (len(work) <= 1):
+        return [_generate_job(job) for job in work]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(_generate_job, work))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic Furby Connect DLC files for load and scaling tests.',
+        epilog='Example: python synth_dlc.py -o corpus/ -n 100 --tracks 500 --track-frames 50 500 -j 8'
+    )
+    parser.add_argument('-o', '--output-dir', default='synth', help='Output directory (default: synth)')
+    parser.add_argument('-n', '--count', type=int, default=1, help='Number of DLCs (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first DLC (default: 0)')
+    parser.add_argument('--cels', type=int, default=DEFAULT_CELS, help=f'Cels per DLC (default: {DEFAULT_CELS})')
+    parser.add_argument('--palettes', type=int, default=DEFAULT_PALETTES, help=f'Palettes (default: {DEFAULT_PALETTES})')
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES,
+                        help=f'Frames per sprite playlist (default: {DEFAULT_FRAMES})')
+    parser.add_argument('--fanout', type=int, nargs=4, default=list(DEFAULT_FANOUT),
+                        help='Entries per node at each XLS level (default: %s)' % ' '.join(map(str, DEFAULT_FANOUT)))
+    parser.add_argument('--tracks', type=int, default=DEFAULT_TRACKS, help=f'AMF tracks (default: {DEFAULT_TRACKS})')
+    parser.add_argument('--track-frames', type=int, nargs=2, default=list(DEFAULT_TRACK_FRAMES),
+                        help='Range of 20ms frames per track (default: %d %d)' % DEFAULT_TRACK_FRAMES)
+    parser.add_argument('--sequences', type=int, default=DEFAULT_SEQUENCES,
+                        help=f'Sequences, playlists and phrases (default: {DEFAULT_SEQUENCES})')
+    parser.add_argument('--animations', type=int, default=DEFAULT_ANIMATIONS,
+                        help=f'Motor animations (default: {DEFAULT_ANIMATIONS})')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes (default: one per CPU)')
+
+    args = parser.parse_args()
+
+    try:
+        paths = generate_corpus(
+            args.output_dir, args.count, args.seed, args.jobs,
+            cels=args.cels, palettes=args.palettes, frames=args.frames, fanout=tuple(args.fanout),
+            tracks=args.tracks, track_frames=tuple(args.track_frames),
+            sequences=args.sequences, animations=args.animations,
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    total = sum(os.path.getsize(p) for p in paths)
+    print(f"Wrote {len(paths)} DLC(s), {total / (1 << 20):.1f} MiB, to {args.output_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,6 +11,7 @@ import unittest
 import os
 import tempfile
 import shutil
+import struct
 from furby import dlc
 
 
@@ -163,6 +164,1887 @@ class TestSectionAccess(unittest.TestCase):
         self.assertTrue(hasattr(amf_section, 'tracks'))
 
 
+class TestBulkAudioReplacement(unittest.TestCase):
+    """Test copy-on-write bulk audio replacement"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        self.test_a18_path = "./audio/new_audio/darkside_wav.a18"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.D = dlc(self.test_dlc_path)
+    
+    def test_replaces_audio(self):
+        """Test that the replaced action plays the new track"""
+        new_track = self.D.dlc_sections["AMF"].__get_track__(self.test_a18_path)
+        result = self.D.replace_audio_bulk({(75, 0, 0, 0): [self.test_a18_path]})
+        for track_no in result[(75, 0, 0, 0)]:
+            self.assertEqual(self.D.dlc_sections["AMF"].tracks[track_no], new_track)
+    
+    def test_does_not_mutate_arguments(self):
+        """Test that the caller's file lists are left alone"""
+        files = [self.test_a18_path]
+        self.D.replace_audio_bulk({(75, 0, 0, 0): files})
+        self.assertEqual(files, [self.test_a18_path])
+    
+    def test_unrelated_actions_untouched(self):
+        """Test that an action sharing a sequence keeps its audio"""
+        # 75-0-1-2 and 75-0-1-6 share a sequence in this DLC.
+        amf = self.D.dlc_sections["AMF"]
+        before = list(amf.tracks)
+        seq_no = self.D.dlc_sections["XLS"].action_tree[75][0][1][6]["seq"]
+        apl_no = self.D.dlc_sections["SEQ"].sequences[seq_no][1] - self.D.dlc_sections["SEQ"].playlist_offset
+        original_playlist = list(self.D.dlc_sections["APL"].playlists[apl_no])
+        
+        result = self.D.replace_audio_bulk({(75, 0, 1, 2): [self.test_a18_path]})
+        
+        self.assertNotEqual(self.D.dlc_sections["XLS"].action_tree[75][0][1][2]["seq"], seq_no)
+        self.assertEqual(self.D.dlc_sections["XLS"].action_tree[75][0][1][6]["seq"], seq_no)
+        self.assertEqual(list(self.D.dlc_sections["APL"].playlists[apl_no]), original_playlist)
+        self.assertEqual(amf.tracks[:len(before)], before)
+        self.assertEqual(len(set(result[(75, 0, 1, 2)])), 1)
+        self.assertEqual(len(self.D.dlc_sections["APL"].playlists), len(self.D.dlc_sections["LPS"].phrases))
+    
+    def test_phrase_count_mismatch(self):
+        """Test that a DLC whose LPS and APL counts differ is refused untouched"""
+        from furby import FormatError
+        del self.D.dlc_sections["LPS"].phrases[-1]
+        sequences = [list(seq) for seq in self.D.dlc_sections["SEQ"].sequences]
+        with self.assertRaises(FormatError):
+            self.D.replace_audio_bulk({(75, 0, 1, 2): [self.test_a18_path]})
+        self.assertEqual([list(seq) for seq in self.D.dlc_sections["SEQ"].sequences], sequences)
+    
+    def test_bulk_roundtrip(self):
+        """Test that a bulk-edited DLC builds and loads again"""
+        self.D.replace_audio_bulk({
+            (75, 0, 0, 0): [self.test_a18_path],
+            (75, 0, 1, 2): [self.test_a18_path],
+        })
+        temp_dir = tempfile.mkdtemp()
+        try:
+            output_path = os.path.join(temp_dir, "output.dlc")
+            self.D.build(output_path)
+            D2 = dlc(output_path)
+            self.assertEqual(len(D2.dlc_sections["AMF"].tracks), len(self.D.dlc_sections["AMF"].tracks))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class TestZeroCopyTracks(unittest.TestCase):
+    """Test that AMF tracks reference the section buffer"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.amf = dlc(self.test_dlc_path).dlc_sections["AMF"]
+    
+    def test_tracks_are_views(self):
+        """Test that parsed tracks are views into rawbytes"""
+        for track in self.amf.tracks:
+            self.assertIsInstance(track, memoryview)
+            self.assertIs(track.obj, self.amf.rawbytes)
+    
+    def test_streamed_matches_compiled(self):
+        """Test that streaming the section gives the compiled bytes"""
+        import io
+        original = self.amf.rawbytes
+        streamed = io.BytesIO()
+        self.amf.write_out(streamed)
+        self.assertEqual(streamed.getvalue(), original)
+        self.assertEqual(self.amf.compiled_size(), len(original))
+        self.assertEqual(self.amf.write_out(), original)
+    
+    def test_compile_repoints_tracks(self):
+        """Test that compiling re-points tracks at the new buffer"""
+        self.amf.tracks[0] = bytes(self.amf.tracks[1])
+        newbytes = self.amf.write_out()
+        self.assertTrue(all(track.obj is newbytes for track in self.amf.tracks))
+        self.assertEqual(self.amf.tracks[0], self.amf.tracks[1])
+
+
+class TestStreamingBuild(unittest.TestCase):
+    """Test building DLCs into file-like objects"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.D = dlc(self.test_dlc_path)
+    
+    def test_compiled_size(self):
+        """Test that every section reports its exact compiled size"""
+        for section_name, section in self.D.dlc_sections.items():
+            streamed = b"".join(section.iter_chunks())
+            self.assertEqual(section.compiled_size(), len(streamed), section_name)
+            self.assertEqual(section.write_out(), streamed, section_name)
+    
+    def test_build_to_bytesio(self):
+        """Test building into a BytesIO"""
+        import io
+        output = io.BytesIO()
+        self.D.build(output)
+        with open(self.test_dlc_path, "rb") as f:
+            self.assertEqual(output.getvalue(), f.read())
+    
+    def test_build_to_unseekable_stream(self):
+        """Test building into a write-only stream, such as a pipe"""
+        class WriteOnly(object):
+            def __init__(self):
+                self.chunks = []
+            def write(self, data):
+                self.chunks.append(bytes(data))
+        
+        output = WriteOnly()
+        self.D.build(output)
+        with open(self.test_dlc_path, "rb") as f:
+            self.assertEqual(b"".join(output.chunks), f.read())
+        # No single write should be anywhere near the size of the AMF section.
+        self.assertLess(max(len(c) for c in output.chunks), self.D.dlc_sections["AMF"].compiled_size() // 4)
+
+
+class TestAudioDeduplication(unittest.TestCase):
+    """Test content-addressed AMF track deduplication"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.D = dlc(self.test_dlc_path)
+    
+    def test_no_duplicates(self):
+        """Test that a DLC without duplicates is left alone"""
+        original_size = self.D.dlc_sections["AMF"].compiled_size()
+        report = self.D.deduplicate_audio()
+        self.assertEqual(report["tracks_before"], report["tracks_after"])
+        self.assertEqual(report["bytes_reclaimed"], 0)
+        self.assertEqual(self.D.dlc_sections["AMF"].compiled_size(), original_size)
+    
+    def test_duplicates_removed(self):
+        """Test that duplicate tracks are dropped and playlists repointed"""
+        amf = self.D.dlc_sections["AMF"]
+        apl = self.D.dlc_sections["APL"]
+        
+        # Make the track played first by playlist 1 a copy of the one played first by playlist 0.
+        kept = apl.playlists[0][0][0]
+        duplicate = apl.playlists[1][0][0]
+        amf.tracks[duplicate] = bytes(amf.tracks[kept])
+        played_before = [[bytes(amf.tracks[e[0]]) for e in pl if e[1] == "AUDIO"] for pl in apl.playlists]
+        original_size = amf.compiled_size()
+        
+        report = self.D.deduplicate_audio()
+        
+        self.assertEqual(report["tracks_after"], report["tracks_before"] - 1)
+        self.assertEqual(report["bytes_reclaimed"], original_size - amf.compiled_size())
+        self.assertEqual(report["remap"][duplicate], report["remap"][kept])
+        played_after = [[bytes(amf.tracks[e[0]]) for e in pl if e[1] == "AUDIO"] for pl in apl.playlists]
+        self.assertEqual(played_after, played_before)
+
+
+def a1800_test_tables():
+    """Stand-in fixed-length A1800 code tables; the real ones are generated from the G.722.1 reference code."""
+    import a1800
+    
+    def fixed_length(count):
+        bits = max(1, (count - 1).bit_length())
+        return [bits] * count, list(range(count))
+    
+    region_bits, region_codes = fixed_length(24)
+    vector_tables = [fixed_length((a1800.MAX_BIN[c] + 1) ** a1800.VECTOR_DIMENSION[c]) for c in range(7)]
+    return a1800.A1800Tables(
+        [region_bits] * 13,
+        [region_codes] * 13,
+        [t[0] for t in vector_tables],
+        [t[1] for t in vector_tables],
+        [[k * a1800.STEP_SIZE[c] for k in range(a1800.MAX_BIN[c] + 1)] for c in range(7)],
+    )
+
+
+class TestA1800Decoder(unittest.TestCase):
+    """Test the native A1800 decoder"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        self.test_a18_path = "./audio/new_audio/darkside_wav.a18"
+        if not os.path.exists(self.test_a18_path):
+            self.skipTest("Test a18 file not found")
+        import a1800
+        self.a1800 = a1800
+        
+        self.tables = a1800_test_tables()
+    
+    def test_mlt_roundtrip(self):
+        """Test that the vectorized MLT and inverse MLT reconstruct the signal"""
+        import numpy as np
+        signal = np.random.default_rng(1).normal(0, 1000, 5000)
+        coefs = self.a1800.mlt(signal)
+        self.assertEqual(coefs.shape, (17, 320))
+        rebuilt = self.a1800.imlt(coefs)
+        self.assertLess(np.max(np.abs(rebuilt[:len(signal)] - signal)), 1e-6)
+    
+    def test_parse_track(self):
+        """Test that a18 files parse with or without the GeneralPlus header"""
+        with open(self.test_a18_path, "rb") as f:
+            data = f.read()
+        bitrate, frames = self.a1800.parse_track(data)
+        self.assertEqual(bitrate, 16000)
+        self.assertEqual(frames.shape[1], 20)
+        self.assertGreater(len(frames), 0)
+        
+        if data.startswith(self.a1800.A18_HEADER):
+            _, bare_frames = self.a1800.parse_track(data[self.a1800.A18_HEADER_LENGTH:])
+            self.assertTrue((bare_frames == frames).all())
+    
+    def test_categorize(self):
+        """Test that categorization gives a category per region and 15 balances"""
+        categories, balances = self.a1800.categorize(320 - 5 - 13 * 5 - 4, list(range(14)))
+        self.assertEqual(len(categories), 14)
+        self.assertEqual(len(balances), 15)
+        self.assertTrue(all(0 <= c <= 7 for c in categories))
+        self.assertTrue(all(0 <= b < 14 for b in balances))
+    
+    def test_decode(self):
+        """Test decoding an a18 file to 16 kHz PCM"""
+        with open(self.test_a18_path, "rb") as f:
+            data = f.read()
+        _, frames = self.a1800.parse_track(data)
+        samples = self.a1800.decode(data, self.tables)
+        self.assertEqual(samples.dtype.name, "int16")
+        self.assertEqual(len(samples), len(frames) * 320)
+        self.assertTrue((self.a1800.decode(data, self.tables) == samples).all())
+    
+    def test_silent_frame(self):
+        """Test that the lowest-power frame decodes to silence"""
+        track = b"\x2a\x00\x00\x00\x80\x3e" + b"\x00" * 40
+        samples = self.a1800.decode(track, self.tables)
+        self.assertEqual(len(samples), 320)
+        self.assertFalse(samples.any())
+    
+    def test_decode_dlc(self):
+        """Test decoding every track of a DLC across worker processes"""
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        D = dlc(self.test_dlc_path)
+        tracks = D.dlc_sections["AMF"].tracks[:4]
+        decoded = self.a1800.decode_tracks(tracks, self.tables, workers=2)
+        self.assertEqual(len(decoded), 4)
+        for track, samples in zip(tracks, decoded):
+            self.assertEqual(len(samples), len(self.a1800.parse_track(track)[1]) * 320)
+    
+    def test_missing_tables(self):
+        """Test that a missing table file gives a helpful error"""
+        with self.assertRaises(FileNotFoundError):
+            self.a1800.load_tables("nonexistent_tables.json")
+    
+    def test_tables_from_reference(self):
+        """Test generating the table file from reference-style C source"""
+        def c_array(name, rows):
+            if isinstance(rows[0], list):
+                body = ",\n".join("    {%s}" % ", ".join(str(v) for v in row) for row in rows)
+            else:
+                body = ", ".join(hex(v) for v in rows)
+            return "Word16 %s[%d] = {\n%s\n};\n" % (name, len(rows), body)
+        
+        tables = self.tables
+        source = "/* huff_tab.c */\n"
+        source += c_array("differential_region_power_bits", [[0] * 24] + tables.region_power_lengths + [[0] * 24] * 14)
+        source += c_array("differential_region_power_codes", [[0] * 24] + [[c for c, _ in row] for row in tables.region_power_codes] + [[0] * 24] * 14)
+        for category in range(7):
+            source += c_array("mlt_sqvh_bitcount_category_%d" % category, [l for _, l in tables.vector_codes[category]])
+            source += "// codes\n" + c_array("mlt_sqvh_code_category_%d" % category, [c for c, _ in tables.vector_codes[category]])
+        source += c_array("mlt_quant_centroid", [[int(round(c * 4096)) for c in row] for row in tables.centroids])
+        
+        temp_dir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(temp_dir, "common"))
+            with open(os.path.join(temp_dir, "common", "huff_tab.c"), "w") as f:
+                f.write(source)
+            generated = self.a1800.A1800Tables.from_dict(self.a1800.tables_from_reference(temp_dir))
+            with self.assertRaises(ValueError):
+                self.a1800.tables_from_reference(os.path.join(temp_dir, "missing"))
+        finally:
+            shutil.rmtree(temp_dir)
+        
+        self.assertEqual(generated.region_power_codes, tables.region_power_codes)
+        self.assertEqual(generated.vector_codes, tables.vector_codes)
+        for ours, theirs in zip(generated.centroids, tables.centroids):
+            self.assertLess(max(abs(ours - theirs)), 1e-3)
+
+
+class TestA1800Reference(unittest.TestCase):
+    """Compare the native codec against a1800.dll, where the tables and reference files are available
+    
+    The codec-reference CI workflow makes both (see audioutils/make_a1800_reference.py)
+    and sets A1800_REFERENCE_REQUIRED, so that these fail rather than skip without them.
+    """
+    
+    def missing(self, reason):
+        if os.environ.get("A1800_REFERENCE_REQUIRED"):
+            self.fail(reason)
+        self.skipTest(reason)
+    
+    def load_tables(self):
+        import a1800
+        try:
+            return a1800.load_tables()
+        except FileNotFoundError:
+            self.missing("A1800 codec tables not found")
+    
+    def test_matches_dll(self):
+        """Test that each .a18 with a .dll.wav decoding beside it decodes alike"""
+        import glob
+        import a1800
+        tables = self.load_tables()
+        pairs = [(p, p[:-len(".a18")] + ".dll.wav") for p in sorted(glob.glob("./audio/new_audio/*.a18")) if not p.endswith(".dll.a18")]
+        pairs = [(a18, wav) for a18, wav in pairs if os.path.exists(wav)]
+        if not pairs:
+            self.missing("No reference decodings from a1800.dll")
+        
+        for a18_path, wav_path in pairs:
+            ours = a1800.decode_file(a18_path, tables)
+            theirs = a1800.read_wav(wav_path)
+            # Noise-filled regions can't match exactly, so allow 10 dB.
+            self.assertGreater(self.snr(theirs, ours), 10, a18_path)
+    
+    def test_encoder_matches_dll(self):
+        """Test that each .wav with a .dll.a18 encoding beside it encodes as well as the DLL does"""
+        import glob
+        import a1800
+        tables = self.load_tables()
+        pairs = [(p, p[:-len(".wav")] + ".dll.a18") for p in sorted(glob.glob("./audio/new_audio/*.wav")) if not p.endswith(".dll.wav")]
+        pairs = [(wav, a18) for wav, a18 in pairs if os.path.exists(a18)]
+        if not pairs:
+            self.missing("No reference encodings from a1800.dll")
+        
+        for wav_path, a18_path in pairs:
+            original = a1800.load_audio(wav_path)
+            ours = a1800.decode(a1800.encode(original, tables), tables)
+            theirs = a1800.decode_file(a18_path, tables)
+            # Both are heard through the (DLL-checked) decoder; ours may be at most 1 dB worse.
+            self.assertGreater(self.snr(original, ours), self.snr(original, theirs) - 1, wav_path)
+    
+    def snr(self, reference, decoded):
+        """Signal to noise ratio of decoded against reference, in dB, at the best lag."""
+        import numpy as np
+        reference = np.asarray(reference, dtype=float)
+        decoded = np.asarray(decoded, dtype=float)
+        # The DLL may not have the same delay; line the two up first.
+        best = None
+        for lag in range(-320, 321, 1):
+            a = decoded[max(lag, 0):]
+            b = reference[max(-lag, 0):]
+            n = min(len(a), len(b))
+            error = np.sum((a[:n] - b[:n]) ** 2)
+            if (best is None) or (error < best[0]):
+                best = (error, np.sum(b[:n] ** 2))
+        return 10 * np.log10(best[1] / max(best[0], 1e-9))
+
+
+class TestA1800Encoder(unittest.TestCase):
+    """Test the native A1800 encoder"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_wav_path = "./audio/new_audio/toccata_in_d_minor_16khz.wav"
+        if not os.path.exists(self.test_wav_path):
+            self.skipTest("Test WAV file not found")
+        import a1800
+        self.a1800 = a1800
+        self.tables = a1800_test_tables()
+        self.samples = a1800.read_wav(self.test_wav_path)[:16000]
+    
+    def test_frame_layout(self):
+        """Test that encoded audio is a whole number of 40-byte frames at 16 kbps"""
+        track = self.a1800.encode(self.samples, self.tables)
+        bitrate, frames = self.a1800.parse_track(track)
+        self.assertEqual(bitrate, 16000)
+        self.assertEqual(len(track), 6 + 40 * len(frames))
+        self.assertEqual(len(frames), 16000 // 320 + 1)
+    
+    def test_roundtrip(self):
+        """Test that decoding the encoder's output resembles the input"""
+        import numpy as np
+        decoded = self.a1800.decode(self.a1800.encode(self.samples, self.tables), self.tables)
+        original = self.samples.astype(float)
+        error = original - decoded[:len(original)]
+        self.assertGreater(np.sum(original ** 2), 4 * np.sum(error ** 2))
+    
+    def test_track_accepted_by_dlc(self):
+        """Test that an encoded .a18 file can be inserted into a DLC"""
+        test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        temp_dir = tempfile.mkdtemp()
+        try:
+            a18_path = os.path.join(temp_dir, "encoded.a18")
+            self.a1800.encode_file(a18_path, self.samples, self.tables)
+            D = dlc(test_dlc_path)
+            D.dlc_sections["AMF"].replace_track(0, a18_path)
+            self.assertEqual(bytes(D.dlc_sections["AMF"].tracks[0]), self.a1800.encode(self.samples, self.tables))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class TestBatchConversion(unittest.TestCase):
+    """Test the parallel, cached batch audio converter"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        import wave
+        import numpy as np
+        from audioutils import batch_convert
+        self.batch_convert = batch_convert
+        self.tables = a1800_test_tables()
+        self.temp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.temp_dir, "in")
+        self.output_dir = os.path.join(self.temp_dir, "out")
+        self.cache_dir = os.path.join(self.temp_dir, "cache")
+        os.mkdir(self.input_dir)
+        
+        # Stereo 44.1 kHz inputs, so they need resampling.
+        rng = np.random.default_rng(0)
+        for name in ("one.wav", "two.wav"):
+            with wave.open(os.path.join(self.input_dir, name), "wb") as w:
+                w.setnchannels(2)
+                w.setsampwidth(2)
+                w.setframerate(44100)
+                w.writeframes(rng.normal(0, 2000, (22050, 2)).astype("<i2").tobytes())
+    
+    def tearDown(self):
+        """Clean up test fixtures"""
+        shutil.rmtree(self.temp_dir)
+    
+    def convert(self, **kwargs):
+        kwargs.setdefault("backend", "native")
+        return self.batch_convert.convert_batch([self.input_dir], self.output_dir, self.tables, cache_dir=self.cache_dir, **kwargs)
+    
+    def read_outputs(self):
+        outputs = {}
+        for name in sorted(os.listdir(self.output_dir)):
+            with open(os.path.join(self.output_dir, name), "rb") as f:
+                outputs[name] = f.read()
+        return outputs
+    
+    def test_parallel_conversion(self):
+        """Test that a directory of inputs is encoded across worker processes"""
+        report = self.convert(jobs=2)
+        self.assertEqual(len(report["encoded"]), 2)
+        self.assertEqual(len(report["cached"]), 0)
+        outputs = self.read_outputs()
+        self.assertEqual(sorted(outputs), ["one.a18", "two.a18"])
+        for data in outputs.values():
+            self.assertTrue(data.startswith(self.batch_convert.a1800.A18_HEADER))
+    
+    def test_unchanged_inputs_cached(self):
+        """Test that a rebuild with nothing changed comes entirely from the cache"""
+        self.convert(jobs=1)
+        first = self.read_outputs()
+        shutil.rmtree(self.output_dir)
+        
+        report = self.convert(jobs=1)
+        self.assertEqual(len(report["encoded"]), 0)
+        self.assertEqual(len(report["cached"]), 2)
+        self.assertEqual(self.read_outputs(), first)
+    
+    def test_settings_change_misses_cache(self):
+        """Test that changing the bitrate re-encodes"""
+        self.convert(jobs=1)
+        report = self.convert(jobs=1, bitrate=24000)
+        self.assertEqual(len(report["encoded"]), 2)
+    
+    def test_same_names_kept_apart(self):
+        """Test that inputs with the same name in different directories don't overwrite each other"""
+        os.mkdir(os.path.join(self.input_dir, "sub"))
+        shutil.copyfile(os.path.join(self.input_dir, "two.wav"), os.path.join(self.input_dir, "sub", "one.wav"))
+        self.convert(jobs=1)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "one.a18")))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "sub", "one.a18")))
+        
+        with self.assertRaises(ValueError):
+            self.batch_convert.convert_batch([os.path.join(self.input_dir, "one.wav"), os.path.join(self.input_dir, "sub", "one.wav")],
+                                             self.output_dir, self.tables, cache_dir=None, backend="native")
+    
+    def test_dll_backend(self):
+        """Test that the dll backend hands the DLL 16 kHz WAVs, and that changing backend or DLL misses the cache"""
+        import wave
+        dll_path = os.path.join(self.temp_dir, "a1800.dll")
+        with open(dll_path, "wb") as f:
+            f.write(b"not really a DLL")
+        seen = []
+        
+        def encode_with_dll(samples, dll):
+            wav_path = os.path.join(self.temp_dir, "seen.wav")
+            self.batch_convert.a1800.write_wav(wav_path, samples)
+            with wave.open(wav_path, "rb") as w:
+                seen.append((w.getframerate(), w.getnchannels(), dll))
+            return b"from the dll"
+        self.batch_convert.encode_with_dll, original = encode_with_dll, self.batch_convert.encode_with_dll
+        self.addCleanup(setattr, self.batch_convert, "encode_with_dll", original)
+        
+        report = self.convert(jobs=1, backend="dll", dll_path=dll_path)
+        self.assertEqual(len(report["encoded"]), 2)
+        self.assertEqual(seen, [(16000, 1, os.path.abspath(dll_path))] * 2)
+        self.assertEqual(set(self.read_outputs().values()), {b"from the dll"})
+        self.assertEqual(len(self.convert(jobs=1, backend="dll", dll_path=dll_path)["cached"]), 2)
+        self.assertEqual(len(self.convert(jobs=1)["encoded"]), 2)
+        with open(dll_path, "ab") as f:
+            f.write(b" (updated)")
+        self.assertEqual(len(self.convert(jobs=1, backend="dll", dll_path=dll_path)["encoded"]), 2)
+        
+        with self.assertRaises(FileNotFoundError):
+            self.convert(jobs=1, backend="dll", dll_path=os.path.join(self.temp_dir, "missing.dll"))
+        with self.assertRaises(ValueError):
+            self.convert(jobs=1, backend="dll", dll_path=dll_path, bitrate=24000)
+
+
+class TestAudioExtraction(unittest.TestCase):
+    """Test the structure-aware a18 extractor"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        from audioutils import extract_audio
+        self.extract_audio = extract_audio
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        """Clean up test fixtures"""
+        shutil.rmtree(self.temp_dir)
+    
+    def test_tracks_match_amf_section(self):
+        """Test that every extracted track matches the parsed AMF section"""
+        D = dlc(self.test_dlc_path)
+        tracks = D.dlc_sections["AMF"].tracks
+        manifest = self.extract_audio.extract_many([self.test_dlc_path], self.temp_dir, jobs=1)
+        
+        self.assertEqual(len(manifest), len(tracks))
+        for entry, track in zip(manifest, tracks):
+            with open(entry["file"], "rb") as f:
+                self.assertEqual(f.read(), bytes(track))
+            self.assertEqual(entry["length"], len(track))
+    
+    def test_manifest_written(self):
+        """Test that the manifest is written alongside the tracks"""
+        import json
+        manifest = self.extract_audio.extract_many([self.test_dlc_path], self.temp_dir, jobs=1)
+        with open(os.path.join(self.temp_dir, "manifest.json")) as f:
+            self.assertEqual(json.load(f), manifest)
+    
+    def test_bad_track_offset(self):
+        """Test that a track offset outside the AMF section is rejected"""
+        from furby import FormatError
+        with open(self.test_dlc_path, "rb") as f:
+            data = bytearray(f.read())
+        D = dlc(self.test_dlc_path)
+        amf_length, amf_offset = [(l, o) for (n, l, o) in D.dlc_header.map_dlc() if n == "AMF"][0]
+        data[amf_offset + 4:amf_offset + 8] = (amf_length + 16).to_bytes(4, "little")
+        with self.assertRaises(FormatError):
+            self.extract_audio.track_spans(bytes(data), amf_offset, amf_length)
+    
+    def test_truncated_dlc(self):
+        """Test that a DLC cut off inside its AMF section raises a FormatError"""
+        from furby import FormatError
+        with open(self.test_dlc_path, "rb") as f:
+            data = f.read()
+        D = dlc(self.test_dlc_path)
+        amf_length, amf_offset = [(l, o) for (n, l, o) in D.dlc_header.map_dlc() if n == "AMF"][0]
+        truncated_path = os.path.join(self.temp_dir, "truncated.dlc")
+        with open(truncated_path, "wb") as f:
+            f.write(data[:amf_offset + amf_length - 1000])
+        with self.assertRaises(FormatError):
+            self.extract_audio.extract_dlc(truncated_path, os.path.join(self.temp_dir, "out"))
+    
+    def test_bad_dlcs_skipped(self):
+        """Test that empty and truncated DLCs are reported, and the rest of the batch still extracted"""
+        with open(self.test_dlc_path, "rb") as f:
+            data = f.read()
+        paths = [os.path.join(self.temp_dir, name) for name in ("empty.dlc", "short.dlc")]
+        for path, content in zip(paths, (b"", data[:0x300])):
+            with open(path, "wb") as f:
+                f.write(content)
+        paths.append(self.test_dlc_path)
+        for jobs in (1, 2):
+            errors = []
+            manifest = self.extract_audio.extract_many(paths, os.path.join(self.temp_dir, "out%d" % jobs), jobs=jobs, errors=errors)
+            self.assertEqual(len(errors), 2)
+            self.assertTrue(errors[0].startswith(paths[0]))
+            self.assertEqual({entry["dlc"] for entry in manifest}, {os.path.normpath(self.test_dlc_path)})
+    
+    def test_same_names_kept_apart(self):
+        """Test that DLCs with the same name from different directories get their own directories"""
+        paths = []
+        for sub in ("a", "b"):
+            os.mkdir(os.path.join(self.temp_dir, sub))
+            paths.append(os.path.join(self.temp_dir, sub, "tu003410.dlc"))
+            shutil.copyfile(self.test_dlc_path, paths[-1])
+        manifest = self.extract_audio.extract_many(paths, os.path.join(self.temp_dir, "out"), jobs=1)
+        files = {entry["file"] for entry in manifest}
+        self.assertEqual(len(files), len(manifest))
+        self.assertEqual({entry["dlc"] for entry in manifest}, set(paths))
+
+
+class TestFrameEditing(unittest.TestCase):
+    """Test frame-accurate a18 trimming and splicing"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.D = dlc(self.test_dlc_path)
+        self.amf = self.D.dlc_sections["AMF"]
+    
+    def test_split_join_roundtrip(self):
+        """Test that splitting a track into frames and joining them is lossless"""
+        for track in self.amf.tracks[:10]:
+            bitrate, frames = self.amf.split_frames(track)
+            self.assertEqual(bitrate, 16000)
+            self.assertTrue(all(len(f) == 40 for f in frames))
+            self.assertEqual(self.amf.join_frames(frames, bitrate), bytes(track))
+    
+    def test_trim_concat_loop(self):
+        """Test trimming, concatenating and looping at frame boundaries"""
+        first, second = self.amf.tracks[0], self.amf.tracks[1]
+        _, first_frames = self.amf.split_frames(first)
+        _, second_frames = self.amf.split_frames(second)
+        
+        trimmed = self.amf.trim_track(first, 2, 7)
+        self.assertEqual(self.amf.frame_count(trimmed), 5)
+        self.assertEqual(bytes(trimmed[6:46]), bytes(first_frames[2]))
+        
+        joined = self.amf.concat_tracks([trimmed, second])
+        self.assertEqual(self.amf.frame_count(joined), 5 + len(second_frames))
+        self.assertEqual(bytes(joined[-40:]), bytes(second_frames[-1]))
+        
+        looped = self.amf.loop_track(trimmed, num_frames=12)
+        self.assertEqual(self.amf.frame_count(looped), 12)
+        self.assertEqual(bytes(looped[6 + 5 * 40:6 + 10 * 40]), bytes(trimmed[6:]))
+        self.assertEqual(self.amf.loop_track(trimmed, times=3), self.amf.concat_tracks([trimmed] * 3))
+        with self.assertRaises(ValueError):
+            self.amf.loop_track(trimmed)
+    
+    def test_bad_bitrate(self):
+        """Test that a bitrate that can't make whole frames raises a FormatError"""
+        from furby import FormatError
+        for bitrate in (0, 100, 16100):
+            with self.assertRaises(FormatError):
+                self.amf.frame_size(bitrate)
+    
+    def test_silence(self):
+        """Test building silence from the built-in frame, a given one, and the native encoder"""
+        from furby import FormatError
+        track = self.amf.silence(25)
+        self.assertEqual(self.amf.frame_count(track), 25)
+        self.assertEqual(struct.unpack_from("<IH", track), (25 * 40 + 2, 16000))
+        self.assertEqual(bytes(self.amf.split_frames(track)[1][24]), self.amf.silent_frame_16k)
+        self.assertEqual(self.amf.silence(3, frame=b"\x00" * 40)[6:], b"\x00" * 120)
+        with self.assertRaises(FormatError):
+            self.amf.silence(3, bitrate=24000)
+        
+        import a1800
+        tables = a1800_test_tables()
+        frame = a1800.silent_frame(tables)
+        # The codec's quietest envelope still carries a little noise fill.
+        self.assertLessEqual(abs(a1800.decode(self.amf.silence(10, frame=frame), tables)).max(), 4)
+    
+    def test_minify_on_frame_boundaries(self):
+        """Test that minified tracks end on a frame boundary"""
+        self.amf.minify_audio(8010)
+        for track in self.amf.tracks:
+            self.assertEqual((len(track) - 6) % 40, 0)
+            self.assertLessEqual(len(track) - 6, 8000)
+        
+        temp_dir = tempfile.mkdtemp()
+        try:
+            output_path = os.path.join(temp_dir, "minified.dlc")
+            self.D.build(output_path)
+            reloaded = dlc(output_path)
+            self.assertEqual([bytes(t) for t in reloaded.dlc_sections["AMF"].tracks], [bytes(t) for t in self.amf.tracks])
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class TestTrackIndex(unittest.TestCase):
+    """Test the AMF track metadata index"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.D = dlc(self.test_dlc_path)
+        self.amf = self.D.dlc_sections["AMF"]
+    
+    def test_index_from_headers(self):
+        """Test that frames, duration and size come from the track headers"""
+        index = self.amf.track_index()
+        self.assertEqual(len(index), len(self.amf.tracks))
+        for row, track in zip(index, self.amf.tracks):
+            self.assertEqual(row["bytes"], len(track))
+            self.assertEqual(row["frames"], (len(track) - 6) // 40)
+            self.assertEqual(row["duration_ms"], row["frames"] * 20)
+            self.assertEqual(row["sample_rate"], self.amf.samplerate)
+    
+    def test_sort_and_format(self):
+        """Test sorting the index by a column and printing it as a table"""
+        index = self.amf.track_index().sort_by("duration_ms", reverse=True)
+        durations = index.column("duration_ms")
+        self.assertEqual(durations, sorted(durations, reverse=True))
+        lines = str(index).splitlines()
+        self.assertEqual(len(lines), len(index) + 1)
+        self.assertIn("duration_ms", lines[0])
+    
+    def test_save_and_load(self):
+        """Test persisting the index next to a DLC"""
+        from furby import TrackIndex
+        index = self.amf.track_index()
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, "tu003410.tracks.json")
+            index.save(path)
+            self.assertEqual(TrackIndex.load(path), index)
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class TestWordListParser(unittest.TestCase):
+    """Test the shared bulk parser for terminated word lists"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.D = dlc(self.test_dlc_path)
+    
+    def read_word_by_word(self, rawbytes, offset, terminator):
+        words = []
+        while not words or words[-1] != terminator:
+            words.append(struct.unpack_from("<H", rawbytes, offset + 2 * len(words))[0])
+        return words
+    
+    def test_matches_word_by_word_parse(self):
+        """Test that every list matches a word-at-a-time read of the section"""
+        for name, attribute, offset_base in (("LPS", "phrases", 3), ("MTR", "animations", 3), ("SEQ", "sequences", 0)):
+            section = self.D.dlc_sections[name]
+            lists = getattr(section, attribute)
+            count = struct.unpack_from("<H", section.rawbytes)[0]
+            offsets = [2 * (offset_base + o) for o in struct.unpack_from("<%dI" % count, section.rawbytes, 6)]
+            expected = [self.read_word_by_word(section.rawbytes, o, section.entry_terminator) for o in offsets]
+            self.assertEqual([list(l) for l in lists], expected)
+    
+    def section_with_bytes(self, rawbytes):
+        section = dlc.SEQ_section()
+        section.rawbytes = rawbytes
+        section.length = len(rawbytes)
+        return section
+    
+    def test_odd_offset(self):
+        """Test that lists starting on an odd byte are read correctly"""
+        section = self.section_with_bytes(b"\x00" + struct.pack("<5H", 1, 2, 3, 0, 9))
+        self.assertEqual(section.__read_word_lists__([1, 5], 0), [[1, 2, 3, 0], [3, 0]])
+    
+    def test_unterminated_list(self):
+        """Test that a list without a terminator raises a FormatError"""
+        from furby import FormatError
+        section = self.section_with_bytes(struct.pack("<3H", 1, 2, 3))
+        with self.assertRaises(FormatError):
+            section.__read_word_lists__([0], 0)
+
+
+class TestPackedLists(unittest.TestCase):
+    """Test CSR-packed storage for APL, LPS, SEQ and MTR"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.D = dlc(self.test_dlc_path)
+    
+    def test_packed_layout(self):
+        """Test that each section's lists share one values array"""
+        from furby import PackedLists
+        for name, attribute in (("APL", "playlists"), ("LPS", "phrases"), ("SEQ", "sequences"), ("MTR", "animations")):
+            lists = getattr(self.D.dlc_sections[name], attribute)
+            self.assertIsInstance(lists, PackedLists)
+            self.assertEqual(len(lists.offsets), len(lists) + 1)
+            self.assertEqual(lists.offsets[-1], len(lists.values))
+            self.assertEqual(sum(lists.row_lengths()), len(lists.values))
+    
+    def test_rows_behave_like_lists(self):
+        """Test editing rows in place and changing their length"""
+        sequences = self.D.dlc_sections["SEQ"].sequences
+        expected = [list(seq) for seq in sequences]
+        
+        sequences[15][3] = 0x8401
+        expected[15][3] = 0x8401
+        sequences[15] = sequences[15][:4] + [0]
+        expected[15] = expected[15][:4] + [0]
+        sequences.append(list(sequences[2]))
+        expected.append(list(expected[2]))
+        del sequences[0]
+        del expected[0]
+        sequences.insert(3, [0x2000, 0x4546, 0])
+        expected.insert(3, [0x2000, 0x4546, 0])
+        
+        self.assertEqual([list(seq) for seq in sequences], expected)
+        self.assertEqual(sequences, expected)
+    
+    def test_list_operations(self):
+        """Test the list operators and conversions rows support, including JSON via tolist()"""
+        import json
+        sequences = self.D.dlc_sections["SEQ"].sequences
+        row = sequences[2]
+        words = list(row)
+        self.assertEqual([1] + row, [1] + words)
+        self.assertEqual(row + [1], words + [1])
+        self.assertEqual(row * 2, words * 2)
+        self.assertEqual(2 * row, words * 2)
+        copied = row.copy()
+        copied[0] = 0
+        self.assertEqual(list(row), words)
+        self.assertEqual(json.loads(json.dumps(sequences.tolist())), [list(seq) for seq in sequences])
+        self.assertEqual(json.loads(json.dumps(row.tolist())), words)
+    
+    def test_held_rows_follow_their_list(self):
+        """Test that a row held across inserts, deletes and replacements keeps showing the same list"""
+        sequences = self.D.dlc_sections["SEQ"].sequences
+        held = sequences[5]
+        words = list(held)
+        
+        sequences.insert(0, [0x2000, 0x4546, 0])
+        self.assertEqual(held, words)
+        self.assertIs(sequences[6], held)
+        del sequences[0]
+        del sequences[1]
+        self.assertEqual(held, words)
+        held[0] = 0x0300
+        words[0] = 0x0300
+        self.assertEqual(sequences[4], words)
+        
+        # Replaced or deleted rows keep their old contents, detached from the section.
+        sequences[4] = [0x0200, 0x4546, 0]
+        self.assertEqual(held, words)
+        held[1] = 1
+        self.assertEqual(sequences[4], [0x0200, 0x4546, 0])
+    
+    def test_packed_on_assignment(self):
+        """Test that assigned lists are packed straight away, so size queries don't change anything"""
+        from furby import PackedLists
+        mtr = self.D.dlc_sections["MTR"]
+        mtr.animations = [list(a) for a in mtr.animations]
+        self.assertIsInstance(mtr.animations, PackedLists)
+        animations = mtr.animations
+        mtr.compiled_size()
+        self.assertIs(mtr.animations, animations)
+    
+    def test_playlist_entries(self):
+        """Test that playlists read back as (value, kind) and kinds are an enum array"""
+        from furby import PackedPlaylists
+        playlists = self.D.dlc_sections["APL"].playlists
+        self.assertTrue(all(kind in ("AUDIO", "PAUSE", "EOF") for pl in playlists for (_, kind) in pl))
+        self.assertEqual(playlists[0][-1], (0xf000, "EOF"))
+        
+        playlists[0][0] = (7, "AUDIO")
+        self.assertEqual(playlists[0][0], (7, "AUDIO"))
+        kinds = playlists.kinds()
+        self.assertEqual(kinds.count(PackedPlaylists.EOF), len(playlists))
+    
+    def test_edited_build_roundtrip(self):
+        """Test that edits survive a build, and that plain lists can still be assigned"""
+        self.D.dlc_sections["SEQ"].sequences[15] = self.D.dlc_sections["SEQ"].sequences[15][:4] + [0]
+        self.D.dlc_sections["MTR"].animations = [list(a) for a in self.D.dlc_sections["MTR"].animations]
+        
+        temp_dir = tempfile.mkdtemp()
+        try:
+            output_path = os.path.join(temp_dir, "packed.dlc")
+            self.D.build(output_path)
+            reloaded = dlc(output_path)
+            for name, attribute in (("APL", "playlists"), ("LPS", "phrases"), ("SEQ", "sequences"), ("MTR", "animations")):
+                self.assertEqual(getattr(reloaded.dlc_sections[name], attribute), getattr(self.D.dlc_sections[name], attribute))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class TestResponseTimeline(unittest.TestCase):
+    """Test expanding action codes into timed event timelines"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.D = dlc(self.test_dlc_path)
+    
+    def test_sequence_timeline(self):
+        """Test that a sequence expands into motor, eye, audio, pause and lip events"""
+        seq = self.D.dlc_sections["SEQ"]
+        amf = self.D.dlc_sections["AMF"]
+        seq.sequences[0] = [0x3000, seq.playlist_offset, 0xc406, 0x8051, 0x10af, 0x8402, 0]
+        timeline = self.D.sequence_timeline(0)
+        
+        self.assertEqual([e.t_ms for e in timeline], sorted(e.t_ms for e in timeline))
+        self.assertEqual(timeline[0].kind, "motor")
+        self.assertEqual(timeline[0].source, "dlc")
+        eyes = [(e.t_ms, e.duration_ms, e.source) for e in timeline if e.kind == "eyes"]
+        self.assertEqual(eyes, [(0, 0xaf, "firmware"), (0xaf, None, "dlc")])
+        
+        playlist = self.D.dlc_sections["APL"].playlists[0]
+        audio = [e for e in timeline if e.kind in ("audio", "pause")]
+        self.assertEqual(len(audio), len(playlist) - 1)
+        for event, (value, kind) in zip(audio, playlist):
+            if kind == "AUDIO":
+                self.assertEqual(event.duration_ms, amf.frame_count(amf.tracks[value]) * 20)
+            else:
+                self.assertEqual(event.duration_ms, value & 0xfff)
+        
+        lips = [e for e in timeline if e.kind == "lips"]
+        self.assertEqual(len(lips), len(self.D.dlc_sections["LPS"].phrases[0]) - 1)
+        self.assertEqual(lips[0].value, "open")
+    
+    def test_response_timeline(self):
+        """Test looking up an action code's sequence, and rejecting firmware ones"""
+        for action_code, leaf in self.D.__action_leaves__():
+            if (leaf["vals"][0] >> 8) == self.D.dlc_sequence_bank:
+                self.assertEqual(self.D.response_timeline(action_code), self.D.sequence_timeline(leaf["seq"]))
+                break
+        for action_code, leaf in self.D.__action_leaves__():
+            if (leaf["vals"][0] >> 8) != self.D.dlc_sequence_bank:
+                with self.assertRaises(KeyError):
+                    self.D.response_timeline(action_code)
+                break
+    
+    def test_batch_shares_memoized_timelines(self):
+        """Test the batch covers every DLC action code and expands each sequence once"""
+        timelines = self.D.response_timelines()
+        by_sequence = {}
+        for action_code, leaf in self.D.__action_leaves__():
+            if (leaf["vals"][0] >> 8) == self.D.dlc_sequence_bank:
+                self.assertIn(action_code, timelines)
+                by_sequence.setdefault(leaf["seq"], []).append(timelines[action_code])
+        self.assertEqual(len(timelines), sum(len(t) for t in by_sequence.values()))
+        for shared in by_sequence.values():
+            for timeline in shared:
+                self.assertIs(timeline, shared[0])
+
+
+class TestLipSync(unittest.TestCase):
+    """Test generating LPS lip-sync phrases from audio"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        import numpy as np
+        import lipsync
+        self.np = np
+        self.lipsync = lipsync
+        self.tone = 8000 * np.sin(np.arange(3200) * 0.3)
+    
+    def test_phrase_from_samples(self):
+        """Test that sound opens the mouth and silence shuts it, in ms"""
+        np = self.np
+        samples = np.concatenate([self.tone, np.zeros(4800), self.tone[:1600]])
+        self.assertEqual(self.lipsync.phrase_from_samples(samples), [0x8000 | 200, 300, 0x8000 | 100, 0, 0xffff])
+        # A phrase always starts with an open word
+        samples = np.concatenate([np.zeros(1600), self.tone])
+        self.assertEqual(self.lipsync.phrase_from_samples(samples), [0x8000, 100, 0x8000 | 200, 0, 0xffff])
+    
+    def test_short_runs_merged(self):
+        """Test that blips too short for the mouth to follow are ignored"""
+        np = self.np
+        samples = np.concatenate([self.tone, np.zeros(320), self.tone])
+        self.assertEqual(self.lipsync.phrase_from_samples(samples), [0x8000 | 420, 0, 0xffff])
+    
+    def test_sync_playlists(self):
+        """Test syncing a playlist from its tracks' PCM, pauses included, in a DLC that still builds"""
+        test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        D = dlc(test_dlc_path)
+        playlist = D.dlc_sections["APL"].playlists[0]
+        pcm = {value: self.tone for value, kind in playlist if kind == "AUDIO"}
+        phrase = self.lipsync.sync_playlists(D, [0], pcm=pcm)[0]
+        
+        self.assertEqual(D.dlc_sections["LPS"].phrases[0], phrase)
+        total_ms = sum(200 if kind == "AUDIO" else value & 0xfff for value, kind in playlist if kind != "EOF")
+        self.assertEqual(sum(w & 0x7fff for w in phrase[:-1]), -(-total_ms // 10) * 10)
+        temp_dir = tempfile.mkdtemp()
+        try:
+            output_path = os.path.join(temp_dir, "synced.dlc")
+            D.build(output_path)
+            self.assertEqual(dlc(output_path).dlc_sections["LPS"].phrases[0], phrase)
+        finally:
+            shutil.rmtree(temp_dir)
+    
+    def test_phrase_count_mismatch(self):
+        """Test that a DLC with fewer phrases than playlists raises a FormatError, not an IndexError"""
+        from furby import FormatError
+        test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        D = dlc(test_dlc_path)
+        del D.dlc_sections["LPS"].phrases[-1]
+        last = len(D.dlc_sections["APL"].playlists) - 1
+        playlist = D.dlc_sections["APL"].playlists[last]
+        pcm = {value: self.tone for value, kind in playlist if kind == "AUDIO"}
+        with self.assertRaises(FormatError):
+            self.lipsync.sync_playlists(D, [last], pcm=pcm)
+
+
+class TestValidation(unittest.TestCase):
+    """Test cross-reference validation"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.D = dlc(self.test_dlc_path)
+    
+    def test_sample_is_valid(self):
+        """Test that an untouched DLC has no issues"""
+        self.assertEqual(self.D.validate(), [])
+    
+    def test_broken_references(self):
+        """Test that broken references are reported with where they are and what they point at"""
+        sections = self.D.dlc_sections
+        sections["SEQ"].sequences[3][1] = sections["SEQ"].playlist_offset + len(sections["APL"].playlists)
+        sections["APL"].playlists[2] = [(len(sections["AMF"].tracks), "AUDIO"), (0xf000, "EOF")]
+        sections["SPR"].frames[5][0] = len(sections["CEL"].cels)
+        for action_code, leaf in self.D.__action_leaves__():
+            if (leaf["vals"][0] >> 8) == self.D.dlc_sequence_bank:
+                self.D.__repoint_leaf__(leaf, len(sections["SEQ"].sequences))
+                break
+        
+        found = {(i.section, i.entry, i.target) for i in self.D.validate()}
+        self.assertIn(("SEQ", 3, "APL"), found)
+        self.assertIn(("APL", 2, "AMF"), found)
+        self.assertIn(("SPR", 5, "CEL"), found)
+        self.assertIn(("XLS", action_code, "SEQ"), found)
+    
+    def test_header_and_track_sizes(self):
+        """Test that stale header sizes and bad track length fields are reported"""
+        amf = self.D.dlc_sections["AMF"]
+        amf.tracks[0] = bytes(amf.tracks[0]) + bytes(40)
+        issues = self.D.validate()
+        self.assertIn(("AMF", 0), [(i.section, i.entry) for i in issues])
+        self.assertIn(("HEADER", "AMF"), [(i.section, i.entry) for i in issues])
+    
+    def test_add_playlist(self):
+        """Test that add_playlist checks and appends a playlist"""
+        from furby import FormatError
+        apl = self.D.dlc_sections["APL"]
+        count = len(apl.playlists)
+        apl.add_playlist([5, 0x1064, 6, 0xf000])
+        self.assertEqual(apl.playlists[count], [(5, "AUDIO"), (0x1064, "PAUSE"), (6, "AUDIO"), (0xf000, "EOF")])
+        with self.assertRaises(FormatError):
+            apl.add_playlist([5, 0x1064, 0xf000])
+
+
+class TestBenchmark(unittest.TestCase):
+    """Test the parse/compile benchmark harness"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        import benchmark_dlc
+        self.benchmark_dlc = benchmark_dlc
+    
+    def test_scaled_dlc_is_valid(self):
+        """Test that a scaled DLC builds, reloads and keeps every reference valid"""
+        original = dlc(self.test_dlc_path)
+        D = self.benchmark_dlc.scale_dlc(dlc(self.test_dlc_path), 2)
+        temp_dir = tempfile.mkdtemp()
+        try:
+            output_path = os.path.join(temp_dir, "scaled.dlc")
+            D.build(output_path)
+            scaled = dlc(output_path)
+        finally:
+            shutil.rmtree(temp_dir)
+        
+        self.assertEqual(scaled.validate(), [])
+        for name, attribute in (("CEL", "cels"), ("SPR", "frames"), ("XLS", "action_tree"), ("AMF", "tracks"), ("APL", "playlists")):
+            self.assertEqual(len(getattr(scaled.dlc_sections[name], attribute)), 2 * len(getattr(original.dlc_sections[name], attribute)))
+    
+    def test_report_and_compare(self):
+        """Test that every section is timed both ways, and that slowdowns are flagged"""
+        report = self.benchmark_dlc.run_benchmarks([self.test_dlc_path], scales=[1], repeat=1)
+        stages = {(r["stage"], r["section"]) for r in report["results"]}
+        for name in ("PAL", "SPR", "CEL", "XLS", "AMF", "APL", "LPS", "SEQ", "MTR"):
+            self.assertIn(("parse", name), stages)
+            self.assertIn(("compile", name), stages)
+        self.assertIn(("load", None), stages)
+        self.assertIn(("build", None), stages)
+        
+        rows, regressions = self.benchmark_dlc.compare(report, report)
+        self.assertEqual(len(rows), len(report["results"]))
+        self.assertEqual(regressions, [])
+        
+        slower = {"results": [dict(r, median_s=3 * r["median_s"]) for r in report["results"]]}
+        rows, regressions = self.benchmark_dlc.compare(report, slower)
+        self.assertEqual(len(regressions), len([r for r in report["results"] if r["median_s"] > 0]))
+
+
+class TestSyntheticDLC(unittest.TestCase):
+    """Test the synthetic DLC generator"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        import synth_dlc
+        self.synth_dlc = synth_dlc
+        self.sizes = dict(cels=5, palettes=2, frames=3, fanout=(4, 3, 2, (1, 3)), tracks=10, track_frames=(5, 20), sequences=6, animations=3)
+    
+    def build_bytes(self, D):
+        import io
+        output = io.BytesIO()
+        D.build(output)
+        return output.getvalue()
+    
+    def test_deterministic(self):
+        """Test that a seed always gives the same DLC, and different seeds don't"""
+        first = self.build_bytes(self.synth_dlc.generate_dlc(seed=7, **self.sizes))
+        self.assertEqual(first, self.build_bytes(self.synth_dlc.generate_dlc(seed=7, **self.sizes)))
+        self.assertNotEqual(first, self.build_bytes(self.synth_dlc.generate_dlc(seed=8, **self.sizes)))
+    
+    def test_sizes_and_references(self):
+        """Test that a generated DLC reloads with the requested sizes and nothing broken"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            paths = self.synth_dlc.generate_corpus(temp_dir, 2, seed=1, jobs=1, **self.sizes)
+            self.assertEqual(len(paths), 2)
+            D = dlc(str(paths[0]))
+        finally:
+            shutil.rmtree(temp_dir)
+        
+        sections = D.dlc_sections
+        self.assertEqual(D.validate(), [])
+        self.assertEqual(len(sections["CEL"].cels), 5)
+        self.assertEqual(len(sections["PAL"].palettes), 2)
+        self.assertEqual([fp["framecount"] for fp in sections["SPR"].frame_playlists], [3] * 16)
+        self.assertEqual(len(sections["XLS"].action_tree), 4)
+        self.assertEqual(len(sections["AMF"].tracks), 10)
+        self.assertEqual(len(sections["SEQ"].sequences), 6)
+        self.assertEqual(len(sections["LPS"].phrases), len(sections["APL"].playlists))
+        used = {value for pl in sections["APL"].playlists for value, kind in pl if kind == "AUDIO"}
+        self.assertEqual(used, set(range(10)))
+    
+    def test_limits(self):
+        """Test that sizes the format can't reference are refused"""
+        with self.assertRaises(ValueError):
+            self.synth_dlc.generate_dlc(sequences=300)
+        with self.assertRaises(ValueError):
+            self.synth_dlc.generate_dlc(frames=0)
+
+
+class TestProfiling(unittest.TestCase):
+    """Test the profiling hooks around load and build"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+    
+    def test_default_is_no_op(self):
+        """Test that without a profiler nothing is recorded and output is unchanged"""
+        import io
+        from furby import Profiler
+        D = dlc(self.test_dlc_path)
+        self.assertIs(type(D.profiler), Profiler)
+        self.assertFalse(D.profiler.enabled)
+        output = io.BytesIO()
+        D.build(output)
+        with open(self.test_dlc_path, "rb") as f:
+            self.assertEqual(output.getvalue(), f.read())
+    
+    def test_spans_cover_every_section(self):
+        """Test that reads, parses and compiles are reported per section with bytes and calls"""
+        import io
+        from furby import SpanRecorder
+        recorder = SpanRecorder()
+        D = dlc(self.test_dlc_path, profiler=recorder)
+        output = io.BytesIO()
+        D.build(output)
+        
+        sections = set(D.dlc_sections)
+        self.assertEqual(len(sections), 9)
+        for stage in ("read", "parse", "compile"):
+            spans = [s for s in recorder.spans if (s.stage == stage) and (s.section in sections)]
+            self.assertEqual({s.section for s in spans}, sections)
+            self.assertEqual(sum(s.bytes for s in spans), len(output.getvalue()) - 0x288)
+        for s in recorder.spans:
+            self.assertGreaterEqual(s.wall_s, 0)
+            self.assertIsNotNone(s.alloc_blocks)
+        self.assertTrue(all(s.reads == 1 for s in recorder.spans if s.stage == "read"))
+        self.assertTrue(all(s.writes >= 1 for s in recorder.spans if s.stage == "compile"))
+        self.assertIn(("map", "HEADER"), [(s.stage, s.section) for s in recorder.spans])
+    
+    def test_callback_and_summary(self):
+        """Test that the callback sees each span and the summary totals them"""
+        from furby import SpanRecorder
+        seen = []
+        recorder = SpanRecorder(callback=seen.append)
+        dlc(self.test_dlc_path, profiler=recorder)
+        self.assertEqual(seen, recorder.spans)
+        summary = {(t["stage"], t["section"]) : t for t in recorder.summary()}
+        self.assertEqual(summary[("parse", "AMF")]["count"], 1)
+        self.assertEqual(sum(t["reads"] for t in summary.values()), 10)
+
+
+class TestLogging(unittest.TestCase):
+    """Test the library's structured log records"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        import logging
+        from furby import log, EventCollector
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.collector = EventCollector()
+        log.addHandler(self.collector)
+        self.addCleanup(log.removeHandler, self.collector)
+        self.addCleanup(log.setLevel, log.level)
+        log.setLevel(logging.DEBUG)
+    
+    def test_self_test_is_logged(self):
+        """Test that the self-test logs one record per section instead of printing"""
+        import io
+        import contextlib
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            D = dlc(self.test_dlc_path, self_test=True)
+        self.assertEqual(stdout.getvalue(), "")
+        counts = self.collector.counts()
+        self.assertEqual({section for (event, section) in counts if event == "self_test"}, set(D.dlc_sections))
+        self.assertEqual(self.collector.events[0]["offset"], 0x288)
+    
+    def test_dead_frames_are_counted(self):
+        """Test that unreferenced sprite frames are reported as one record with a count"""
+        D = dlc(self.test_dlc_path)
+        spr = D.dlc_sections["SPR"]
+        for fp in spr.frame_playlists:
+            fp["frame_indices"] = [i for i in fp["frame_indices"] if i not in (1, 2)] or [0]
+            fp["framecount"] = len(fp["frame_indices"])
+        D.SPR_section(spr.write_out())
+        
+        dead = [e for e in self.collector.events if e["event"] == "dead_frames"]
+        self.assertEqual(len(dead), 1)
+        self.assertEqual(dead[0]["section"], "SPR")
+        self.assertEqual(dead[0]["count"], 2)
+        self.assertEqual(self.collector.counts()[("dead_frames", "SPR")], 2)
+    
+    def test_merge_worker_events(self):
+        """Test that events from elsewhere (e.g. worker processes) can be merged and counted"""
+        import pickle
+        D = dlc(self.test_dlc_path)
+        D.dlc_sections["AMF"].minify_audio(100)
+        events = pickle.loads(pickle.dumps(self.collector.events))
+        self.collector.merge(events)
+        self.assertEqual(self.collector.counts()[("minify_floor", "AMF")], 2)
+        self.assertEqual(events[0]["level"], "WARNING")
+
+
+class TestBudgetFitting(unittest.TestCase):
+    """Test fitting a DLC into a byte budget"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.D = dlc(self.test_dlc_path)
+    
+    def build_size(self):
+        import io
+        output = io.BytesIO()
+        self.D.build(output)
+        return len(output.getvalue())
+    
+    def test_lossless_strategies_first(self):
+        """Test that a small cut is met by deduplication alone, without touching audio"""
+        tracks = list(self.D.dlc_sections["AMF"].tracks)
+        size = self.D.compiled_size()
+        self.assertEqual(size, os.path.getsize(self.test_dlc_path))
+        report = self.D.fit_to_budget(size - 1000)
+        self.assertTrue(report["fits"])
+        self.assertEqual([s["strategy"] for s in report["steps"]], ["deduplicate_audio", "deduplicate_frames"])
+        self.assertEqual(self.build_size(), report["size_after"])
+        self.assertEqual(list(self.D.dlc_sections["AMF"].tracks), tracks)
+        self.assertEqual(self.D.validate(), [])
+    
+    def test_trims_low_priority_tracks_first(self):
+        """Test that trimming meets the budget, sparing higher priority tracks"""
+        amf = self.D.dlc_sections["AMF"]
+        lengths = [len(t) for t in amf.tracks]
+        budget = self.D.compiled_size() - 100000
+        report = self.D.fit_to_budget(budget, priorities={0 : 1, 1 : 1})
+        self.assertTrue(report["fits"])
+        self.assertLessEqual(self.build_size(), budget)
+        self.assertEqual(report["steps"][-1]["strategy"], "trim_audio")
+        self.assertEqual([len(t) for t in amf.tracks[:2]], lengths[:2])
+        for t in amf.tracks:
+            self.assertEqual((len(t) - 6) % amf.frame_size(), 0)
+        self.assertEqual(self.D.validate(), [])
+    
+    def test_over_budget_and_unused_assets(self):
+        """Test that an impossible budget is reported, and unused tracks are dropped"""
+        apl = self.D.dlc_sections["APL"]
+        apl.playlists[0] = [(v, k) for v, k in apl.playlists[0] if k != "AUDIO"]
+        report = self.D.fit_to_budget(1000, strategies=("drop_unused_assets", "trim_audio"))
+        self.assertFalse(report["fits"])
+        self.assertGreater(report["size_after"], 1000)
+        self.assertGreater(len(report["steps"][0]["tracks"]), 0)
+        self.build_size()
+        self.assertEqual(self.D.validate(), [])
+        with self.assertRaises(ValueError):
+            self.D.fit_to_budget(1000, strategies=("defragment",))
+
+
+class TestAsyncAPI(unittest.TestCase):
+    """Test the asyncio load and build entry points"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        with open(self.test_dlc_path, "rb") as f:
+            self.original = f.read()
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        """Clean up test fixtures"""
+        shutil.rmtree(self.temp_dir)
+    
+    def test_open_and_build(self):
+        """Test that aopen and abuild round-trip a DLC through a file"""
+        import asyncio
+        output_path = os.path.join(self.temp_dir, "async.dlc")
+        
+        async def job():
+            D = await dlc.aopen(self.test_dlc_path)
+            await D.abuild(output_path)
+            return D
+        
+        D = asyncio.run(job())
+        self.assertEqual(set(D.dlc_sections), {"PAL", "SPR", "CEL", "XLS", "AMF", "APL", "LPS", "SEQ", "MTR"})
+        with open(output_path, "rb") as f:
+            self.assertEqual(f.read(), self.original)
+    
+    def test_concurrent_jobs_are_limited(self):
+        """Test that no more than max_jobs run on the executor at once"""
+        import asyncio
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from furby import AsyncJobs
+        
+        state = {"running" : 0, "peak" : 0}
+        lock = threading.Lock()
+        
+        class CountingExecutor(ThreadPoolExecutor):
+            def submit(self, fn, *args, **kwargs):
+                def counted():
+                    with lock:
+                        state["running"] += 1
+                        state["peak"] = max(state["peak"], state["running"])
+                    try:
+                        return fn(*args, **kwargs)
+                    finally:
+                        with lock:
+                            state["running"] -= 1
+                return ThreadPoolExecutor.submit(self, counted)
+        
+        with CountingExecutor(max_workers=8) as executor:
+            jobs = AsyncJobs(max_jobs=2, executor=executor)
+            
+            async def main():
+                return await asyncio.gather(*[dlc.aopen(self.test_dlc_path, jobs=jobs) for _ in range(5)])
+            
+            loaded = asyncio.run(main())
+        
+        self.assertEqual(len(loaded), 5)
+        self.assertLessEqual(state["peak"], 2)
+    
+    def test_build_to_stream_writer(self):
+        """Test that abuild streams into an asyncio StreamWriter, draining as it goes"""
+        import asyncio
+        
+        class FakeStreamWriter(object):
+            def __init__(self):
+                self.chunks = []
+                self.drains = 0
+            def write(self, data):
+                self.chunks.append(bytes(data))
+            async def drain(self):
+                self.drains += 1
+        
+        writer = FakeStreamWriter()
+        
+        async def job():
+            D = await dlc.aopen(self.test_dlc_path)
+            await D.abuild(writer)
+        
+        asyncio.run(job())
+        self.assertEqual(b"".join(writer.chunks), self.original)
+        self.assertEqual(writer.drains, len(writer.chunks))
+        self.assertGreater(len(writer.chunks), 9)
+
+
+class TestBuildServer(unittest.TestCase):
+    """Test the local build server"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        import build_server
+        self.build_server = build_server
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        self.templates = build_server.TemplateCache({"tu003410" : self.test_dlc_path})
+        self.templates.warm()
+    
+    def serve(self, **kwargs):
+        import threading
+        server = self.build_server.make_server(self.templates, ("127.0.0.1", 0), **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+    
+    def post(self, connection, job):
+        import json
+        connection.request("POST", "/build", json.dumps(job), {"Content-Type" : "application/json"})
+        response = connection.getresponse()
+        return response.status, response.read()
+    
+    def test_build_job(self):
+        """Test that a job's DLC matches making the same edits locally, and the template is untouched"""
+        import io
+        import http.client
+        server = self.serve()
+        connection = http.client.HTTPConnection(*server.server_address)
+        status, body = self.post(connection, {"template" : "tu003410", "edits" : [
+            {"op" : "trim_track", "track" : 3, "end" : 10},
+            {"op" : "copy_cel", "from" : 17, "to" : 1},
+        ]})
+        self.assertEqual(status, 200)
+        
+        D = dlc(self.test_dlc_path)
+        amf = D.dlc_sections["AMF"]
+        amf.tracks[3] = amf.trim_track(amf.tracks[3], 0, 10)
+        D.dlc_sections["CEL"].cels[1] = [row[:] for row in D.dlc_sections["CEL"].cels[17]]
+        expected = io.BytesIO()
+        D.build(expected)
+        self.assertEqual(body, expected.getvalue())
+        
+        status, body = self.post(connection, {"template" : "tu003410", "edits" : []})
+        with open(self.test_dlc_path, "rb") as f:
+            self.assertEqual(body, f.read())
+    
+    def test_bad_jobs(self):
+        """Test that unknown templates and edits, and busy servers, are refused"""
+        import json
+        import http.client
+        server = self.serve(max_jobs=1, queue_timeout=0.01)
+        connection = http.client.HTTPConnection(*server.server_address)
+        status, body = self.post(connection, {"template" : "nope"})
+        self.assertEqual(status, 400)
+        self.assertIn("nope", json.loads(body)["error"])
+        status, body = self.post(connection, {"template" : "tu003410", "edits" : [{"op" : "trim_track", "track" : 10000}]})
+        self.assertEqual(status, 400)
+        
+        server.jobs.acquire()
+        try:
+            status, body = self.post(connection, {"template" : "tu003410"})
+            # A busy server refuses a job without waiting for its body
+            waiting = http.client.HTTPConnection(*server.server_address, timeout=5)
+            waiting.putrequest("POST", "/build")
+            waiting.putheader("Content-Length", "100")
+            waiting.endheaders()
+            self.assertEqual(waiting.getresponse().status, 503)
+            waiting.close()
+        finally:
+            server.jobs.release()
+        self.assertEqual(status, 503)
+        
+        for length in ["-1", "ten"]:
+            connection.putrequest("POST", "/build")
+            connection.putheader("Content-Length", length)
+            connection.endheaders()
+            response = connection.getresponse()
+            response.read()
+            self.assertEqual(response.status, 400)
+            connection.close()
+        status, body = self.post(connection, [])
+        self.assertEqual(status, 400)
+    
+    def test_template_cache_and_unix_socket(self):
+        """Test the template cache limit, and serving over a UNIX socket"""
+        import json
+        import socket
+        import http.client
+        if not hasattr(socket, "AF_UNIX"):
+            self.skipTest("No UNIX sockets")
+        
+        cache = self.build_server.TemplateCache({"a" : self.test_dlc_path, "b" : self.test_dlc_path}, max_templates=1)
+        first = cache.get("a")
+        self.assertIs(cache.get("a"), first)
+        cache.get("b")
+        self.assertEqual(list(cache.loaded), ["b"])
+        
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        socket_path = os.path.join(temp_dir, "build.sock")
+        self.serve(socket_path=socket_path)
+        
+        class UnixConnection(http.client.HTTPConnection):
+            def connect(self):
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(socket_path)
+        
+        connection = UnixConnection("localhost")
+        connection.request("GET", "/templates")
+        self.assertEqual(json.loads(connection.getresponse().read())["templates"], ["tu003410"])
+        status, body = self.post(connection, {"template" : "tu003410"})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body), os.path.getsize(self.test_dlc_path))
+
+
+    def test_assets_directory(self):
+        """Test that jobs can only read files from the assets directory"""
+        import base64
+        import json
+        import http.client
+        a18_path = os.path.abspath("./audio/new_audio/darkside_wav.a18")
+        if not os.path.exists(a18_path):
+            self.skipTest("Test a18 file not found")
+        assets = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, assets)
+        shutil.copy(a18_path, os.path.join(assets, "hello.a18"))
+        os.symlink(a18_path, os.path.join(assets, "escape.a18"))
+        
+        server = self.serve(assets=assets)
+        connection = http.client.HTTPConnection(*server.server_address)
+        status, body = self.post(connection, {"template" : "tu003410", "edits" : [
+            {"op" : "replace_track", "track" : 3, "files" : ["hello.a18"]}]})
+        self.assertEqual(status, 200)
+        for path in [os.path.relpath(a18_path, assets), a18_path, "escape.a18"]:
+            status, body = self.post(connection, {"template" : "tu003410", "edits" : [
+                {"op" : "replace_track", "track" : 3, "files" : [path]}]})
+            self.assertEqual(status, 400, path)
+        status, body = self.post(connection, {"template" : "tu003410", "edits" : [
+            {"op" : "replace_cels", "image" : "/etc/passwd"}]})
+        self.assertEqual(status, 400)
+        self.assertIn("outside", json.loads(body)["error"])
+        
+        server = self.serve()
+        connection = http.client.HTTPConnection(*server.server_address)
+        status, body = self.post(connection, {"template" : "tu003410", "edits" : [
+            {"op" : "replace_track", "track" : 3, "files" : ["hello.a18"]}]})
+        self.assertEqual(status, 400)
+        with open(a18_path, "rb") as f:
+            inline = base64.b64encode(f.read()).decode("ascii")
+        status, body = self.post(connection, {"template" : "tu003410", "edits" : [
+            {"op" : "replace_track", "track" : 3, "a18_base64" : [inline]}]})
+        self.assertEqual(status, 200)
+    
+    def test_invalid_audio(self):
+        """Test that malformed a18 files and action codes get a 400, not a dropped connection"""
+        import base64
+        import json
+        import http.client
+        server = self.serve()
+        connection = http.client.HTTPConnection(*server.server_address)
+        bad = [b"", b"\x10\x00", struct.pack("<IH", 1000, 16000) + bytes(40), struct.pack("<IH", 44, 16000) + bytes(42)]
+        for data in bad:
+            for op in ("replace_audio", "replace_track"):
+                edit = {"op" : op, "action_code" : [75, 0, 0, 0], "track" : 3, "a18_base64" : [base64.b64encode(data).decode("ascii")]}
+                status, body = self.post(connection, {"template" : "tu003410", "edits" : [edit]})
+                self.assertEqual(status, 400, (op, data))
+                self.assertIn("a18_base64[0]", json.loads(body)["error"])
+        status, body = self.post(connection, {"template" : "tu003410", "edits" : [
+            {"op" : "replace_audio", "action_code" : [75, 0, 0], "a18_base64" : [base64.b64encode(struct.pack("<IH", 42, 16000) + bytes(40)).decode("ascii")]}]})
+        self.assertEqual(status, 400)
+    
+    def test_template_loads_outside_lock(self):
+        """Test that parsing a template doesn't hold up other templates, and is done once"""
+        import threading
+        cache = self.build_server.TemplateCache({"slow" : self.test_dlc_path, "warm" : self.test_dlc_path})
+        warm = cache.get("warm")
+        started = threading.Event()
+        release = threading.Event()
+        loads = []
+        
+        def slow_dlc(path):
+            loads.append(path)
+            started.set()
+            release.wait(10)
+            return warm
+        self.build_server.dlc = slow_dlc
+        self.addCleanup(setattr, self.build_server, "dlc", dlc)
+        
+        results = []
+        loaders = [threading.Thread(target=lambda: results.append(cache.get("slow"))) for _ in range(2)]
+        for thread in loaders:
+            thread.start()
+        self.assertTrue(started.wait(10))
+        other = threading.Thread(target=lambda: results.append(cache.get("warm")))
+        other.start()
+        other.join(5)
+        self.assertFalse(other.is_alive())
+        release.set()
+        for thread in loaders:
+            thread.join(10)
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(results, [warm] * 3)
+
+
+class TestClone(unittest.TestCase):
+    """Test copy-on-write cloning"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        with open(self.test_dlc_path, "rb") as f:
+            self.original = f.read()
+        self.D = dlc(self.test_dlc_path)
+    
+    def build_bytes(self, D):
+        import io
+        output = io.BytesIO()
+        D.build(output)
+        return output.getvalue()
+    
+    def test_edits_stay_in_their_clone(self):
+        """Test that edits to a clone or its original don't show up in the other"""
+        clone = self.D.clone()
+        clone.dlc_sections["CEL"].cels[1][0][0] = 5
+        clone.dlc_sections["SEQ"].sequences[15][3] = 0x8401
+        clone.dlc_sections["AMF"].tracks[3] = clone.dlc_sections["AMF"].trim_track(clone.dlc_sections["AMF"].tracks[3], 0, 10)
+        self.D.dlc_sections["SPR"].frames[0][0] = 2
+        
+        self.assertNotEqual(self.D.dlc_sections["CEL"].cels[1][0][0], 5)
+        self.assertNotEqual(self.D.dlc_sections["SEQ"].sequences[15][3], 0x8401)
+        self.assertNotEqual(clone.dlc_sections["SPR"].frames[0][0], 2)
+        
+        other = self.D.clone()
+        self.assertEqual(other.dlc_sections["SPR"].frames[0][0], 2)
+        other.dlc_sections["SPR"].frames[0][0] = 0
+        self.assertEqual(self.D.dlc_sections["SPR"].frames[0][0], 2)
+        self.assertNotEqual(self.build_bytes(clone), self.original)
+        self.assertEqual(self.build_bytes(other), self.original)
+    
+    def test_untouched_data_is_shared(self):
+        """Test that clones share untouched sections, and cels until they're used"""
+        from furby import CopyOnWriteList
+        clones = [self.D.clone() for _ in range(100)]
+        clone = clones[0]
+        for name in self.D.dlc_sections:
+            self.assertIs(clone.dlc_sections.peek(name), clones[1].dlc_sections.peek(name))
+        
+        cels = clone.dlc_sections["CEL"].cels
+        self.assertIsInstance(cels, CopyOnWriteList)
+        self.assertIsNot(clone.dlc_sections.peek("CEL"), clones[1].dlc_sections.peek("CEL"))
+        self.assertIs(list.__getitem__(cels, 5), self.D.dlc_sections.peek("CEL").cels[5])
+        cels[3][0][0] = 7
+        self.assertIsNot(list.__getitem__(cels, 3), self.D.dlc_sections.peek("CEL").cels[3])
+        self.assertIs(list.__getitem__(cels, 5), self.D.dlc_sections.peek("CEL").cels[5])
+        scaled = cels * 2
+        scaled[5][0][0] = 9
+        self.assertNotEqual(self.D.dlc_sections["CEL"].cels[5][0][0], 9)
+        self.assertEqual(self.build_bytes(clones[-1]), self.original)
+    
+    def test_held_sections(self):
+        """Test that sections held from before a clone stay with the original"""
+        amf = self.D.dlc_sections["AMF"]
+        cel_section = self.D.dlc_sections["CEL"]
+        cel = cel_section.cels[1]
+        clone = self.D.clone()
+        self.assertIsNot(clone.dlc_sections.peek("AMF"), amf)
+        self.assertIs(clone.dlc_sections.peek("SPR"), self.D.dlc_sections.peek("SPR"))
+        
+        amf.tracks[3] = amf.trim_track(amf.tracks[3], 0, 10)
+        cel_section.cels[2][0][0] = 5
+        cel[0][0] = 6
+        self.assertIs(self.D.dlc_sections["AMF"], amf)
+        self.assertIs(self.D.dlc_sections["CEL"].cels[1], cel)
+        self.assertEqual(self.D.dlc_sections["CEL"].cels[2][0][0], 5)
+        self.assertEqual(self.build_bytes(clone), self.original)
+        self.assertNotEqual(clone.dlc_sections["AMF"].tracks[3], amf.tracks[3])
+        
+        clone.dlc_sections["CEL"].cels[1][0][0] = 7
+        self.assertEqual(cel[0][0], 6)
+    
+    def test_concurrent_builds(self):
+        """Test that clones sharing sections can be built on several threads at once"""
+        from concurrent.futures import ThreadPoolExecutor
+        clones = [self.D.clone() for _ in range(8)]
+        clones[0].dlc_sections["XLS"].action_tree[1]["entries"]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            built = list(pool.map(self.build_bytes, clones))
+        self.assertTrue(all(b == self.original for b in built))
+
+
+class TestEditJournal(unittest.TestCase):
+    """Test the edit journal and incremental builds"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(self.test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        with open(self.test_dlc_path, "rb") as f:
+            self.original = f.read()
+        self.D = dlc(self.test_dlc_path)
+        self.journal = self.D.start_journal()
+    
+    def build_bytes(self, D):
+        import io
+        output = io.BytesIO()
+        D.build(output)
+        return output.getvalue()
+    
+    def edit_cel(self):
+        cel = self.D.dlc_sections["CEL"].cels[3]
+        cel[0][0] = (cel[0][0] + 1) % 64
+    
+    def test_undo_and_redo(self):
+        """Test that edits are recorded with what they touched, and can be undone and redone"""
+        with self.journal.edit("eye colour"):
+            self.edit_cel()
+        with self.journal.edit("sequence"):
+            self.D.dlc_sections["SEQ"].sequences[4][3] = 0x8401
+        with self.journal.edit("look only"):
+            self.D.dlc_sections["APL"].playlists[0]
+        
+        self.assertEqual([e.label for e in self.journal.undo_stack], ["eye colour", "sequence"])
+        self.assertEqual(self.journal.undo_stack[0].changes, {"CEL" : {3}})
+        self.assertEqual(self.journal.touched(), {"CEL" : {3}, "SEQ" : {4}})
+        edited = self.build_bytes(self.D)
+        
+        self.assertEqual(self.journal.undo().label, "sequence")
+        self.journal.undo()
+        self.assertIsNone(self.journal.undo())
+        self.assertEqual(self.build_bytes(self.D), self.original)
+        self.journal.redo()
+        self.journal.redo()
+        self.assertEqual(self.build_bytes(self.D), edited)
+    
+    def test_failed_edit_rolls_back(self):
+        """Test that an edit that raises leaves the DLC as it was"""
+        with self.assertRaises(ValueError):
+            with self.journal.edit("bad"):
+                self.D.dlc_sections["AMF"].tracks.clear()
+                self.edit_cel()
+                raise ValueError("oops")
+        self.assertEqual(len(self.D.dlc_sections["AMF"].tracks), 146)
+        self.assertEqual(self.journal.undo_stack, [])
+        self.assertEqual(self.journal.touched(), {})
+        self.assertEqual(self.build_bytes(self.D), self.original)
+    
+    def test_held_sections(self):
+        """Test that edits through sections held from before an edit are rolled back, and undone"""
+        seq = self.D.dlc_sections["SEQ"]
+        old = seq.sequences[4][3]
+        with self.assertRaises(ValueError):
+            with self.journal.edit("bad"):
+                seq.sequences[4][3] = 0xe001
+                raise ValueError("oops")
+        self.assertEqual(self.D.dlc_sections["SEQ"].sequences[4][3], old)
+        self.assertEqual(self.build_bytes(self.D), self.original)
+        
+        seq = self.D.dlc_sections["SEQ"]
+        with self.journal.edit("held"):
+            seq.sequences[4][3] = 0xe001
+        self.assertEqual(self.journal.undo_stack[-1].changes, {"SEQ" : {4}})
+        self.assertEqual(self.journal.undo().label, "held")
+        self.assertEqual(self.D.dlc_sections["SEQ"].sequences[4][3], old)
+        self.assertEqual(self.build_bytes(self.D), self.original)
+        self.journal.redo()
+        self.assertEqual(self.D.dlc_sections["SEQ"].sequences[4][3], 0xe001)
+    
+    def test_incremental_build(self):
+        """Test that builds after an edit only recompile what changed, and match a full build"""
+        from furby import SpanRecorder
+        self.build_bytes(self.D)
+        with self.journal.edit():
+            self.edit_cel()
+        recorder = SpanRecorder()
+        self.D.profiler = recorder
+        incremental = self.build_bytes(self.D)
+        
+        compiled = {s.section for s in recorder.spans if s.stage == "compile"}
+        reused = {s.section for s in recorder.spans if s.stage == "reuse"}
+        self.assertEqual(compiled, {"CEL"})
+        self.assertEqual(reused, set(self.D.dlc_sections) - {"CEL"})
+        
+        full = dlc(self.test_dlc_path)
+        cel = full.dlc_sections["CEL"].cels[3]
+        cel[0][0] = (cel[0][0] + 1) % 64
+        self.assertEqual(incremental, self.build_bytes(full))
+        self.assertEqual(self.journal.touched(), {})
+    
+    def test_held_references(self):
+        """Test that incremental builds see edits made in place through references held across builds"""
+        self.build_bytes(self.D)
+        cel = self.D.dlc_sections["CEL"].cels[0]
+        sequences = self.D.dlc_sections["SEQ"].sequences
+        self.assertEqual(self.build_bytes(self.D), self.original)
+        cel[0][0] = (cel[0][0] + 1) % 64
+        sequences[4][3] = 0x8401
+        incremental = self.build_bytes(self.D)
+        
+        full = dlc(self.test_dlc_path)
+        full.dlc_sections["CEL"].cels[0][0][0] = cel[0][0]
+        full.dlc_sections["SEQ"].sequences[4][3] = 0x8401
+        self.assertEqual(incremental, self.build_bytes(full))
+
+
+class TestImportTime(unittest.TestCase):
+    """Test that importing furby stays cheap"""
+    
+    def setUp(self):
+        """Set up test fixtures"""
+        import benchmark_dlc
+        self.benchmark_dlc = benchmark_dlc
+    
+    def test_no_heavy_modules(self):
+        """Test that importing furby doesn't load PIL, numpy or asyncio"""
+        result = self.benchmark_dlc.import_time(repeat=1)
+        self.assertEqual(result["heavy_modules"], [])
+    
+    def test_under_budget(self):
+        """Test that importing furby is within the benchmark's budget"""
+        result = self.benchmark_dlc.import_time(repeat=3)
+        self.assertLess(1000 * result["median_s"], self.benchmark_dlc.IMPORT_BUDGET_MS)
+    
+    def test_imaging_loads_pil(self):
+        """Test that the imaging helpers still work with PIL imported on first use"""
+        test_dlc_path = "./dlc/dlc2/tu003410.dlc"
+        if not os.path.exists(test_dlc_path):
+            self.skipTest("Test DLC file not found")
+        D = dlc(test_dlc_path)
+        temp_dir = tempfile.mkdtemp()
+        try:
+            output_path = os.path.join(temp_dir, "cel.png")
+            D.draw_cel(0, 1, output_path)
+            self.assertTrue(os.path.exists(output_path))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
 class TestErrorHandling(unittest.TestCase):
     """Test error handling and edge cases"""
     